@@ -0,0 +1,73 @@
+import re
+from hashlib import blake2b
+
+from app.config import ACCOUNT_VERIFY_CHECKSUM
+
+ALPHABET = '13456789abcdefghijkmnopqrstuwxyz'
+PREFIXES = ('xrb_', 'nano_')
+# Existing subscriptions are stored with xrb_ so both prefixes normalise to it
+CANONICAL_PREFIX = 'xrb_'
+
+# 52 characters of public key (4 bits of padding make the first one 1 or 3) followed by an 8 character checksum
+_ACCOUNT = f'(?:xrb|nano)_[13][{ALPHABET}]{{59}}'
+account_regex = re.compile(rf'{_ACCOUNT}\Z')
+_accounts_regex = re.compile(f'^{_ACCOUNT}$', re.MULTILINE)
+_DECODE = {character: value for value, character in enumerate(ALPHABET)}
+
+
+def normalize(account):
+    """Return the canonical form of an account: stripped, lowercase and with the xrb_ prefix."""
+    if not isinstance(account, str):
+        return account
+    account = account.strip().lower()
+    if account.startswith('nano_'):
+        account = CANONICAL_PREFIX + account[len('nano_'):]
+    return account
+
+
+def is_valid(account, verify_checksum=None):
+    """Validate an account which has already been normalised."""
+    if not isinstance(account, str) or not account_regex.fullmatch(account):
+        return False
+    return checksum_valid(account) if _verify(verify_checksum) else True
+
+
+def validate_many(accounts, verify_checksum=None):
+    """Normalise and validate accounts in bulk, returning (valid, invalid) lists in their original order.
+
+    The normalised accounts are matched with a single regex scan over them all rather than one match per account.
+    """
+    normalized = [normalize(account) for account in accounts]
+    strings = [account for account in normalized if isinstance(account, str)]
+    matched = set(_accounts_regex.findall('\n'.join(strings)))
+    if _verify(verify_checksum):
+        matched = {account for account in matched if checksum_valid(account)}
+    valid, invalid = [], []
+    for original, account in zip(accounts, normalized):
+        if account in matched:
+            valid.append(account)
+        else:
+            invalid.append(original)
+    return valid, invalid
+
+
+def public_key(account):
+    encoded = account.split('_', 1)[1][:52]
+    return _decode(encoded).to_bytes(33, 'big')[1:]
+
+
+def checksum_valid(account):
+    encoded = account.split('_', 1)[1]
+    checksum = blake2b(public_key(account), digest_size=5).digest()[::-1]
+    return _decode(encoded[52:]).to_bytes(5, 'big') == checksum
+
+
+def _decode(encoded):
+    value = 0
+    for character in encoded:
+        value = value << 5 | _DECODE[character]
+    return value
+
+
+def _verify(verify_checksum):
+    return ACCOUNT_VERIFY_CHECKSUM if verify_checksum is None else verify_checksum
@@ -0,0 +1,471 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, parse_qs
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from werkzeug.http import parse_etags
+
+from app import accounts, compression, feed, ratelimit, transactions
+from app.config import NANO_HOST, NANO_PORT, NODE_CONNECT_TIMEOUT, NODE_READ_TIMEOUT, NODE_RETRIES, \
+    NODE_RETRY_BACKOFF, NODE_BREAKER_THRESHOLD, NODE_BREAKER_RESET, ASYNC_NODE_POOL_SIZE, ASYNC_WSGI_THREADS, \
+    ASYNC_DB_THREADS, RECAPTCHA_SECRET, FEED_HEARTBEAT_INTERVAL, FEED_LONG_POLL_TIMEOUT, \
+    HISTORY_MAX_COUNT, TRANSACTION_SYNC_MAX_AGE, ASYNC_HTTP_MAX_RESPONSE_SIZE
+from app.database import db_session
+from app.history import history_cache
+from app.metrics import node_rpc_duration, node_rpc_errors, request_duration
+from app.node import CircuitBreaker, NodeError, IDEMPOTENT_ACTIONS
+from app.routes import RECAPTCHA_VERIFY_URL, RECAPTCHA_VERIFIED_ENVIRON, RATE_LIMIT_CHECKED_ENVIRON, \
+    InvalidBatchRequest, _is_invalid_account, _parse_batch_request, _batch_cost, _add_mobile_subscription, \
+    older_than, history_etag
+
+logger = logging.getLogger(__name__)
+
+IMPORT_PATHS = ('/mobile/subscribe/import', '/subscribe/import')
+# Scope key of the environ entries added for the Flask application
+SCOPE_ENVIRON = 'nanotify.environ'
+
+
+class AsyncResponse:
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+
+class ResponseTooLarge(ValueError):
+    pass
+
+
+class AsyncHTTPClient:
+    """httpx client with a keep-alive connection pool which reads at most ``max_size`` bytes of a response body."""
+
+    def __init__(self, pool_size=ASYNC_NODE_POOL_SIZE, connect_timeout=NODE_CONNECT_TIMEOUT,
+                 read_timeout=NODE_READ_TIMEOUT, max_size=ASYNC_HTTP_MAX_RESPONSE_SIZE):
+        self.max_size = max_size
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+
+    async def post(self, url, body, content_type='application/json'):
+        return await self.request('POST', url, body, {'Content-Type': content_type})
+
+    async def request(self, method, url, body=b'', headers=None):
+        async with self._client.stream(method, url, content=body, headers=headers) as response:
+            length = response.headers.get('content-length', '')
+            if length.isdigit() and int(length) > self.max_size:
+                raise ResponseTooLarge(f'{url} sent a {length} byte response')
+            data = bytearray()
+            async for chunk in response.aiter_bytes():
+                data += chunk
+                if len(data) > self.max_size:
+                    raise ResponseTooLarge(f'{url} sent a response over {self.max_size} bytes')
+            return AsyncResponse(response.status_code, dict(response.headers), bytes(data))
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class AsyncNodeClient:
+
+    def __init__(self, url, http=None, retries=NODE_RETRIES, backoff=NODE_RETRY_BACKOFF, breaker=None):
+        self.url = url
+        self.http = http or AsyncHTTPClient()
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(NODE_BREAKER_THRESHOLD, NODE_BREAKER_RESET)
+
+    async def call(self, action, **params):
+        self.breaker.before_call()
+        data = json.dumps(dict(params, action=action)).encode()
+        attempts = 1 + (self.retries if action in IDEMPOTENT_ACTIONS else 0)
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            try:
+                response = await self.http.post(self.url, data)
+                if response.status >= 400:
+                    raise NodeError(f'Node responded {response.status} to {action}')
+                result = response.json()
+            except (OSError, httpx.HTTPError, ValueError, NodeError) as e:
+                node_rpc_duration.observe(time.perf_counter() - start, action=action)
+                node_rpc_errors.inc(action=action)
+                if attempt + 1 == attempts:
+                    self.breaker.record_failure()
+                    if isinstance(e, NodeError):
+                        raise
+                    raise NodeError(f'{action} failed: {e!r}') from e
+                delay = self.backoff * 2 ** attempt
+                logger.info(f'Retrying {action} in {delay}s after {e!r}')
+                await asyncio.sleep(delay)
+            else:
+                node_rpc_duration.observe(time.perf_counter() - start, action=action)
+                self.breaker.record_success()
+                return result
+
+    async def account_history(self, account, count=10, head=None):
+        params = {'account': account, 'count': count}
+        if head:
+            params['head'] = head
+        return (await self.call('account_history', **params)).get('history', [])
+
+    async def close(self):
+        await self.http.close()
+
+
+class AsyncSession:
+    """Runs work against ``app.database.db_session`` on a bounded thread pool so the event loop never blocks."""
+
+    def __init__(self, session=db_session, max_workers=ASYNC_DB_THREADS):
+        self._session = session
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def run(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._call, fn, args)
+
+    def _call(self, fn, args):
+        try:
+            result = fn(*args)
+            self._session.commit()
+            return result
+        except BaseException:
+            self._session.rollback()
+            raise
+        finally:
+            self._session.remove()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+async def account_history(node, db, account, count=10, head=None):
+    return await history_cache.get_or_load_async(
+        (account, count, head), lambda: _load_history(node, db, account, count, head))
+
+
+async def _load_history(node, db, account, count, head):
+    history = await transactions.history_async(node, db, account, count, head, max_age=TRANSACTION_SYNC_MAX_AGE)
+    await db.run(transactions.mark_viewed, account)
+    return history
+
+
+async def accounts_history(node, db, accounts, count=10, heads=None):
+    heads = heads or {}
+    histories = await asyncio.gather(*[account_history(node, db, account, count, heads.get(account))
+                                       for account in accounts])
+    return dict(zip(accounts, histories))
+
+
+async def verify_recaptcha(http, response, remoteip):
+    data = urlencode({'secret': RECAPTCHA_SECRET, 'response': response or '', 'remoteip': remoteip or ''})
+    result = await http.post(RECAPTCHA_VERIFY_URL, data.encode(), 'application/x-www-form-urlencoded')
+    return bool(result.json().get('success'))
+
+
+class NanoAsgi:
+    """ASGI application serving the ``nano`` blueprint without blocking on I/O.
+
+    Node bound routes, the live transaction feed (which only this mode serves) and ``/mobile/subscribe`` are
+    served natively on the event loop, so an open feed costs no thread. Every other
+    route is handed to the Flask application through a2wsgi's bounded thread pool, with the reCAPTCHA for
+    ``/register`` verified asynchronously beforehand.
+    """
+
+    def __init__(self, wsgi_app, node=None, db=None, http=None, wsgi_threads=ASYNC_WSGI_THREADS, feed_hub=None,
+                 heartbeat=FEED_HEARTBEAT_INTERVAL):
+        self.wsgi_app = wsgi_app
+        self.wsgi = WSGIMiddleware(_with_scope_environ(wsgi_app), workers=wsgi_threads)
+        self.http = http or AsyncHTTPClient()
+        self.node = node or AsyncNodeClient(f'http://{NANO_HOST}:{NANO_PORT}')
+        self.db = db or AsyncSession()
+        self.feed = feed_hub or feed.hub
+        self.heartbeat = heartbeat
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        method, path = scope['method'], scope['path']
+        if method == 'GET' and path.startswith('/transactions/') and '/' not in path[len('/transactions/'):]:
+            return await self._native('profile.get_transactions', method, send,
+                                      self._get_transactions, scope, path[len('/transactions/'):])
+        if method == 'GET' and _feed_account(path, '/events') is not None:
+            # Not timed with the other native routes as the response lasts as long as the client stays connected
+            return await self._stream_transactions(scope, receive, send, _feed_account(path, '/events'))
+        if method == 'GET' and _feed_account(path, '/poll') is not None:
+            return await self._poll_transactions(scope, receive, send, _feed_account(path, '/poll'))
+        if method == 'POST' and path == '/transactions':
+            return await self._native('profile.get_transactions_batch', method, send,
+                                      self._get_transactions_batch, scope, await _read_body(receive))
+        if method == 'POST' and path == '/mobile/subscribe':
+            return await self._native('profile.mobile_subscribe', method, send,
+                                      self._mobile_subscribe, scope, await _read_body(receive))
+        environ = {}
+        if method == 'POST' and path in IMPORT_PATHS:
+            # Turned away before an import's body, which may hold thousands of accounts, is read
+            wait = await self._rate_limit(scope, 'import', None)
+            if wait:
+                return await _respond_limited(send, wait)
+            environ[RATE_LIMIT_CHECKED_ENVIRON] = 'import'
+        if method == 'POST' and path == '/register' and RECAPTCHA_SECRET:
+            body = await _read_body(receive)
+            environ[RECAPTCHA_VERIFIED_ENVIRON] = await self._verify_recaptcha(scope, body)
+            receive = _replay(body, receive)
+        await self.wsgi(dict(scope, **{SCOPE_ENVIRON: environ}), receive, send)
+
+    async def close(self):
+        await self.node.close()
+        await self.http.close()
+        self.db.close()
+        self.wsgi.executor.shutdown(wait=False)
+
+    async def _native(self, endpoint, method, send, handler, *args):
+        start = time.perf_counter()
+        status = []
+
+        async def send_and_record(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            await send(message)
+
+        try:
+            await handler(*args, send_and_record)
+        except NodeError as e:
+            logger.exception(str(e))
+            await _respond(send_and_record, 500)
+        finally:
+            request_duration.observe(time.perf_counter() - start, endpoint=endpoint, method=method,
+                                     status=status[0] if status else 500)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _get_transactions(self, scope, account, send):
+        account = accounts.normalize(account)
+        wait = await self._rate_limit(scope, 'transactions', None)
+        if wait:
+            return await _respond_limited(send, wait)
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        before = query.get('before', [None])[0]
+        try:
+            count = int(query.get('count', [10])[0])
+        except ValueError:
+            count = 0
+        if _is_invalid_account(account) or not 0 < count <= HISTORY_MAX_COUNT:
+            return await _respond(send, 400)
+        if before:
+            history = older_than(await account_history(self.node, self.db, account, count + 1, before), before)
+        else:
+            history = await account_history(self.node, self.db, account, count)
+        etag = history_etag(history, count)
+        headers = [(b'etag', f'W/"{etag}"'.encode()), (b'cache-control', b'no-cache')]
+        if_none_match = dict(scope['headers']).get(b'if-none-match')
+        if if_none_match and parse_etags(if_none_match.decode('latin-1')).contains_weak(etag):
+            return await _respond(send, 304, headers=headers)
+        await _respond_compressed(scope, send, json.dumps(history).encode(), headers)
+
+    async def _get_transactions_batch(self, scope, body, send):
+        data = _json_or_none(body)
+        wait = await self._rate_limit(scope, 'transactions', None, _batch_cost(data))
+        if wait:
+            return await _respond_limited(send, wait)
+        try:
+            accounts, count, heads = _parse_batch_request(data)
+        except InvalidBatchRequest as e:
+            return await _respond(send, 400, json.dumps({'invalid': e.invalid}).encode() if e.invalid else b'')
+        histories = await accounts_history(self.node, self.db, accounts, count, heads)
+        await _respond_compressed(scope, send, json.dumps(histories).encode())
+
+    async def _stream_transactions(self, scope, receive, send, account):
+        account = accounts.normalize(account)
+        if _is_invalid_account(account):
+            return await _respond(send, 400)
+        last_event_id = dict(scope['headers']).get(b'last-event-id')
+        head = last_event_id.decode('latin-1') if last_event_id else None
+        watcher = await self._watch(scope, send, account, head)
+        if watcher is None:
+            return
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', feed.EVENT_STREAM.encode()), (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')]})
+            await _send_event(send, f'retry: {int(self.feed.interval * 1000)}\n\n')
+            while True:
+                history = asyncio.ensure_future(watcher.next_async(self.heartbeat))
+                await asyncio.wait([history, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    history.cancel()
+                    return
+                await _send_event(send, feed.KEEPALIVE if history.result() is None else feed.event(history.result()))
+        finally:
+            disconnected.cancel()
+            self.feed.unwatch(watcher)
+
+    async def _poll_transactions(self, scope, receive, send, account):
+        # Long poll: answers as soon as the head differs from the client's ``head``, or with 204 after ``timeout``
+        account = accounts.normalize(account)
+        if _is_invalid_account(account):
+            return await _respond(send, 400)
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        try:
+            timeout = min(float(query.get('timeout', [FEED_LONG_POLL_TIMEOUT])[0]), FEED_LONG_POLL_TIMEOUT)
+        except ValueError:
+            timeout = FEED_LONG_POLL_TIMEOUT
+        watcher = await self._watch(scope, send, account, query.get('head', [None])[0])
+        if watcher is None:
+            return
+        history = asyncio.ensure_future(watcher.next_async(timeout))
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            await asyncio.wait([history, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                return
+            if history.result() is None:
+                return await _respond(send, 204)
+            await _respond_compressed(scope, send, json.dumps(history.result()).encode())
+        finally:
+            history.cancel()
+            disconnected.cancel()
+            self.feed.unwatch(watcher)
+
+    async def _watch(self, scope, send, account, head):
+        """Watch ``account`` for the client, or respond and return ``None`` when it is limited or the feed is full."""
+        wait = await self._rate_limit(scope, 'transactions', None)
+        if wait:
+            return await _respond_limited(send, wait)
+        try:
+            return self.feed.watch(feed.AsyncWatcher(account, head, client=_client_ip(scope)))
+        except feed.TooManyWatches:
+            # The client gets a watch back once one of its feeds ends, which a long poll does within its timeout
+            return await _respond_limited(send, FEED_LONG_POLL_TIMEOUT)
+        except feed.FeedFull:
+            logger.warning(f'Feed is full, refused to watch {account}')
+            retry_after = ratelimit.retry_after(FEED_LONG_POLL_TIMEOUT).encode()
+            return await _respond(send, 503, headers=[(b'retry-after', retry_after)])
+
+    async def _mobile_subscribe(self, scope, body, send):
+        content_type = dict(scope['headers']).get(b'content-type', b'')
+        data = _json_or_none(body) if content_type.startswith(b'application/json') else None
+        account = accounts.normalize(data.get('account')) if isinstance(data, dict) else None
+        wait = await self._rate_limit(scope, 'subscribe', None if _is_invalid_account(account) else account)
+        if wait:
+            return await _respond_limited(send, wait)
+        if _is_invalid_account(account):
+            logger.info(f'Invalid account {account}')
+            return await _respond(send, 400)
+        added = await self.db.run(_add_mobile_subscription, account)
+        await _respond(send, 201 if added else 409)
+
+    async def _rate_limit(self, scope, name, account, cost=1):
+        ip = _client_ip(scope)
+        if not ratelimit.limiter.store.blocking:
+            return ratelimit.limiter.check(name, ip=ip, account=account, cost=cost)
+        return await asyncio.get_event_loop().run_in_executor(
+            self.wsgi.executor, lambda: ratelimit.limiter.check(name, ip=ip, account=account, cost=cost))
+
+    async def _verify_recaptcha(self, scope, body):
+        form = parse_qs(body.decode('latin-1'))
+        client = scope.get('client') or (None,)
+        try:
+            return await verify_recaptcha(self.http, form.get('g-recaptcha-response', [None])[0], client[0])
+        except (OSError, httpx.HTTPError, ValueError) as e:
+            logger.exception(str(e))
+            return False
+
+
+def _client_ip(scope):
+    forwarded_for = dict(scope['headers']).get(b'x-forwarded-for')
+    return ratelimit.client_ip((scope.get('client') or (None,))[0],
+                               forwarded_for.decode('latin-1') if forwarded_for else None)
+
+
+def _json_or_none(body):
+    try:
+        return json.loads(body.decode()) if body else None
+    except ValueError:
+        return None
+
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+def _replay(body, receive):
+    """A ``receive`` which hands over a body already read from ``receive`` before carrying on with it."""
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def replayed():
+        return pending.pop() if pending else await receive()
+    return replayed
+
+
+def _with_scope_environ(wsgi_app):
+    # a2wsgi passes the scope on in the environ, which carries what the asyncio server already worked out about the
+    # request. Its input ends with the request body, as Flask otherwise ignores a body without a Content-Length.
+    # The a2wsgi releases which still run on Python 3.6 give SERVER_PORT as an int where WSGI has a string
+    def app(environ, start_response):
+        environ.update(environ['asgi.scope'].get(SCOPE_ENVIRON, {}))
+        environ['wsgi.input_terminated'] = True
+        environ['SERVER_PORT'] = str(environ['SERVER_PORT'])
+        return wsgi_app(environ, start_response)
+    return app
+
+
+def _feed_account(path, suffix):
+    """The account of a ``/transactions/<account><suffix>`` path, otherwise ``None``."""
+    if path.startswith('/transactions/') and path.endswith(suffix):
+        account = path[len('/transactions/'):-len(suffix)]
+        if account and '/' not in account:
+            return account
+    return None
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_event(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+
+async def _respond(send, status, body=b'', content_type='application/json', headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode()),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _respond_compressed(scope, send, body, headers=()):
+    accept_encoding = dict(scope['headers']).get(b'accept-encoding', b'').decode('latin-1')
+    body, encoding = compression.compress_body(body, accept_encoding)
+    headers = [*headers, (b'vary', b'Accept-Encoding')]
+    if encoding:
+        headers.append((b'content-encoding', encoding.encode()))
+    await _respond(send, 200, body, headers=headers)
+
+
+async def _respond_limited(send, wait):
+    await send({'type': 'http.response.start', 'status': 429,
+                'headers': [(b'content-length', b'0'), (b'retry-after', ratelimit.retry_after(wait).encode())]})
+    await send({'type': 'http.response.body', 'body': b''})
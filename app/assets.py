@@ -0,0 +1,35 @@
+import hashlib
+import os
+import threading
+
+from flask import current_app, url_for
+
+_fingerprints = {}
+_lock = threading.Lock()
+
+
+def fingerprint(static_folder, filename, reload=False):
+    """A short hash of a static file's content, computed once per process unless ``reload`` is set."""
+    path = os.path.join(static_folder, filename)
+    digest = None if reload else _fingerprints.get(path)
+    if digest is None:
+        try:
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        except OSError:
+            digest = ''
+        with _lock:
+            _fingerprints[path] = digest
+    return digest
+
+
+def static_url(filename):
+    """URL of a static file which changes with its content, so it can be cached by clients indefinitely."""
+    app = current_app
+    digest = fingerprint(app.static_folder, filename, reload=app.debug)
+    return url_for('static', filename=filename, v=digest) if digest else url_for('static', filename=filename)
+
+
+def is_fingerprinted(filename, version):
+    app = current_app
+    return bool(version) and version == fingerprint(app.static_folder, filename, reload=app.debug)
@@ -0,0 +1,112 @@
+import csv
+import json
+import uuid
+from collections import namedtuple
+
+from app import accounts
+from app.config import BULK_IMPORT_BATCH_SIZE, BULK_IMPORT_MAX_ACCOUNTS
+from app.database import db_session
+from app.models import Subscription
+from app.subscribers import mark_changed
+
+CSV = 'csv'
+JSON_LINES = 'jsonl'
+FORMATS = {
+    CSV: 'text/csv',
+    JSON_LINES: 'application/x-ndjson'
+}
+_MIMETYPES = {
+    'text/csv': CSV,
+    'application/x-ndjson': JSON_LINES,
+    'application/jsonl': JSON_LINES,
+    'application/x-jsonlines': JSON_LINES
+}
+
+ImportResult = namedtuple('ImportResult', ['imported', 'duplicates', 'invalid'])
+
+
+class TooManyAccounts(ValueError):
+    pass
+
+
+def format_for(mimetype, requested=None):
+    if requested:
+        return requested if requested in FORMATS else None
+    return _MIMETYPES.get(mimetype, CSV)
+
+
+def parse_accounts(lines, fmt):
+    """Yield the account on each line of a CSV or JSON lines stream, or None for lines which can't be read."""
+    text = (line.decode('utf-8', 'replace') if isinstance(line, bytes) else line for line in lines)
+    if fmt == CSV:
+        for row in csv.reader(text):
+            if row and row[0].strip() and row[0].strip().lower() != 'account':
+                yield row[0].strip()
+    else:
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield value.get('account') if isinstance(value, dict) else value if isinstance(value, str) else None
+
+
+def import_subscriptions(lines, email=None, batch_size=BULK_IMPORT_BATCH_SIZE, max_accounts=BULK_IMPORT_MAX_ACCOUNTS):
+    imported = duplicates = invalid = 0
+    seen = set()
+    for chunk in _chunks(lines, batch_size, max_accounts):
+        valid, rejected = accounts.validate_many(chunk)
+        invalid += len(rejected)
+        batch = []
+        for account in valid:
+            if account in seen:
+                duplicates += 1
+            else:
+                seen.add(account)
+                batch.append(account)
+        if batch:
+            added = _insert_batch(batch, email)
+            imported, duplicates = imported + added, duplicates + len(batch) - added
+    return ImportResult(imported, duplicates, invalid)
+
+
+def export_subscriptions(email, fmt, batch_size=BULK_IMPORT_BATCH_SIZE):
+    query = db_session.query(Subscription.account).filter(Subscription.email_lower == email.lower()) \
+        .order_by(Subscription.account).yield_per(batch_size)
+    if fmt == CSV:
+        yield 'account\r\n'
+        for account, in query:
+            yield f'{account}\r\n'
+    else:
+        for account, in query:
+            yield json.dumps({'account': account}) + '\n'
+
+
+def _chunks(lines, size, max_accounts):
+    chunk = []
+    for count, line in enumerate(lines, 1):
+        if count > max_accounts:
+            raise TooManyAccounts(f'More than {max_accounts} accounts')
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_batch(batch, email):
+    query = db_session.query(Subscription.account).filter(Subscription.account.in_(batch))
+    if email:
+        query = query.filter(Subscription.email_lower == email.lower())
+    existing = {account for account, in query}
+    rows = [{'id': str(uuid.uuid4()), 'email': email, 'email_lower': email.lower() if email else None,
+             'account': account}
+            for account in batch if account not in existing]
+    if rows:
+        db_session.execute(Subscription.__table__.insert(), rows)
+        mark_changed(db_session(), [row['account'] for row in rows])
+    return len(rows)
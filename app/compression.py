@@ -0,0 +1,51 @@
+import gzip
+
+from werkzeug.http import parse_accept_header
+
+from app.config import COMPRESS_MIN_SIZE, COMPRESS_LEVEL
+
+try:
+    import brotli
+except ImportError:
+    # Optional, responses are gzipped without it
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain', 'application/xml'}
+
+
+def negotiate(accept_encoding):
+    """The encoding to compress a response with for the client's Accept-Encoding, or ``None``."""
+    accepted = parse_accept_header(accept_encoding or '')
+    if brotli is not None and accepted.quality('br'):
+        return 'br'
+    if accepted.quality('gzip'):
+        return 'gzip'
+    return None
+
+
+def encode(data, encoding, level=COMPRESS_LEVEL):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+def compress_body(data, accept_encoding, min_size=COMPRESS_MIN_SIZE):
+    """Return ``data`` compressed for the client and the encoding used, or as it is with ``None``."""
+    encoding = negotiate(accept_encoding)
+    if encoding is None or len(data) < min_size:
+        return data, None
+    return encode(data, encoding), encoding
+
+
+def compress(response, accept_encoding, min_size=COMPRESS_MIN_SIZE):
+    """Compress a buffered JSON or HTML response in place when the client accepts it and it's worth the CPU."""
+    if response.mimetype not in COMPRESSIBLE_TYPES or response.direct_passthrough or response.is_streamed:
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'Content-Encoding' in response.headers or response.status_code not in (200, 201):
+        return response
+    data, encoding = compress_body(response.get_data(), accept_encoding, min_size)
+    if encoding:
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+    return response
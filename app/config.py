@@ -1,6 +1,117 @@
 import os
+import tempfile
 
 RECAPTCHA_SECRET=os.getenv('RECAPTCHA_SECRET')
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///:memory:')
 BCRYPT_SECRET = os.getenv('BCRYPT_SECRET', 'secret')
 NANO_HOST = os.getenv('NANO_HOST', '[::1]')
+NANO_PORT = int(os.getenv('NANO_PORT', '7076'))
+HISTORY_CACHE_TTL = float(os.getenv('HISTORY_CACHE_TTL', '5'))
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', '10000'))
+NODE_POOL_SIZE = int(os.getenv('NODE_POOL_SIZE', '10'))
+NODE_CONNECT_TIMEOUT = float(os.getenv('NODE_CONNECT_TIMEOUT', '2'))
+NODE_READ_TIMEOUT = float(os.getenv('NODE_READ_TIMEOUT', '5'))
+NODE_RETRIES = int(os.getenv('NODE_RETRIES', '2'))
+NODE_RETRY_BACKOFF = float(os.getenv('NODE_RETRY_BACKOFF', '0.1'))
+NODE_BREAKER_THRESHOLD = int(os.getenv('NODE_BREAKER_THRESHOLD', '5'))
+NODE_BREAKER_RESET = float(os.getenv('NODE_BREAKER_RESET', '30'))
+HISTORY_BATCH_WORKERS = int(os.getenv('HISTORY_BATCH_WORKERS', '8'))
+HISTORY_BATCH_MAX_ACCOUNTS = int(os.getenv('HISTORY_BATCH_MAX_ACCOUNTS', '100'))
+HISTORY_MAX_COUNT = int(os.getenv('HISTORY_MAX_COUNT', '100'))
+ASYNC_NODE_POOL_SIZE = int(os.getenv('ASYNC_NODE_POOL_SIZE', '100'))
+ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', '32'))
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', '8'))
+ASYNC_HTTP_MAX_RESPONSE_SIZE = int(os.getenv('ASYNC_HTTP_MAX_RESPONSE_SIZE', '16777216'))
+SUBSCRIBERS_CACHE_TTL = float(os.getenv('SUBSCRIBERS_CACHE_TTL', '60'))
+SUBSCRIBERS_CACHE_SIZE = int(os.getenv('SUBSCRIBERS_CACHE_SIZE', '100000'))
+SUBSCRIBERS_MAX_ACCOUNTS = int(os.getenv('SUBSCRIBERS_MAX_ACCOUNTS', '1000'))
+INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN')
+BULK_IMPORT_BATCH_SIZE = int(os.getenv('BULK_IMPORT_BATCH_SIZE', '500'))
+BULK_IMPORT_MAX_ACCOUNTS = int(os.getenv('BULK_IMPORT_MAX_ACCOUNTS', '100000'))
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+# More hashes than this queued or running on the host are answered with a 429, as are those which wait for a hashing
+# slot for PASSWORD_HASH_TIMEOUT seconds
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', str(2 * PASSWORD_HASH_WORKERS)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '5'))
+# Where the hashing slots shared by every worker process on the host are kept
+PASSWORD_HASH_LOCK_DIR = os.getenv('PASSWORD_HASH_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'nanotify-passwords'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+SESSION_REFRESH_FRACTION = float(os.getenv('SESSION_REFRESH_FRACTION', '0.5'))
+ACCOUNT_VERIFY_CHECKSUM = os.getenv('ACCOUNT_VERIFY_CHECKSUM', 'false').lower() == 'true'
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '5000'))
+FEED_POLL_INTERVAL = float(os.getenv('FEED_POLL_INTERVAL', '2'))
+FEED_HEARTBEAT_INTERVAL = float(os.getenv('FEED_HEARTBEAT_INTERVAL', '15'))
+FEED_LONG_POLL_TIMEOUT = float(os.getenv('FEED_LONG_POLL_TIMEOUT', '25'))
+FEED_HISTORY_COUNT = int(os.getenv('FEED_HISTORY_COUNT', '10'))
+# The poller asks the node about every watched account each FEED_POLL_INTERVAL, so how many it watches is capped
+FEED_MAX_ACCOUNTS = int(os.getenv('FEED_MAX_ACCOUNTS', '1000'))
+FEED_MAX_CLIENT_WATCHES = int(os.getenv('FEED_MAX_CLIENT_WATCHES', '10'))
+SUBSCRIBED_ACCOUNTS_TTL = float(os.getenv('SUBSCRIBED_ACCOUNTS_TTL', '60'))
+NOTIFICATION_BATCH_SIZE = int(os.getenv('NOTIFICATION_BATCH_SIZE', '500'))
+NOTIFICATION_ENQUEUE_TIMEOUT = float(os.getenv('NOTIFICATION_ENQUEUE_TIMEOUT', '5'))
+# Notifications older than this are taken to be committed, well past any transaction inserting them could run
+NOTIFICATION_CLAIM_SETTLE = float(os.getenv('NOTIFICATION_CLAIM_SETTLE', '300'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '32'))
+WEBHOOK_HOST_CONCURRENCY = int(os.getenv('WEBHOOK_HOST_CONCURRENCY', '4'))
+WEBHOOK_CONNECT_TIMEOUT = float(os.getenv('WEBHOOK_CONNECT_TIMEOUT', '2'))
+WEBHOOK_READ_TIMEOUT = float(os.getenv('WEBHOOK_READ_TIMEOUT', '5'))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))
+WEBHOOK_BACKOFF_BASE = float(os.getenv('WEBHOOK_BACKOFF_BASE', '1'))
+WEBHOOK_BACKOFF_MAX = float(os.getenv('WEBHOOK_BACKOFF_MAX', '3600'))
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', '500'))
+WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', '1'))
+# Deliveries are refused to hosts resolving to loopback, private or link-local addresses unless this is set
+WEBHOOK_ALLOW_PRIVATE = os.getenv('WEBHOOK_ALLOW_PRIVATE', 'false').lower() == 'true'
+SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '25'))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'false').lower() == 'true'
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '10'))
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', '60'))
+EMAIL_FROM = os.getenv('EMAIL_FROM', 'Nanotify <notifications@nanotify.me>')
+EMAIL_DIGEST_WINDOW = float(os.getenv('EMAIL_DIGEST_WINDOW', '60'))
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', '500'))
+EMAIL_POLL_INTERVAL = float(os.getenv('EMAIL_POLL_INTERVAL', '5'))
+SUBSCRIPTIONS_PAGE_SIZE = int(os.getenv('SUBSCRIPTIONS_PAGE_SIZE', '50'))
+SUBSCRIPTIONS_MAX_PAGE_SIZE = int(os.getenv('SUBSCRIPTIONS_MAX_PAGE_SIZE', '500'))
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory')
+RATE_LIMIT_STORE_TIMEOUT = float(os.getenv('RATE_LIMIT_STORE_TIMEOUT', '0.05'))
+RATE_LIMIT_MEMORY_SIZE = int(os.getenv('RATE_LIMIT_MEMORY_SIZE', '100000'))
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+RATE_LIMIT_REGISTER_IP = os.getenv('RATE_LIMIT_REGISTER_IP', '10/3600')
+RATE_LIMIT_SUBSCRIBE_IP = os.getenv('RATE_LIMIT_SUBSCRIBE_IP', '30/60')
+RATE_LIMIT_SUBSCRIBE_ACCOUNT = os.getenv('RATE_LIMIT_SUBSCRIBE_ACCOUNT', '10/60')
+RATE_LIMIT_TRANSACTIONS_IP = os.getenv('RATE_LIMIT_TRANSACTIONS_IP', '120/60')
+RATE_LIMIT_IMPORT_IP = os.getenv('RATE_LIMIT_IMPORT_IP', '10/3600')
+TRANSACTION_SYNC_PAGE_SIZE = int(os.getenv('TRANSACTION_SYNC_PAGE_SIZE', '100'))
+TRANSACTION_SYNC_MAX_BLOCKS = int(os.getenv('TRANSACTION_SYNC_MAX_BLOCKS', '1000'))
+# How long the stored history of an account nobody subscribes to is kept after it was last viewed
+TRANSACTION_UNSUBSCRIBED_TTL = float(os.getenv('TRANSACTION_UNSUBSCRIBED_TTL', '86400'))
+TRANSACTION_EVICT_EVERY = int(os.getenv('TRANSACTION_EVICT_EVERY', '1000'))
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '500'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '31536000'))
+ROBOTS_MAX_AGE = int(os.getenv('ROBOTS_MAX_AGE', '86400'))
+TEMPLATES_AUTO_RELOAD = {'true': True, 'false': False}.get(os.getenv('TEMPLATES_AUTO_RELOAD', '').lower())
+TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR')
+TEMPLATE_STREAM_BUFFER = int(os.getenv('TEMPLATE_STREAM_BUFFER', '20'))
+PREFETCH_BATCH_SIZE = int(os.getenv('PREFETCH_BATCH_SIZE', '50'))
+PREFETCH_INTERVAL = float(os.getenv('PREFETCH_INTERVAL', '60'))
+# 0 always asks the node, deployments running app.prefetch set it to about twice PREFETCH_INTERVAL
+TRANSACTION_SYNC_MAX_AGE = float(os.getenv('TRANSACTION_SYNC_MAX_AGE', '0'))
+PREFETCH_RECENT = float(os.getenv('PREFETCH_RECENT', '3600'))
+PREFETCH_NODE_SHARE = float(os.getenv('PREFETCH_NODE_SHARE', '0.25'))
+PREFETCH_MAX_DELAY = float(os.getenv('PREFETCH_MAX_DELAY', '60'))
+PREFETCH_HISTORY_COUNT = int(os.getenv('PREFETCH_HISTORY_COUNT', '10'))
+PREFETCH_VIEW_RESOLUTION = float(os.getenv('PREFETCH_VIEW_RESOLUTION', '60'))
@@ -1,14 +1,91 @@
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
+import logging
+
+from flask import g, has_app_context
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.ext.declarative import declarative_base
 
-from app.config import DATABASE_URL
+from app.config import DATABASE_URL, DATABASE_READ_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, \
+    DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS
+from app.metrics import instrument_engine
+
+MEMORY_URLS = ('sqlite://', 'sqlite:///:memory:')
+
+# WAL lets readers carry on while a writer commits; NORMAL sync is durable across application crashes in WAL mode
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', '-16000'),
+    ('mmap_size', '134217728'),
+)
+
+
+def create_db_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE,
+                     pool_pre_ping=DB_POOL_PRE_PING, statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS):
+    """Create an instrumented engine tuned for the backend ``url`` points at."""
+    backend = make_url(url).get_backend_name()
+    if url in MEMORY_URLS:
+        logging.warning('Using an in-memory SQLite database, which is not shared between processes')
+        # share the single in-memory database with every thread rather than one database per thread
+        engine = create_engine(url, convert_unicode=True, poolclass=StaticPool,
+                               connect_args={'check_same_thread': False})
+    elif backend == 'sqlite':
+        engine = create_engine(url, convert_unicode=True, pool_pre_ping=pool_pre_ping,
+                               connect_args={'check_same_thread': False, 'timeout': statement_timeout_ms / 1000})
+        _tune_sqlite(engine)
+    else:
+        connect_args = {}
+        if backend == 'postgresql' and statement_timeout_ms:
+            connect_args['options'] = f'-c statement_timeout={statement_timeout_ms}'
+        engine = create_engine(url, convert_unicode=True, pool_size=pool_size, max_overflow=max_overflow,
+                               pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping, connect_args=connect_args)
+        if backend == 'mysql' and statement_timeout_ms:
+            _set_on_connect(engine, f'SET SESSION MAX_EXECUTION_TIME={int(statement_timeout_ms)}')
+    instrument_engine(engine)
+    return engine
+
+
+def _tune_sqlite(engine):
+    _set_on_connect(engine, *(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS))
+
+
+def _set_on_connect(engine, *statements):
+    @event.listens_for(engine, 'connect')
+    def _configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
 
-engine = create_engine(DATABASE_URL, convert_unicode=True)
-db_session = scoped_session(sessionmaker(autocommit=False,
+
+class RoutingSession(Session):
+    """Session which sends the reads of views marked ``read_only`` to ``read_bind`` and everything else to ``bind``.
+
+    Flushes always go to ``bind`` so a read only view which does write still writes to the primary.
+    """
+
+    def __init__(self, read_bind=None, **kwargs):
+        super().__init__(**kwargs)
+        self.read_bind = read_bind
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.read_bind is not None and not self._flushing and has_app_context() and g.get('read_only'):
+            return self.read_bind
+        return super().get_bind(mapper, clause)
+
+
+engine = create_db_engine(DATABASE_URL)
+read_engine = create_db_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
+db_session = scoped_session(sessionmaker(class_=RoutingSession,
+                                         autocommit=False,
                                          autoflush=False,
-                                         bind=engine))
+                                         bind=engine,
+                                         read_bind=read_engine))
 Base = declarative_base()
 Base.query = db_session.query_property()
 
@@ -18,4 +95,17 @@ def init_db():
     # they will be registered properly on the metadata.  Otherwise
     # you will have to import them first before calling init_db()
     import app.models
+    from app.migrations import upgrade
     Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+
+
+def dispose_engines():
+    """Close the pooled connections a forked process inherited so it opens its own rather than share its parent's.
+
+    An in-memory database only exists in its single connection so that is kept.
+    """
+    db_session.remove()
+    for bind in {engine, read_engine}:
+        if not isinstance(bind.pool, StaticPool):
+            bind.dispose()
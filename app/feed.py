@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from app import history
+from app.config import FEED_POLL_INTERVAL, FEED_HISTORY_COUNT, FEED_MAX_ACCOUNTS, FEED_MAX_CLIENT_WATCHES
+from app.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+EVENT_STREAM = 'text/event-stream'
+KEEPALIVE = ': keepalive\n\n'
+
+
+class FeedFull(Exception):
+    """The process already polls as many accounts as it may."""
+
+
+class TooManyWatches(Exception):
+    """The client already watches as many accounts as it may."""
+
+
+def head_of(account_history):
+    return account_history[0]['hash'] if account_history else None
+
+
+def event(account_history):
+    """Format a history as a Server-Sent Event whose id, sent back as ``Last-Event-ID`` on reconnect, is the head."""
+    return f'id: {head_of(account_history) or ""}\nevent: history\ndata: {json.dumps(account_history)}\n\n'
+
+
+class Watcher:
+    """A client watching one account, woken by the feed's poller whenever the account's head block changes.
+
+    Only the latest history is kept so a slow client skips straight to the newest state rather than queueing.
+    """
+
+    def __init__(self, account, head=None, client=None):
+        self.account = account
+        self.head = head
+        self.client = client
+        self._history = None
+        self._changed = threading.Condition()
+
+    def notify(self, head, account_history):
+        with self._changed:
+            if head == self.head:
+                return False
+            self.head = head
+            self._history = account_history
+            self._changed.notify_all()
+            return True
+
+    def next(self, timeout=None):
+        """Wait up to ``timeout`` seconds for a new history, returning ``None`` if the head did not change."""
+        with self._changed:
+            if self._history is None:
+                self._changed.wait(timeout)
+            account_history, self._history = self._history, None
+            return account_history
+
+
+class AsyncWatcher(Watcher):
+    """Watcher for clients served on an event loop, which is woken from the poller thread."""
+
+    def __init__(self, account, head=None, client=None, loop=None):
+        super().__init__(account, head, client)
+        self._loop = loop or asyncio.get_event_loop()
+        self._event = asyncio.Event()
+
+    def notify(self, head, account_history):
+        changed = super().notify(head, account_history)
+        if changed:
+            self._loop.call_soon_threadsafe(self._event.set)
+        return changed
+
+    async def next_async(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+        return self.next(0)
+
+
+class FeedHub:
+    """Fans the history of watched accounts out to every client watching them.
+
+    A single poller thread per process refreshes every watched account each ``interval`` seconds, so node load
+    grows with the number of distinct accounts being watched rather than with the number of clients. That is capped
+    at ``max_accounts`` accounts, and each client at ``max_client_watches`` watchers.
+    """
+
+    def __init__(self, load=history.refresh, interval=FEED_POLL_INTERVAL, count=FEED_HISTORY_COUNT,
+                 max_accounts=FEED_MAX_ACCOUNTS, max_client_watches=FEED_MAX_CLIENT_WATCHES):
+        self.load = load
+        self.interval = interval
+        self.count = count
+        self.max_accounts = max_accounts
+        self.max_client_watches = max_client_watches
+        self._watchers = defaultdict(set)
+        self._client_watches = defaultdict(int)
+        self._histories = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Threads do not survive a fork so the poller is started lazily in each process
+        self._poller = PerProcess(self._start_poller)
+
+    def watch(self, watcher):
+        """Start notifying ``watcher``, raising ``TooManyWatches`` or ``FeedFull`` when it is over a cap."""
+        with self._lock:
+            if watcher.client is not None and self._client_watches[watcher.client] >= self.max_client_watches:
+                raise TooManyWatches(f'{watcher.client} already watches {self.max_client_watches} accounts')
+            if watcher.account not in self._watchers and len(self._watchers) >= self.max_accounts:
+                raise FeedFull(f'Already watching {self.max_accounts} accounts')
+            self._watchers[watcher.account].add(watcher)
+            if watcher.client is not None:
+                self._client_watches[watcher.client] += 1
+            latest = self._histories.get(watcher.account)
+        if latest is not None:
+            watcher.notify(head_of(latest), latest)
+        else:
+            self._wake.set()
+        self._poller.get()
+        return watcher
+
+    def unwatch(self, watcher):
+        with self._lock:
+            watchers = self._watchers.get(watcher.account)
+            if watchers is None or watcher not in watchers:
+                return
+            watchers.discard(watcher)
+            if watcher.client is not None:
+                self._client_watches[watcher.client] -= 1
+                if not self._client_watches[watcher.client]:
+                    del self._client_watches[watcher.client]
+            if not watchers:
+                del self._watchers[watcher.account]
+                self._histories.pop(watcher.account, None)
+
+    def poll(self):
+        with self._lock:
+            accounts = list(self._watchers)
+        if not accounts:
+            return
+        for account, account_history in self.load(accounts, self.count).items():
+            with self._lock:
+                watchers = list(self._watchers.get(account, ()))
+                if watchers:
+                    self._histories[account] = account_history
+            head = head_of(account_history)
+            for watcher in watchers:
+                watcher.notify(head, account_history)
+
+    def stats(self):
+        with self._lock:
+            return {'accounts': len(self._watchers),
+                    'watchers': sum(len(watchers) for watchers in self._watchers.values())}
+
+    def _start_poller(self):
+        poller = threading.Thread(target=self._run, name='feed-poller', daemon=True)
+        poller.start()
+        return poller
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Failed to poll watched accounts')
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+hub = FeedHub()
@@ -0,0 +1,58 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from requests import RequestException
+
+from app import transactions
+from app.cache import TTLCache
+from app.config import HISTORY_CACHE_SIZE, HISTORY_CACHE_TTL, HISTORY_BATCH_WORKERS, TRANSACTION_SYNC_MAX_AGE
+from app.metrics import register_cache
+from app.process import PerProcess
+
+history_cache = TTLCache(maxsize=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL)
+register_cache('history', history_cache)
+
+logger = logging.getLogger(__name__)
+
+# Worker threads do not survive a fork so the pool is created lazily in each process
+_executor = PerProcess(lambda: ThreadPoolExecutor(max_workers=HISTORY_BATCH_WORKERS),
+                       close=lambda executor: executor.shutdown(wait=False))
+
+
+def account_history(account, count=10, head=None):
+    return history_cache.get_or_load((account, count, head), lambda: _load(account, count, head))
+
+
+def accounts_history(accounts, count=10, heads=None):
+    heads = heads or {}
+    if len(accounts) == 1:
+        return {accounts[0]: account_history(accounts[0], count, heads.get(accounts[0]))}
+    futures = {account: _executor.get().submit(account_history, account, count, heads.get(account))
+               for account in accounts}
+    return {account: future.result() for account, future in futures.items()}
+
+
+def refresh(accounts, count=10):
+    """Sync the latest history of ``accounts`` from the node, bypassing and then repopulating ``history_cache``.
+
+    Accounts the node fails to answer for are logged and left out of the result.
+    """
+    futures = {account: _executor.get().submit(transactions.history, account, count)
+               for account in accounts}
+    histories = {}
+    for account, future in futures.items():
+        try:
+            history = future.result()
+        except RequestException as e:
+            logger.warning(f'Failed to refresh history of {account}: {e!r}')
+            continue
+        history_cache.set((account, count, None), history)
+        histories[account] = history
+    return histories
+
+
+def _load(account, count, head):
+    history = transactions.history(account, count, head, max_age=TRANSACTION_SYNC_MAX_AGE)
+    transactions.mark_viewed(account)
+    return history
+
@@ -0,0 +1,203 @@
+import datetime
+import logging
+import os
+import smtplib
+import time
+from collections import OrderedDict
+from email.message import EmailMessage
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy import func
+
+from app.config import SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_STARTTLS, SMTP_TIMEOUT, \
+    SMTP_IDLE_TIMEOUT, EMAIL_FROM, EMAIL_DIGEST_WINDOW, EMAIL_BATCH_SIZE, EMAIL_POLL_INTERVAL
+from app.database import db_session
+from app.metrics import registry, email_send_duration, email_digest_notifications, smtp_connections
+from app.models import EmailDelivery, Notification
+from app.notifications import claim
+from app.subscribers import subscribers_for
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'email'
+
+_environment = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates', 'email')),
+                           autoescape=select_autoescape(['html']), auto_reload=False)
+# Compiled once when the module is imported rather than for every digest
+TEXT_TEMPLATE = _environment.get_template('digest.txt')
+HTML_TEMPLATE = _environment.get_template('digest.html')
+
+
+def render(sender, recipient, notifications):
+    message = EmailMessage()
+    message['Subject'] = f'{len(notifications)} new Nano transaction{"s" if len(notifications) != 1 else ""}'
+    message['From'] = sender
+    message['To'] = recipient
+    message.set_content(TEXT_TEMPLATE.render(notifications=notifications))
+    message.add_alternative(HTML_TEMPLATE.render(notifications=notifications), subtype='html')
+    return message
+
+
+class PersistentSMTP:
+    """An SMTP session kept open across messages, reopened when the server drops it or it has been idle too long."""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT, idle_timeout=SMTP_IDLE_TIMEOUT, clock=time.monotonic):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._clock = clock
+        self._smtp = None
+        self._last_used = None
+
+    def send(self, message):
+        reused = self._smtp is not None and self._clock() - self._last_used < self.idle_timeout
+        if not reused:
+            self._open()
+        start = time.perf_counter()
+        try:
+            self._smtp.send_message(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            if not reused:
+                email_send_duration.observe(time.perf_counter() - start, result='error')
+                raise
+            # The server closed the session since it was last used, retry once on a new one
+            self._open()
+            self._smtp.send_message(message)
+        except smtplib.SMTPException:
+            email_send_duration.observe(time.perf_counter() - start, result='error')
+            raise
+        email_send_duration.observe(time.perf_counter() - start, result='success')
+        self._last_used = self._clock()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _open(self):
+        self.close()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        smtp_connections.inc()
+        self._smtp = smtp
+        self._last_used = self._clock()
+
+
+class DigestSender:
+    """Emails subscribers their notifications, coalesced into one digest per recipient.
+
+    A recipient's digest goes out ``window`` seconds after their oldest unsent notification was queued, with
+    everything queued for them since, so a busy account sends one email per window rather than one per block.
+    """
+
+    def __init__(self, session=db_session, smtp=None, window=EMAIL_DIGEST_WINDOW, batch_size=EMAIL_BATCH_SIZE,
+                 sender=EMAIL_FROM, clock=datetime.datetime.utcnow):
+        self.session = session
+        self.smtp = smtp or PersistentSMTP()
+        self.window = window
+        self.batch_size = batch_size
+        self.sender = sender
+        self.clock = clock
+
+    def run(self, interval=EMAIL_POLL_INTERVAL):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Email digest delivery failed')
+                self.session.rollback()
+            finally:
+                self.session.remove()
+            registry.maybe_flush()
+            time.sleep(interval)
+
+    def run_once(self):
+        self.expand()
+        return self.send_due()
+
+    def close(self):
+        self.smtp.close()
+
+    def expand(self):
+        """Queue each new notification for every distinct email address subscribed to its account."""
+        rows = claim(self.session, CHANNEL, self.batch_size)
+        if not rows:
+            self.session.rollback()
+            return 0
+        subscribers = subscribers_for({account for _, account in rows})
+        now = self.clock()
+        deliveries = []
+        for notification_id, account in rows:
+            # Addresses are compared case insensitively like logins, so each inbox gets a single digest
+            emails = OrderedDict.fromkeys(subscriber.email.lower() for subscriber in subscribers[account]
+                                          if subscriber.email)
+            deliveries.extend({'notification_id': notification_id, 'email': email, 'status': EmailDelivery.PENDING,
+                               'queued_at': now} for email in emails)
+        if deliveries:
+            self.session.execute(EmailDelivery.__table__.insert(), deliveries)
+        self.session.commit()
+        return len(deliveries)
+
+    def send_due(self):
+        """Send a digest to every recipient whose window has closed, returning how many were sent."""
+        cutoff = self.clock() - datetime.timedelta(seconds=self.window)
+        recipients = [email for email, in self.session.query(EmailDelivery.email)
+                      .filter(EmailDelivery.status == EmailDelivery.PENDING)
+                      .group_by(EmailDelivery.email)
+                      .having(func.min(EmailDelivery.queued_at) <= cutoff)
+                      .limit(self.batch_size)]
+        if not recipients:
+            self.session.rollback()
+            return 0
+        digests = OrderedDict((email, []) for email in recipients)
+        rows = self.session.query(EmailDelivery.id, EmailDelivery.email, Notification.account, Notification.hash,
+                                  Notification.amount) \
+            .join(Notification, Notification.id == EmailDelivery.notification_id) \
+            .filter(EmailDelivery.status == EmailDelivery.PENDING) \
+            .filter(EmailDelivery.email.in_(recipients)) \
+            .order_by(EmailDelivery.id)
+        for row in rows:
+            digests[row.email].append(row)
+        self.session.rollback()
+        sent = 0
+        for email, notifications in digests.items():
+            try:
+                self.smtp.send(render(self.sender, email, notifications))
+            except smtplib.SMTPRecipientsRefused as e:
+                logger.warning(f'Dropping digest refused for {email}: {e.recipients}')
+                self._mark(notifications, EmailDelivery.FAILED)
+                continue
+            except (smtplib.SMTPException, OSError):
+                # Leave the rest queued for the next run rather than hammering a failing server
+                logger.exception('Failed to send email digest')
+                break
+            self._mark(notifications, EmailDelivery.SENT)
+            email_digest_notifications.inc(len(notifications))
+            sent += 1
+        return sent
+
+    def _mark(self, notifications, status):
+        table = EmailDelivery.__table__
+        try:
+            self.session.execute(table.update()
+                                 .where(table.c.id.in_([notification.id for notification in notifications]))
+                                 .values(status=status, sent_at=self.clock() if status == EmailDelivery.SENT else None))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+
+if __name__ == '__main__':
+    DigestSender().run()
@@ -0,0 +1,30 @@
+"""Schema commands, run once per deploy before the workers start rather than by each worker as it imports the app.
+
+    python -m app.manage init-db    create any missing tables then apply pending migrations
+    python -m app.manage migrate    only apply pending migrations to an existing schema
+"""
+import argparse
+
+from app.database import engine, init_db
+from app.migrations import upgrade
+
+
+def migrate():
+    upgrade(engine)
+
+
+COMMANDS = {
+    'init-db': init_db,
+    'migrate': migrate,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.manage', description='Set up the database schema')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+    COMMANDS[args.command]()
+
+
+if __name__ == '__main__':
+    main()
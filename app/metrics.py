@@ -0,0 +1,315 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from app.config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+from app.process import PerProcess
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class CallbackCounter(Counter):
+    """Counter whose values are read from ``callback`` (returning ``{label values: value}``) when collected."""
+
+    def __init__(self, name, documentation, labelnames, callback):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def samples(self):
+        return [[list(key), value] for key, value in self._callback().items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _key(self.labelnames, labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts['buckets'][i] += 1
+                    break
+            else:
+                counts['buckets'][-1] += 1
+            counts['sum'] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), {'buckets': list(counts['buckets']), 'sum': counts['sum']}]
+                    for key, counts in self._values.items()]
+
+
+class Registry:
+    """Metrics for this process which, when ``directory`` is set, are aggregated with every other worker's.
+
+    Each process writes a snapshot to ``<directory>/<pid>-<random>.json`` (at most every ``flush_interval`` seconds
+    and on every scrape) and rendering sums the snapshots of all processes, like prometheus_client's multiprocess
+    mode. The snapshots of processes which have exited are folded into ``<directory>/dead.json`` so their counts are
+    kept without the directory growing with every restarted worker. The directory must only be shared by processes
+    on one host, whose pids tell which of them are still running.
+    """
+
+    DEAD = 'dead.json'
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = OrderedDict()
+        self._last_flush = 0
+        self._key = PerProcess(lambda: f'{os.getpid()}-{uuid.uuid4().hex}')
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return OrderedDict((metric.name, {
+            'type': metric.type,
+            'help': metric.documentation,
+            'labelnames': list(metric.labelnames),
+            'buckets': list(getattr(metric, 'buckets', ())),
+            'samples': metric.samples()
+        }) for metric in self._metrics.values())
+
+    def maybe_flush(self):
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @property
+    def key(self):
+        """Names this process's snapshot, a later process given the same pid gets a different key."""
+        return self._key.get()
+
+    def flush(self):
+        if not self.directory:
+            return
+        self._last_flush = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        _write(os.path.join(self.directory, f'{self.key}.json'), self.snapshot())
+
+    def collect(self):
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        self.fold_dead()
+        return merge(filter(None, map(_read, glob.glob(os.path.join(self.directory, '*.json')))))
+
+    def fold_dead(self):
+        """Add the snapshots of processes which have exited to the dead processes' totals and remove them."""
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            # Held while folding so two scrapes can't both add the same snapshot
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            paths = [path for path in glob.glob(os.path.join(self.directory, '*.json'))
+                     if not _is_running(_pid(path))]
+            if not paths:
+                return
+            dead = os.path.join(self.directory, self.DEAD)
+            snapshots = [_read(path) for path in paths]
+            _write(dead, merge(filter(None, [_read(dead)] + snapshots)))
+            for path in paths:
+                os.remove(path)
+
+    def render(self):
+        return render(self.collect())
+
+
+def merge(snapshots):
+    merged = OrderedDict()
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                if metric['type'] == 'histogram':
+                    current = target['samples'].setdefault(key, {'buckets': [0] * len(value['buckets']), 'sum': 0.0})
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                else:
+                    target['samples'][key] = target['samples'].get(key, 0) + value
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+    return merged
+
+
+def render(snapshot):
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f'# HELP {name} {metric["help"]}')
+        lines.append(f'# TYPE {name} {metric["type"]}')
+        for labels, value in sorted(metric['samples']):
+            pairs = list(zip(metric['labelnames'], labels))
+            if metric['type'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + ['+Inf'], value['buckets']):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else repr(float(bound))
+                    lines.append(f'{name}_bucket{_labels(pairs + [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(pairs)} {value["sum"]}')
+                lines.append(f'{name}_count{_labels(pairs)} {cumulative}')
+            else:
+                lines.append(f'{name}{_labels(pairs)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, snapshot):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+def _pid(path):
+    """The pid a snapshot was written by, or ``None`` for the dead processes' totals."""
+    name = os.path.basename(path).split('.')[0].split('-')[0]
+    return int(name) if name.isdigit() else None
+
+
+def _is_running(pid):
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+registry = Registry()
+
+request_duration = registry.histogram('nanotify_request_duration_seconds', 'Request latency by endpoint',
+                                      ['endpoint', 'method', 'status'])
+db_query_duration = registry.histogram('nanotify_db_query_duration_seconds', 'Database query latency by endpoint',
+                                       ['endpoint'])
+node_rpc_duration = registry.histogram('nanotify_node_rpc_duration_seconds', 'Nano node RPC latency by action',
+                                       ['action'])
+node_rpc_errors = registry.counter('nanotify_node_rpc_errors_total', 'Failed Nano node RPC calls by action',
+                                   ['action'])
+password_hash_duration = registry.histogram('nanotify_password_hash_duration_seconds', 'bcrypt time by operation',
+                                            ['operation'])
+password_hash_rejected = registry.counter('nanotify_password_hash_rejected_total',
+                                          'Password hashes rejected because the hashing queue was full')
+callback_blocks = registry.counter('nanotify_callback_blocks_total', 'Node callback blocks by outcome', ['result'])
+notification_enqueue_duration = registry.histogram('nanotify_notification_enqueue_duration_seconds',
+                                                   'Time to durably queue the notifications for a callback')
+webhook_request_duration = registry.histogram('nanotify_webhook_request_duration_seconds',
+                                              'Webhook POST latency by result', ['result'])
+webhook_delivery_latency = registry.histogram('nanotify_webhook_delivery_latency_seconds',
+                                              'Time from a block being queued to its webhook delivery',
+                                              buckets=(.1, .5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 21600))
+email_send_duration = registry.histogram('nanotify_email_send_duration_seconds', 'SMTP send latency by result',
+                                         ['result'])
+email_digest_notifications = registry.counter('nanotify_email_digest_notifications_total',
+                                              'Notifications sent in email digests')
+smtp_connections = registry.counter('nanotify_smtp_connections_total', 'SMTP connections opened')
+rate_limit_requests = registry.counter('nanotify_rate_limit_requests_total', 'Rate limited requests by outcome',
+                                       ['limit', 'scope', 'result'])
+rate_limit_store_duration = registry.histogram('nanotify_rate_limit_store_duration_seconds',
+                                               'Time to take a token from the rate limit store', ['store'])
+rate_limit_store_errors = registry.counter('nanotify_rate_limit_store_errors_total',
+                                           'Rate limit checks let through because the store failed')
+prefetch_accounts = registry.counter('nanotify_prefetch_accounts_total', 'Account histories prefetched by outcome',
+                                     ['result'])
+prefetch_batch_duration = registry.histogram('nanotify_prefetch_batch_duration_seconds',
+                                             'Time the node took to refresh a batch of prefetched accounts')
+
+
+def register_cache(name, cache):
+    registry.register(CallbackCounter(f'nanotify_{name}_cache_total', f'{name} cache lookups and evictions',
+                                      ['result'], lambda: _cache_samples(cache)))
+
+
+def _cache_samples(cache):
+    stats = cache.stats()
+    return {(result,): stats[result] for result in ('hits', 'misses', 'coalesced', 'evictions')}
+
+
+def instrument_engine(engine):
+    from flask import has_request_context, request
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        endpoint = request.endpoint if has_request_context() else None
+        db_query_duration.observe(elapsed, endpoint=endpoint or 'none')
+
+    @event.listens_for(engine, 'handle_error')
+    def _failed_query(context):
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
@@ -0,0 +1,153 @@
+import logging
+import sqlite3
+
+from sqlalchemy import Table, Column, Index, Integer, MetaData, inspect, func, select, or_
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+schema_migration = Table('schema_migration', metadata, Column('version', Integer, primary_key=True))
+
+
+def _add_lookup_columns(connection):
+    # Lowercase lookup columns and indexes so email and account lookups don't scan the tables
+    from app.models import Subscription, User
+    for model in (User, Subscription):
+        table = model.__table__
+        if 'email_lower' not in _columns(connection, table.name):
+            connection.execute(f'ALTER TABLE {_quote(connection, table.name)} ADD COLUMN email_lower VARCHAR')
+        connection.execute(table.update()
+                           .where(table.c.email_lower.is_(None))
+                           .where(table.c.email.isnot(None))
+                           .values(email_lower=func.lower(table.c.email)))
+        _create_indexes(connection, table)
+
+
+def _normalize_webhooks(connection):
+    # Subscriptions used to carry a copy of their user's webhook, which is now looked up from the user instead
+    if 'webhook' not in _columns(connection, 'subscription'):
+        return
+    user = _quote(connection, 'user')
+    connection.execute(f'UPDATE {user} SET webhook = ('
+                       f'SELECT MAX(subscription.webhook) FROM subscription '
+                       f'WHERE subscription.email_lower = {user}.email_lower) '
+                       f'WHERE webhook IS NULL')
+    _delete_duplicate_subscriptions(connection)
+    if connection.dialect.name != 'sqlite' or sqlite3.sqlite_version_info >= (3, 35, 0):
+        connection.execute('ALTER TABLE subscription DROP COLUMN webhook')
+    else:
+        connection.execute('UPDATE subscription SET webhook = NULL')
+
+
+def _add_history_viewed_at(connection):
+    # Account history tables created before views were recorded for the prefetcher
+    from app.models import AccountHistory
+    table = AccountHistory.__table__
+    if not connection.dialect.has_table(connection, table.name):
+        return
+    if 'viewed_at' not in _columns(connection, table.name):
+        column_type = table.c.viewed_at.type.compile(dialect=connection.dialect)
+        connection.execute(f'ALTER TABLE {_quote(connection, table.name)} ADD COLUMN viewed_at {column_type}')
+    _create_indexes(connection, table)
+
+
+def _add_webhook_delivery_host(connection):
+    # Deliveries queued before the host was stored alongside the URL
+    from app.models import WebhookDelivery
+    from app.webhooks import host_of
+    table = WebhookDelivery.__table__
+    if not connection.dialect.has_table(connection, table.name):
+        return
+    if 'host' not in _columns(connection, table.name):
+        column_type = table.c.host.type.compile(dialect=connection.dialect)
+        connection.execute(f'ALTER TABLE {_quote(connection, table.name)} ADD COLUMN host {column_type}')
+    urls = connection.execute(select([table.c.url]).where(table.c.host.is_(None)).distinct()).fetchall()
+    for url, in urls:
+        connection.execute(table.update().where(table.c.url == url).where(table.c.host.is_(None))
+                           .values(host=host_of(url)))
+    _create_indexes(connection, table)
+
+
+def _add_notification_claims(connection):
+    # Channels used to only keep a cursor, which skipped notifications committed after higher ids
+    from app.models import NotificationClaim
+    NotificationClaim.__table__.create(connection, checkfirst=True)
+
+
+def _normalize_subscription_accounts(connection):
+    # Accounts used to be stored as they were sent, so lookups by the normalised account missed nano_ or uppercase ones
+    from app import accounts
+    from app.models import Subscription
+    table = Subscription.__table__
+    rows = connection.execute(select([table.c.account])
+                              .where(or_(table.c.account != func.lower(func.trim(table.c.account)),
+                                         table.c.account.startswith('nano_', autoescape=True)))
+                              .distinct()).fetchall()
+    for account, in rows:
+        connection.execute(table.update().where(table.c.account == account)
+                           .values(account=accounts.normalize(account)))
+    if rows:
+        _delete_duplicate_subscriptions(connection)
+
+
+def _unique_transaction_hashes(connection):
+    # Syncs running at once could store the same block twice, so the history of an account with duplicates is
+    # dropped, to be fetched again on its next view, before each block is made unique
+    from app.models import AccountHistory, Transaction
+    table = Transaction.__table__
+    if not connection.dialect.has_table(connection, table.name):
+        return
+    duplicated = [account for account, in connection.execute(
+        select([table.c.account]).group_by(table.c.account, table.c.hash).having(func.count() > 1).distinct())]
+    for account in duplicated:
+        connection.execute(table.delete().where(table.c.account == account))
+        connection.execute(AccountHistory.__table__.delete().where(AccountHistory.__table__.c.account == account))
+    # Built on a copy of the table as an index on the model's table would be added to it
+    copy = table.tometadata(MetaData())
+    old = Index('ix_account_transaction_account_hash', copy.c.account, copy.c.hash)
+    if old.name in {index['name'] for index in inspect(connection).get_indexes(table.name)}:
+        old.drop(connection)
+    _create_indexes(connection, table)
+
+
+MIGRATIONS = [
+    (1, _add_lookup_columns),
+    (2, _normalize_webhooks),
+    (3, _add_history_viewed_at),
+    (4, _add_webhook_delivery_host),
+    (5, _add_notification_claims),
+    (6, _normalize_subscription_accounts),
+    (7, _unique_transaction_hashes),
+]
+
+
+def upgrade(bind):
+    metadata.create_all(bind=bind)
+    with bind.begin() as connection:
+        applied = {row.version for row in connection.execute(select([schema_migration.c.version]))}
+        for version, migration in MIGRATIONS:
+            if version not in applied:
+                logger.info(f'Applying migration {version} {migration.__name__}')
+                migration(connection)
+                connection.execute(schema_migration.insert().values(version=version))
+
+
+def _delete_duplicate_subscriptions(connection):
+    # MySQL can't select from the table it deletes from unless the ids are read into a derived table first
+    connection.execute('DELETE FROM subscription WHERE id NOT IN (SELECT id FROM ('
+                       'SELECT MIN(id) AS id FROM subscription GROUP BY email_lower, account) AS kept)')
+
+
+def _columns(connection, table_name):
+    return {column['name'] for column in inspect(connection).get_columns(table_name)}
+
+
+def _create_indexes(connection, table):
+    existing = {index['name'] for index in inspect(connection).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(connection)
+
+
+def _quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
@@ -1,6 +1,8 @@
+import datetime
 import uuid
 
-from sqlalchemy import Column, String, Binary, types
+from sqlalchemy import Column, String, Binary, Boolean, Index, Integer, Text, DateTime, ForeignKey, types
+from sqlalchemy.orm import validates, relationship
 
 from app.database import Base
 
@@ -13,19 +15,37 @@ class Subscription(Base):
     __tablename__ = 'subscription'
     id = Column(String, primary_key=True, default=uuid.uuid4)
     email = Column(String)
-    webhook = Column(String)
+    email_lower = Column(String)
     account = Column(String, nullable=False)
 
-    def __init__(self, account, email=None, webhook=None):
+    # The webhook belongs to the subscriber so changing it is one write however many accounts they follow
+    user = relationship('User', primaryjoin='foreign(Subscription.email_lower) == User.email_lower',
+                        viewonly=True, uselist=False)
+
+    __table_args__ = (
+        Index('ix_subscription_email_lower_account', 'email_lower', 'account'),
+        Index('ix_subscription_account', 'account'),
+    )
+
+    def __init__(self, account, email=None):
         self.id = str(uuid.uuid4())
         self.email = email
-        self.webhook = webhook
         self.account = account
 
+    @validates('email')
+    def _set_email_lower(self, key, email):
+        self.email_lower = email.lower() if email else None
+        return email
+
+    @property
+    def webhook(self):
+        return self.user.webhook if self.user else None
+
 
 class User(Base):
     __tablename__ = 'user'
     email = Column(String, primary_key=True)
+    email_lower = Column(String, index=True)
     password = Column(String, nullable=False)
     webhook = Column(String)
 
@@ -34,6 +54,11 @@ class User(Base):
         self.password = password
         self.webhook = webhook
 
+    @validates('email')
+    def _set_email_lower(self, key, email):
+        self.email_lower = email.lower() if email else None
+        return email
+
     @staticmethod
     def is_authenticated():
         return True
@@ -51,3 +76,111 @@ class User(Base):
 
     def __repr__(self):
         return '<User %r>' % self.email
+
+
+class Notification(Base):
+    """A block sent to or from a subscribed account, queued until it has been delivered to the subscribers."""
+    __tablename__ = 'notification'
+    id = Column(Integer, primary_key=True)
+    account = Column(String, nullable=False)
+    hash = Column(String, nullable=False)
+    amount = Column(String)
+    block = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index('ux_notification_account_hash', 'account', 'hash', unique=True),
+    )
+
+
+class NotificationCursor(Base):
+    """The notification up to which each delivery channel has picked up every notification."""
+    __tablename__ = 'notification_cursor'
+    channel = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, channel, last_id=0):
+        self.channel = channel
+        self.last_id = last_id
+
+
+class NotificationClaim(Base):
+    """A notification after its channel's cursor which the channel has picked up."""
+    __tablename__ = 'notification_claim'
+    channel = Column(String, primary_key=True)
+    notification_id = Column(Integer, ForeignKey('notification.id'), primary_key=True)
+
+
+class WebhookDelivery(Base):
+    """A notification to be POSTed to one webhook, retried with backoff until it succeeds or runs out of attempts."""
+    __tablename__ = 'webhook_delivery'
+    PENDING = 'pending'
+    DELIVERED = 'delivered'
+    FAILED = 'failed'
+
+    id = Column(Integer, primary_key=True)
+    notification_id = Column(Integer, ForeignKey('notification.id'), nullable=False)
+    url = Column(String, nullable=False)
+    # Deliveries are limited per host, so hosts with no free slots are left out of the query for due deliveries
+    host = Column(String)
+    status = Column(String, nullable=False, default=PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    delivered_at = Column(DateTime)
+    last_error = Column(String)
+
+    __table_args__ = (
+        Index('ix_webhook_delivery_status_next_attempt_at', 'status', 'next_attempt_at'),
+        Index('ix_webhook_delivery_status_host', 'status', 'host'),
+    )
+
+
+class EmailDelivery(Base):
+    """A notification waiting to go out to one email address in that recipient's next digest."""
+    __tablename__ = 'email_delivery'
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    id = Column(Integer, primary_key=True)
+    notification_id = Column(Integer, ForeignKey('notification.id'), nullable=False)
+    email = Column(String, nullable=False)
+    status = Column(String, nullable=False, default=PENDING)
+    queued_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_email_delivery_status_email', 'status', 'email'),
+    )
+
+
+class AccountHistory(Base):
+    """How much of an account's chain is held locally, from its newest block (``head``) back to ``tail``."""
+    __tablename__ = 'account_history'
+    account = Column(String, primary_key=True)
+    head = Column(String)
+    tail = Column(String)
+    # The tail is the account's open block so there is nothing older to fetch
+    complete = Column(Boolean, nullable=False, default=False)
+    synced_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # When the history was last requested, so the prefetcher keeps the accounts people look at freshest
+    viewed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_account_history_viewed_at', 'viewed_at'),
+    )
+
+
+class Transaction(Base):
+    """A block of an account's history as the node returned it. ``seq`` orders an account's blocks, newest highest."""
+    __tablename__ = 'account_transaction'
+    id = Column(Integer, primary_key=True)
+    account = Column(String, nullable=False)
+    seq = Column(Integer, nullable=False)
+    hash = Column(String, nullable=False)
+    entry = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index('ux_account_transaction_account_seq', 'account', 'seq', unique=True),
+        Index('ux_account_transaction_account_hash', 'account', 'hash', unique=True),
+    )
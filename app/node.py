@@ -0,0 +1,145 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+
+from app.config import NANO_HOST, NANO_PORT, NODE_POOL_SIZE, NODE_CONNECT_TIMEOUT, NODE_READ_TIMEOUT, \
+    NODE_RETRIES, NODE_RETRY_BACKOFF, NODE_BREAKER_THRESHOLD, NODE_BREAKER_RESET
+from app.metrics import node_rpc_duration, node_rpc_errors
+from app.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+# Read only RPC actions which are safe to send to the node more than once
+IDEMPOTENT_ACTIONS = {
+    'account_balance',
+    'account_block_count',
+    'account_history',
+    'account_info',
+    'accounts_balances',
+    'accounts_frontiers',
+    'accounts_pending',
+    'block',
+    'block_count',
+    'blocks',
+    'blocks_info',
+    'frontiers',
+    'pending',
+    'version'
+}
+
+
+class NodeError(RequestException):
+    pass
+
+
+class NodeUnavailable(NodeError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        if self.state == self.OPEN:
+            raise NodeUnavailable('Nano node circuit breaker is open')
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning(f'Opening node circuit breaker after {self._failures} failures')
+                self._opened_at = self._clock()
+
+
+class NodeClient:
+
+    def __init__(self, url, pool_size=NODE_POOL_SIZE, timeout=(NODE_CONNECT_TIMEOUT, NODE_READ_TIMEOUT),
+                 retries=NODE_RETRIES, backoff=NODE_RETRY_BACKOFF, breaker=None):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(NODE_BREAKER_THRESHOLD, NODE_BREAKER_RESET)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def call(self, action, **params):
+        self.breaker.before_call()
+        data = dict(params, action=action)
+        attempts = 1 + (self.retries if action in IDEMPOTENT_ACTIONS else 0)
+        for attempt in range(attempts):
+            try:
+                with node_rpc_duration.time(action=action):
+                    response = self.session.post(self.url, json.dumps(data), timeout=self.timeout)
+                    response.raise_for_status()
+                    result = response.json()
+            except (RequestException, ValueError) as e:
+                node_rpc_errors.inc(action=action)
+                if attempt + 1 == attempts:
+                    self.breaker.record_failure()
+                    if isinstance(e, ValueError):
+                        raise NodeError(f'Invalid response from node for {action}') from e
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.info(f'Retrying {action} in {delay}s after {e!r}')
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def close(self):
+        self.session.close()
+
+
+# Sessions must not be shared across forked gunicorn workers so one is created per process
+_client = PerProcess(lambda: NodeClient(f'http://{NANO_HOST}:{NANO_PORT}'), close=NodeClient.close)
+
+
+def get_client():
+    return _client.get()
+
+
+def reset_client():
+    _client.reset()
+
+
+def call(action, **params):
+    return get_client().call(action, **params)
+
+
+def account_history(account, count=10, head=None):
+    params = {'account': account, 'count': count}
+    if head:
+        params['head'] = head
+    return call('account_history', **params).get('history', [])
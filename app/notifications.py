@@ -0,0 +1,204 @@
+import datetime
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from sqlalchemy import exists, func
+from sqlalchemy.exc import IntegrityError
+
+from app import accounts
+from app.config import NOTIFICATION_BATCH_SIZE, NOTIFICATION_ENQUEUE_TIMEOUT, NOTIFICATION_CLAIM_SETTLE
+from app.database import db_session
+from app.metrics import callback_blocks, notification_enqueue_duration
+from app.models import Notification, NotificationClaim, NotificationCursor
+from app.process import PerProcess
+from app.subscribers import subscribed_accounts
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCallback(ValueError):
+    pass
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+def parse_callback(body):
+    """Return a notification for the account of a node HTTP callback's block and, for a send, its recipient."""
+    if not isinstance(body, dict) or not body.get('hash') or not body.get('account'):
+        raise InvalidCallback()
+    block = body.get('block') or {}
+    if isinstance(block, str):
+        # The node sends the block as a JSON encoded string
+        try:
+            block = json.loads(block)
+        except ValueError:
+            raise InvalidCallback()
+    if not isinstance(block, dict):
+        raise InvalidCallback()
+    recipients = [body['account']]
+    if block.get('destination'):
+        recipients.append(block['destination'])
+    elif block.get('link_as_account') and _is_send(body, block):
+        recipients.append(block['link_as_account'])
+    text = json.dumps(block)
+    return [{'account': account, 'hash': body['hash'], 'amount': body.get('amount'), 'block': text}
+            for account in OrderedDict.fromkeys(accounts.normalize(recipient) for recipient in recipients)]
+
+
+def _is_send(body, block):
+    return body.get('is_send') in (True, 'true') or body.get('subtype') == 'send' or block.get('type') == 'send'
+
+
+class NotificationQueue:
+    """Durably queues notifications in the ``notification`` table from one writer thread per process.
+
+    Callers block until their notifications are committed so an acknowledged callback is never lost, and
+    everything queued while a commit is running goes into the next one so a burst of blocks costs one
+    transaction per batch rather than one per block.
+    """
+
+    def __init__(self, session=db_session, batch_size=NOTIFICATION_BATCH_SIZE, timeout=NOTIFICATION_ENQUEUE_TIMEOUT):
+        self.session = session
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._pending = []
+        self._changed = threading.Condition()
+        # Threads do not survive a fork so the writer is started lazily in each process
+        self._writer = PerProcess(self._start_writer)
+
+    def put(self, notifications):
+        """Queue ``notifications``, raising ``QueueTimeout`` if they are not written in time."""
+        future = Future()
+        with self._changed:
+            self._pending.append((notifications, future))
+            self._changed.notify()
+        self._writer.get()
+        try:
+            future.result(self.timeout)
+        except FutureTimeout:
+            raise QueueTimeout()
+
+    def _start_writer(self):
+        writer = threading.Thread(target=self._run, name='notification-writer', daemon=True)
+        writer.start()
+        return writer
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._pending:
+                    self._changed.wait()
+                batch, size = [], 0
+                while self._pending and (not batch or size + len(self._pending[0][0]) <= self.batch_size):
+                    batch.append(self._pending.pop(0))
+                    size += len(batch[-1][0])
+            try:
+                self.write([notification for notifications, _ in batch for notification in notifications])
+            except Exception as e:
+                logger.exception('Failed to queue notifications')
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+    def write(self, notifications):
+        """Insert the notifications which are not already queued, returning how many were inserted."""
+        unique = OrderedDict(((n['account'], n['hash']), n) for n in notifications)
+        try:
+            existing = set(self.session.query(Notification.account, Notification.hash)
+                           .filter(Notification.hash.in_({block_hash for _, block_hash in unique})))
+            new = [notification for key, notification in unique.items() if key not in existing]
+            if new:
+                self.session.execute(Notification.__table__.insert(), new)
+            self.session.commit()
+            return len(new)
+        except IntegrityError:
+            # Another process queued one of the blocks first, fall back to inserting them one at a time
+            self.session.rollback()
+            return sum(self._write_one(notification) for notification in new)
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.remove()
+
+    def _write_one(self, notification):
+        try:
+            self.session.execute(Notification.__table__.insert(), notification)
+            self.session.commit()
+            return 1
+        except IntegrityError:
+            self.session.rollback()
+            return 0
+
+
+queue = NotificationQueue()
+
+
+def ingest(body, notification_queue=None):
+    """Queue notifications for the subscribed accounts in a node callback, returning how many were matched."""
+    try:
+        candidates = parse_callback(body)
+    except InvalidCallback:
+        callback_blocks.inc(result='invalid')
+        raise
+    subscribed = set(subscribed_accounts.matching([candidate['account'] for candidate in candidates]))
+    matched = [candidate for candidate in candidates if candidate['account'] in subscribed]
+    if not matched:
+        callback_blocks.inc(result='ignored')
+        return 0
+    with notification_enqueue_duration.time():
+        (notification_queue or queue).put(matched)
+    callback_blocks.inc(result='matched')
+    return len(matched)
+
+
+def claim(session, channel, batch_size, settle=NOTIFICATION_CLAIM_SETTLE, clock=datetime.datetime.utcnow):
+    """Return the ids and accounts of the next notifications for a delivery ``channel`` and record them as claimed.
+
+    Ids are assigned when notifications are inserted but they become visible when their transaction commits, which
+    may be after a higher id's, so each claimed notification is recorded rather than only the highest id. The
+    channel's cursor then moves past the notifications which are all claimed and older than ``settle`` seconds, so
+    only recent notifications are checked against the claims. Nothing is recorded until ``session`` commits, so the
+    channel must queue its deliveries in the same transaction, and two processes claiming the same notifications
+    fail to commit rather than both deliver them.
+    """
+    cursor = session.query(NotificationCursor).get(channel)
+    if cursor is None:
+        cursor = NotificationCursor(channel)
+        session.add(cursor)
+    claimed = exists().where(NotificationClaim.channel == channel) \
+        .where(NotificationClaim.notification_id == Notification.id)
+    rows = session.query(Notification.id, Notification.account) \
+        .filter(Notification.id > cursor.last_id) \
+        .filter(~claimed) \
+        .order_by(Notification.id) \
+        .limit(batch_size) \
+        .all()
+    if rows:
+        session.execute(NotificationClaim.__table__.insert(),
+                        [{'channel': channel, 'notification_id': row.id} for row in rows])
+    # Every notification before the first unclaimed one is claimed, but only the settled ones can't be joined by more
+    unclaimed = session.query(func.min(Notification.id)) \
+        .filter(Notification.id > cursor.last_id) \
+        .filter(~claimed) \
+        .scalar()
+    settled = session.query(func.max(Notification.id)) \
+        .filter(Notification.id > cursor.last_id) \
+        .filter(Notification.created_at < clock() - datetime.timedelta(seconds=settle)) \
+        .scalar()
+    if settled is not None:
+        last_id = settled if unclaimed is None else min(settled, unclaimed - 1)
+        if last_id > cursor.last_id:
+            session.query(NotificationClaim) \
+                .filter(NotificationClaim.channel == channel) \
+                .filter(NotificationClaim.notification_id <= last_id) \
+                .delete(synchronize_session=False)
+            cursor.last_id = last_id
+    return rows
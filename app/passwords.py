@@ -0,0 +1,138 @@
+import fcntl
+import logging
+import os
+import random
+import threading
+import time
+
+import bcrypt
+
+from app.config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE, PASSWORD_HASH_TIMEOUT, \
+    PASSWORD_HASH_LOCK_DIR
+from app.metrics import password_hash_duration, password_hash_rejected
+from app.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Limits bcrypt across every worker process on the host and sheds load when too much work is queued.
+
+    A hash needs one of ``max_queue`` queue slots, or it is rejected straight away, then one of ``workers`` hashing
+    slots, which it waits up to ``timeout`` seconds for before it is rejected too. The slots are locks on files in
+    ``directory`` so they are shared by every worker process as well as the threads of each, and a slot held by a
+    worker which is killed is freed with it.
+    """
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE,
+                 timeout=PASSWORD_HASH_TIMEOUT, directory=PASSWORD_HASH_LOCK_DIR):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.directory = directory
+        self._pending = 0
+        self._lock = threading.Lock()
+        # A forked worker opens the slot files itself as the lock is held by the open file, which it would share
+        self._queue = PerProcess(lambda: _Slots(directory, 'queue', max_queue), close=_Slots.close)
+        self._hashing = PerProcess(lambda: _Slots(directory, 'hash', workers), close=_Slots.close)
+
+    @property
+    def pending(self):
+        """Hashes queued or running in this process."""
+        return self._pending
+
+    def hash(self, password):
+        return self._run('hash', bcrypt.hashpw, _encode(password), bcrypt.gensalt(self.rounds))
+
+    def check(self, password, hashed):
+        return self._run('check', bcrypt.checkpw, _encode(password), _encode(hashed))
+
+    def needs_rehash(self, hashed):
+        # bcrypt hashes look like $2b$<rounds>$<salt and hash>
+        try:
+            return int(_encode(hashed).split(b'$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, operation, fn, *args):
+        queue, hashing = self._queue.get(), self._hashing.get()
+        queued = queue.acquire()
+        if queued is None:
+            password_hash_rejected.inc()
+            raise HashingOverloaded(f'{self.max_queue} password hashes already queued')
+        with self._lock:
+            self._pending += 1
+        try:
+            with password_hash_duration.time(operation=operation):
+                slot = hashing.acquire(self.timeout)
+                if slot is None:
+                    password_hash_rejected.inc()
+                    raise HashingOverloaded(f'No password hashing slot free within {self.timeout:g}s')
+                try:
+                    # bcrypt releases the GIL so the other threads of a threaded worker carry on meanwhile
+                    return fn(*args)
+                finally:
+                    hashing.release(slot)
+        finally:
+            with self._lock:
+                self._pending -= 1
+            queue.release(queued)
+
+
+class _Slots:
+    """``size`` slots, each held by locking its file in ``directory``.
+
+    flock is held by the open file, which the threads of a process share, so each slot also has a lock taken by
+    the thread holding it.
+    """
+
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, directory, name, size):
+        os.makedirs(directory, exist_ok=True)
+        paths = [os.path.join(directory, f'{name}.{i}.lock') for i in range(size)]
+        self._slots = [(threading.Lock(), os.open(path, os.O_RDWR | os.O_CREAT, 0o600)) for path in paths]
+
+    def acquire(self, timeout=0):
+        """Take whichever slot is free first within ``timeout`` seconds, otherwise return ``None``."""
+        deadline = time.monotonic() + timeout
+        while True:
+            for slot in random.sample(self._slots, len(self._slots)):
+                if self._take(slot):
+                    return slot
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(self.POLL_INTERVAL, max(0, deadline - time.monotonic())))
+
+    def release(self, slot):
+        lock, fd = slot
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        lock.release()
+
+    def close(self):
+        for _, fd in self._slots:
+            os.close(fd)
+
+    @staticmethod
+    def _take(slot):
+        lock, fd = slot
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            lock.release()
+            return False
+
+
+def _encode(value):
+    return value.encode() if isinstance(value, str) else value
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,125 @@
+import datetime
+import logging
+import time
+from itertools import chain
+
+from sqlalchemy import exists, func
+
+from app import history
+from app.config import PREFETCH_BATCH_SIZE, PREFETCH_INTERVAL, PREFETCH_RECENT, PREFETCH_NODE_SHARE, \
+    PREFETCH_MAX_DELAY, PREFETCH_HISTORY_COUNT, TRANSACTION_SYNC_MAX_AGE
+from app.database import db_session
+from app.metrics import registry, prefetch_accounts, prefetch_batch_duration
+from app.models import AccountHistory, Notification, Subscription
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Keeps the stored history of every subscribed account synced with the node, so the first view of an account
+    reads the store rather than waiting on the node.
+
+    Each pass refreshes the accounts viewed or active within ``recent`` seconds first, most recent first, then walks
+    the other subscribed accounts in batches. The pause after a batch is scaled to how long the node took over it so
+    the prefetcher keeps the node busy at most ``node_share`` of the time, and backs off further when the node fails.
+    """
+
+    def __init__(self, session=db_session, refresh=history.refresh, batch_size=PREFETCH_BATCH_SIZE,
+                 recent=PREFETCH_RECENT, node_share=PREFETCH_NODE_SHARE, max_delay=PREFETCH_MAX_DELAY,
+                 count=PREFETCH_HISTORY_COUNT, clock=datetime.datetime.utcnow, timer=time.monotonic,
+                 sleep=time.sleep):
+        self.session = session
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.recent = recent
+        self.node_share = node_share
+        self.max_delay = max_delay
+        self.count = count
+        self.clock = clock
+        self.timer = timer
+        self.sleep = sleep
+        self.delay = 0
+
+    def run(self, interval=PREFETCH_INTERVAL):
+        if TRANSACTION_SYNC_MAX_AGE < interval:
+            logger.warning(f'TRANSACTION_SYNC_MAX_AGE is {TRANSACTION_SYNC_MAX_AGE:g}s, less than the {interval:g}s '
+                           f'between passes, so views will still wait on the node for most prefetched accounts. '
+                           f'Set it to about {2 * interval:g}s')
+        while True:
+            start = self.timer()
+            try:
+                refreshed = self.run_once()
+                logger.info(f'Prefetched {refreshed} accounts in {self.timer() - start:.1f}s')
+            except Exception:
+                logger.exception('Prefetching failed')
+                self.session.rollback()
+            finally:
+                self.session.remove()
+            registry.maybe_flush()
+            self.sleep(max(0, interval - (self.timer() - start)))
+
+    def run_once(self):
+        """Refresh every subscribed account once, returning how many were refreshed."""
+        refreshed = 0
+        for accounts in self.batches():
+            refreshed += self.prefetch(accounts)
+        return refreshed
+
+    def batches(self):
+        """Batches of subscribed accounts, the recently viewed or active ones first."""
+        recent = self.recent_accounts()
+        for start in range(0, len(recent), self.batch_size):
+            yield recent[start:start + self.batch_size]
+        recent = set(recent)
+        after = ''
+        while True:
+            page = [account for account, in self.session.query(Subscription.account).distinct()
+                    .filter(Subscription.account > after)
+                    .order_by(Subscription.account)
+                    .limit(self.batch_size)]
+            # Don't hold a transaction open while the node is asked for the batch
+            self.session.commit()
+            if not page:
+                return
+            after = page[-1]
+            accounts = [account for account in page if account not in recent]
+            if accounts:
+                yield accounts
+
+    def recent_accounts(self):
+        """Subscribed accounts viewed or sent a block within ``recent`` seconds, most recent first."""
+        since = self.clock() - datetime.timedelta(seconds=self.recent)
+        viewed = self.session.query(AccountHistory.account, AccountHistory.viewed_at) \
+            .filter(AccountHistory.viewed_at >= since) \
+            .filter(exists().where(Subscription.account == AccountHistory.account))
+        active = self.session.query(Notification.account, func.max(Notification.created_at)) \
+            .filter(Notification.created_at >= since) \
+            .filter(exists().where(Subscription.account == Notification.account)) \
+            .group_by(Notification.account)
+        latest = {}
+        for account, at in chain(viewed, active):
+            latest[account] = max(at, latest.get(account, at))
+        self.session.commit()
+        return sorted(latest, key=lambda account: (latest[account], account), reverse=True)
+
+    def prefetch(self, accounts):
+        """Refresh a batch of accounts then wait for long enough to keep within the node share."""
+        start = self.timer()
+        refreshed = len(self.refresh(accounts, self.count))
+        elapsed = self.timer() - start
+        prefetch_batch_duration.observe(elapsed)
+        prefetch_accounts.inc(refreshed, result='refreshed')
+        if refreshed < len(accounts):
+            prefetch_accounts.inc(len(accounts) - refreshed, result='failed')
+            # The node is struggling (or its circuit breaker is open) so give it longer each time
+            self.delay = min(self.max_delay, max(2 * self.delay, elapsed, 1))
+        else:
+            self.delay = min(self.max_delay, elapsed * (1 - self.node_share) / self.node_share)
+        # A pass over every subscribed account can take a long while so the metrics are written out as it goes
+        registry.maybe_flush()
+        self.sleep(self.delay)
+        return refreshed
+
+
+if __name__ == '__main__':
+    Prefetcher().run()
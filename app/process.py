@@ -0,0 +1,43 @@
+import os
+import threading
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+class PerProcess:
+    """A value created lazily by each process the first time it is asked for.
+
+    Threads, sockets and pools don't survive a fork, so a worker forked from a preloaded parent creates its own
+    rather than using the parent's. ``close`` is called with the value when it is reset by the process which created
+    it, a value inherited from the parent is just dropped.
+    """
+
+    def __init__(self, factory, close=None):
+        self.factory = factory
+        self.close = close
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def reset(self):
+        with self._lock:
+            value, pid = self._value, self._pid
+            self._value = self._pid = None
+        if value is not None and pid == os.getpid() and self.close:
+            self.close(value)
+
+
+def reset():
+    """Reset every per process value, called in a worker once it is forked."""
+    for instance in list(_instances):
+        instance.reset()
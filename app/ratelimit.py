@@ -0,0 +1,192 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from app.config import RATE_LIMIT_ENABLED, RATE_LIMIT_STORE, RATE_LIMIT_STORE_TIMEOUT, RATE_LIMIT_MEMORY_SIZE, \
+    RATE_LIMIT_TRUSTED_PROXIES, RATE_LIMIT_REGISTER_IP, RATE_LIMIT_SUBSCRIBE_IP, RATE_LIMIT_SUBSCRIBE_ACCOUNT, \
+    RATE_LIMIT_TRANSACTIONS_IP, RATE_LIMIT_IMPORT_IP
+from app.metrics import rate_limit_requests, rate_limit_store_duration, rate_limit_store_errors
+from app.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class Limit(namedtuple('Limit', ['burst', 'period'])):
+    """A token bucket holding ``burst`` requests which refills at ``burst`` requests per ``period`` seconds."""
+
+    @classmethod
+    def parse(cls, text):
+        """Parse ``<burst>/<seconds>``, returning ``None`` for an empty string so a limit can be switched off."""
+        if not text:
+            return None
+        burst, period = text.split('/')
+        return cls(int(burst), float(period))
+
+    @property
+    def rate(self):
+        return self.burst / self.period
+
+
+def take(tokens, updated, limit, now, cost=1):
+    """Take ``cost`` tokens from a bucket last left with ``tokens`` at ``updated``.
+
+    Returns the tokens left, how long to wait before retrying (0 when the request is allowed) and when the bucket
+    will be full again, after which it can be forgotten. A cost above the burst takes the whole bucket.
+    """
+    cost = min(cost, limit.burst)
+    tokens = limit.burst if tokens is None else min(limit.burst, tokens + (now - updated) * limit.rate)
+    if tokens >= cost:
+        tokens -= cost
+        wait = 0
+    else:
+        wait = (cost - tokens) / limit.rate
+    return tokens, wait, now + (limit.burst - tokens) / limit.rate
+
+
+class MemoryStore:
+    """Buckets for this process only, so each worker enforces its own share of a limit."""
+
+    blocking = False
+
+    def __init__(self, maxsize=RATE_LIMIT_MEMORY_SIZE):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, now, cost=1):
+        with self._lock:
+            tokens, updated, _ = self._buckets.pop(key, (None, None, None))
+            tokens, wait, full_at = take(tokens, updated, limit, now, cost)
+            self._buckets[key] = (tokens, now, full_at)
+            # Drop the least recently used buckets, starting with any that have refilled anyway
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteStore:
+    """Buckets in a SQLite database shared by every worker on the host, so a limit applies across all of them.
+
+    Each take is a single ``BEGIN IMMEDIATE`` transaction. Any other store with the same ``take`` and ``clear``,
+    such as one backed by Redis, can be used in its place.
+    """
+
+    blocking = True
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, timeout=RATE_LIMIT_STORE_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        # One connection per thread, opened again in a forked worker rather than shared with its parent
+        self._local = PerProcess(threading.local)
+        self._takes = 0
+        with self._connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS rate_limit '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, '
+                               'full_at REAL NOT NULL)')
+
+    def take(self, key, limit, now, cost=1):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM rate_limit WHERE key = ?', (key,)).fetchone()
+            tokens, wait, full_at = take(row[0] if row else None, row[1] if row else None, limit, now, cost)
+            connection.execute('INSERT OR REPLACE INTO rate_limit (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                               (key, tokens, now, full_at))
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                connection.execute('DELETE FROM rate_limit WHERE full_at < ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM rate_limit')
+
+    def _connection(self):
+        local = self._local.get()
+        if not hasattr(local, 'connection'):
+            local.connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                            check_same_thread=False)
+        return local.connection
+
+
+def create_store(url=RATE_LIMIT_STORE):
+    """``memory`` for a store per process or ``sqlite:///<path>`` for one shared through a SQLite file."""
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported rate limit store {url}')
+
+
+class RateLimiter:
+    """Token bucket rate limits per client IP and per account.
+
+    ``limits`` maps ``(name, 'ip' | 'account')`` to a :class:`Limit`. A store that fails lets the request through
+    rather than taking the endpoint down with it.
+    """
+
+    def __init__(self, store, limits, enabled=RATE_LIMIT_ENABLED, clock=time.time):
+        self.store = store
+        self.limits = limits
+        self.enabled = enabled
+        self.clock = clock
+
+    def check(self, name, ip=None, account=None, cost=1):
+        """Take ``cost`` tokens from each of the request's buckets, returning the seconds to wait or 0 if it is
+        allowed."""
+        if not self.enabled:
+            return 0
+        for scope, value in (('ip', ip), ('account', account)):
+            limit = self.limits.get((name, scope))
+            if limit is None or value is None:
+                continue
+            start = time.perf_counter()
+            try:
+                wait = self.store.take(f'{name}:{scope}:{value}', limit, self.clock(), cost)
+            except Exception:
+                logger.exception(f'Rate limit store failed for {name}')
+                rate_limit_store_errors.inc()
+                return 0
+            finally:
+                rate_limit_store_duration.observe(time.perf_counter() - start, store=type(self.store).__name__)
+            if wait:
+                rate_limit_requests.inc(limit=name, scope=scope, result='limited')
+                return wait
+            rate_limit_requests.inc(limit=name, scope=scope, result='allowed')
+        return 0
+
+
+def retry_after(wait):
+    """The Retry-After header value for a wait, rounded up to whole seconds."""
+    return str(max(1, math.ceil(wait)))
+
+
+def client_ip(remote_addr, forwarded_for=None, trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES):
+    """The client's address, taken from X-Forwarded-For when there are ``trusted_proxies`` in front of the app."""
+    if trusted_proxies and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        if len(addresses) >= trusted_proxies:
+            return addresses[-trusted_proxies]
+    return remote_addr
+
+
+limiter = RateLimiter(create_store(), {
+    ('register', 'ip'): Limit.parse(RATE_LIMIT_REGISTER_IP),
+    ('subscribe', 'ip'): Limit.parse(RATE_LIMIT_SUBSCRIBE_IP),
+    ('subscribe', 'account'): Limit.parse(RATE_LIMIT_SUBSCRIBE_ACCOUNT),
+    ('transactions', 'ip'): Limit.parse(RATE_LIMIT_TRANSACTIONS_IP),
+    ('import', 'ip'): Limit.parse(RATE_LIMIT_IMPORT_IP),
+})
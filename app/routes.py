@@ -1,25 +1,42 @@
 import datetime
+import hmac
 import logging
 import re
+import time
+from collections import OrderedDict
+from functools import wraps
 
-import bcrypt
 import flask
 import requests
-from flask import render_template, Blueprint, url_for, request, Response, json
+from flask import render_template, Blueprint, url_for, request, Response, json, stream_with_context
 from flask_login import login_required, login_user, current_user, logout_user
 from requests import RequestException
-from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.utils import redirect
 
-from app.config import RECAPTCHA_SECRET, NANO_HOST
+from app import accounts, assets, bulk, compression, metrics, notifications, ratelimit, templating
+from app.config import RECAPTCHA_SECRET, HISTORY_BATCH_MAX_ACCOUNTS, HISTORY_MAX_COUNT, INTERNAL_TOKEN, \
+    SUBSCRIBERS_MAX_ACCOUNTS, SESSION_REFRESH_FRACTION, SUBSCRIPTIONS_PAGE_SIZE, \
+    SUBSCRIPTIONS_MAX_PAGE_SIZE, STATIC_MAX_AGE
 from app.database import db_session
+from app.history import account_history, accounts_history, history_cache
+from app.metrics import request_duration
 from app.models import Subscription, User
+from app.passwords import hasher, HashingOverloaded
+from app.subscribers import subscribers_for, mark_changed
 
 logger = logging.getLogger(__name__)
 
+RECAPTCHA_VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+RECAPTCHA_VERIFIED_ENVIRON = 'nanotify.recaptcha_verified'
+# The name of the rate limit the asyncio server already took the request's tokens for
+RATE_LIMIT_CHECKED_ENVIRON = 'nanotify.rate_limit_checked'
+block_hash_regex = re.compile(r'[0-9A-Fa-f]{64}\Z')
+
 nano = Blueprint('profile', __name__, template_folder='templates', static_folder='static')
 
+email_regex = re.compile(r'(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)')
+
 url_regex = re.compile(
         r'^(?:http|ftp)s?://' # http:// or https://
         r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
@@ -44,32 +61,114 @@ def shutdown_session(exception=None):
 
 @nano.before_request
 def before_request():
-    flask.session.permanent = True
+    if not flask.session.permanent:
+        flask.session.permanent = True
     nano.permanent_session_lifetime = datetime.timedelta(minutes=30)
-    flask.session.modified = True
+    _refresh_session()
     flask.g.user = current_user
 
 
+@nano.before_app_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@nano.after_app_request
+def observe_request_duration(response):
+    start = flask.g.get('request_start')
+    if start is not None:
+        request_duration.observe(time.perf_counter() - start, endpoint=request.endpoint or 'none',
+                                 method=request.method, status=response.status_code)
+    metrics.registry.maybe_flush()
+    return response
+
+
+@nano.after_app_request
+def compress_response(response):
+    return compression.compress(response, request.headers.get('Accept-Encoding'))
+
+
+@nano.after_app_request
+def cache_static(response):
+    # Fingerprinted URLs change with the file so their responses never go stale
+    if request.endpoint == 'static' and response.status_code in (200, 304) \
+            and assets.is_fingerprinted(request.view_args.get('filename'), request.args.get('v')):
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    return response
+
+
+@nano.app_template_global()
+def static_url(filename):
+    return assets.static_url(filename)
+
+
+def _refresh_session():
+    # Only re-sign the session cookie once it is part way to expiring rather than on every response
+    now = int(time.time())
+    lifetime = flask.current_app.permanent_session_lifetime.total_seconds()
+    if now - flask.session.get('_refreshed', 0) > lifetime * SESSION_REFRESH_FRACTION:
+        flask.session['_refreshed'] = now
+
+
 @nano.app_errorhandler(RequestException)
 def handle_request_exception(e):
     logger.exception(str(e))
     return Response(status=500)
 
 
+@nano.app_errorhandler(HashingOverloaded)
+def handle_hashing_overloaded(e):
+    logger.warning(str(e))
+    return Response(status=429, headers={'Retry-After': '1'})
+
+
 @nano.app_errorhandler(Exception)
 def handle_exception(e):
     logger.exception(str(e))
     return render_template('error.html', error='Invalid email or password')
 
 
+def rate_limited(name, account=None, cost=None):
+    # Answers 429 once the client, or the account the request is for, has used up its limit. ``account`` picks the
+    # account out of the view's arguments and ``cost`` how many tokens the request takes
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.environ.get(RATE_LIMIT_CHECKED_ENVIRON) == name:
+                return f(*args, **kwargs)
+            ip = ratelimit.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+            wait = ratelimit.limiter.check(name, ip=ip, account=account(kwargs) if account else None,
+                                           cost=cost(kwargs) if cost else 1)
+            if wait:
+                return Response(status=429, headers={'Retry-After': ratelimit.retry_after(wait)})
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+def _body_account(kwargs):
+    body = request.get_json(silent=True)
+    account = accounts.normalize(body.get('account')) if isinstance(body, dict) else None
+    return None if _is_invalid_account(account) else account
+
+
+def _batch_cost(body):
+    # A batch takes a token per account so it costs the same as viewing each of its accounts
+    requested = body.get('accounts') if isinstance(body, dict) else None
+    return len(requested) if isinstance(requested, list) and requested else 1
+
+
 @nano.route('/', methods=['POST'])
 def login():
     email = request.form['email']
     password = request.form['password']
-    user = db_session.query(User).filter(func.lower(User.email) == func.lower(email)).first()
+    user = db_session.query(User).filter(User.email_lower == email.lower()).first()
     logger.info(f'Attempt to login user {email}')
-    if user and bcrypt.checkpw(password.encode(), user.password):
+    if user and hasher.check(password, user.password):
         logger.info(f'{email} logged in')
+        if hasher.needs_rehash(user.password):
+            logger.info(f'Rehashing password for {email} with {hasher.rounds} rounds')
+            user.password = hasher.hash(password)
         login_user(user)
         return redirect(url_for('.subscribe'))
     else:
@@ -84,22 +183,19 @@ def logout():
 
 
 @nano.route('/register', methods=['POST'])
+@rate_limited('register')
 def get_register():
-    if RECAPTCHA_SECRET:
-        data = {'secret': RECAPTCHA_SECRET, 'response': request.form.get('g-recaptcha-response'),
-                'remoteip': request.remote_addr}
-        response = requests.post('https://www.google.com/recaptcha/api/siteverify', data=data).json()
-        if not response.get('success'):
-            return render_template('register.html', error='Invalid reCAPTCHA')
+    if RECAPTCHA_SECRET and not _is_recaptcha_verified():
+        return render_template('register.html', error='Invalid reCAPTCHA')
     email = request.form.get('email')
     password = request.form.get('password')
-    if not email or not password or not re.match('(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)', email):
+    if not email or not password or not email_regex.match(email):
         return render_template('register.html', error='Enter a valid email and password')
     if len(password) < 8:
         return render_template('register.html', error='Password must be more than 8 characters')
 
     logger.info(f'Registering {email}')
-    password = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    password = hasher.hash(password)
     user = User(email, password)
     db_session.add(user)
     return redirect(url_for('.get_login'))
@@ -118,71 +214,284 @@ def get_login():
 @nano.route('/subscribe', methods=['POST'])
 @login_required
 def subscribe():
-    account = request.form.get('account')
-    subscriptions = _get_subscriptions_for_user()
+    account = accounts.normalize(request.form.get('account'))
     if _is_invalid_account(account):
-        return render_template('subscribe.html', error='Add an account in the correct format', subscriptions=subscriptions)
+        return _render_subscriptions(error='Add an account in the correct format')
+    email_lower = current_user.email.lower()
     if request.form['action'] == 'delete':
         logger.info(f'{current_user.email} deleting subscription to {account}')
-        for subscription in subscriptions:
-            if subscription.account == account:
-                subscriptions.remove(subscription)
-                db_session.delete(subscription)
-    elif not db_session.query(Subscription).filter(func.lower(Subscription.email) == func.lower(current_user.email)) \
+        deleted = db_session.query(Subscription).filter(Subscription.email_lower == email_lower) \
+            .filter(Subscription.account == account).delete(synchronize_session=False)
+        if deleted:
+            mark_changed(db_session(), [account])
+    elif not db_session.query(Subscription.id).filter(Subscription.email_lower == email_lower) \
             .filter(Subscription.account == account).first():
         logger.info(f'{current_user.email} adding subscription to {account}')
-        subscription = Subscription(account=account, email=current_user.email, webhook=current_user.webhook)
-        db_session.add(subscription)
-        subscriptions.append(subscription)
-    return render_template('subscribe.html', subscriptions=subscriptions)
+        db_session.add(Subscription(account=account, email=current_user.email))
+    # Committed before the page streams rather than at teardown, after the response has gone out
+    db_session.commit()
+    return _render_subscriptions()
 
 
 @nano.route('/transactions/<account>', methods=['GET'])
+@rate_limited('transactions')
 def get_transactions(account):
-    if _is_invalid_account(account):
+    account = accounts.normalize(account)
+    count, before = request.args.get('count', 10, type=int), request.args.get('before')
+    if _is_invalid_account(account) or not 0 < count <= HISTORY_MAX_COUNT:
+        return Response(status=400)
+    history = older_than(account_history(account, count + 1, before), before) if before \
+        else account_history(account, count)
+    response = Response(json.dumps(history), mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+    response.set_etag(history_etag(history, count), weak=True)
+    return response.make_conditional(request)
+
+
+def history_etag(history, count):
+    # History only changes when a block is added, so a page is identified by its first block and its length
+    return f'{history[0].get("hash") if history else "empty"}-{count}'
+
+
+def older_than(history, before):
+    # A page continues from the last block of the previous one, which history starting from it includes first
+    return [block for block in history if block.get('hash') != before][:len(history) - 1]
+
+
+@nano.route('/transactions/<account>/events', methods=['GET'])
+@nano.route('/transactions/<account>/poll', methods=['GET'])
+def get_transaction_feed(account):
+    # An open feed holds the worker serving it for as long as the client waits, so a handful of clients would take
+    # every gunicorn worker. The feed is only served by the asyncio mode, which holds it on the event loop instead
+    return Response(status=501)
+
+
+@nano.route('/transactions', methods=['POST'])
+@rate_limited('transactions', cost=lambda kwargs: _batch_cost(request.get_json(silent=True)))
+def get_transactions_batch():
+    try:
+        accounts, count, heads = _parse_batch_request(request.get_json(silent=True))
+    except InvalidBatchRequest as e:
+        return Response(json.dumps({'invalid': e.invalid}) if e.invalid else None, status=400,
+                        mimetype='application/json')
+    return Response(json.dumps(accounts_history(accounts, count, heads)), mimetype='application/json')
+
+
+class InvalidBatchRequest(ValueError):
+
+    def __init__(self, invalid=None):
+        super().__init__(invalid)
+        self.invalid = invalid or []
+
+
+def _parse_batch_request(body):
+    body = body if isinstance(body, dict) else {}
+    requested = body.get('accounts')
+    count = body.get('count', 10)
+    # head maps an account to the block hash its history should start from
+    heads = body.get('head') or {}
+    if not isinstance(requested, list) or not requested or len(requested) > HISTORY_BATCH_MAX_ACCOUNTS:
+        raise InvalidBatchRequest()
+    # bool is an int too, and a head ends up in the history cache's keys so it has to be a block hash
+    if type(count) is not int or not 0 < count <= HISTORY_MAX_COUNT or not isinstance(heads, dict) \
+            or not all(isinstance(head, str) and block_hash_regex.match(head) for head in heads.values()):
+        raise InvalidBatchRequest()
+    valid, invalid = accounts.validate_many(requested)
+    if invalid:
+        logger.info(f'Invalid accounts {invalid}')
+        raise InvalidBatchRequest(invalid)
+    heads = {accounts.normalize(account): head for account, head in heads.items()}
+    return list(OrderedDict.fromkeys(valid)), count, heads
+
+
+def internal_only(f):
+    # Internal endpoints need the shared token. Without one only local callers are allowed, and only in debug or
+    # testing since behind a reverse proxy every request comes from a local address.
+    # The node's HTTP callback can't send headers so it may pass the token in the query string instead
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if INTERNAL_TOKEN:
+            authorization = request.headers.get('Authorization', '')
+            token = request.headers.get('X-Internal-Token') \
+                or (authorization[len('Bearer '):] if authorization.startswith('Bearer ') else None) \
+                or request.args.get('token') or ''
+            if not hmac.compare_digest(token.encode(), INTERNAL_TOKEN.encode()):
+                return Response(status=403)
+        elif not (flask.current_app.debug or flask.current_app.testing) \
+                or request.remote_addr not in ('127.0.0.1', '::1'):
+            return Response(status=403)
+        return f(*args, **kwargs)
+    return decorated
+
+
+def read_only(f):
+    # Queries made by the view go to the read replica (when one is configured) instead of the primary
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        flask.g.read_only = True
+        return f(*args, **kwargs)
+    return decorated
+
+
+@nano.route('/internal/stats/history', methods=['GET'])
+@internal_only
+def get_history_cache_stats():
+    return json.dumps(history_cache.stats())
+
+
+@nano.route('/metrics', methods=['GET'])
+@internal_only
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@nano.route('/internal/subscribers', methods=['POST'])
+@internal_only
+@read_only
+def get_subscribers():
+    body = request.get_json(silent=True) or {}
+    requested = body.get('accounts')
+    if not isinstance(requested, list) or not requested or len(requested) > SUBSCRIBERS_MAX_ACCOUNTS:
+        return Response(status=400)
+    valid, invalid = accounts.validate_many(requested)
+    if invalid:
+        return Response(status=400)
+    subscribers = subscribers_for(valid)
+    return Response(json.dumps({account: [subscriber._asdict() for subscriber in account_subscribers]
+                                for account, account_subscribers in subscribers.items()}),
+                    mimetype='application/json')
+
+
+@nano.route('/internal/callback', methods=['POST'])
+@internal_only
+def node_callback():
+    try:
+        notifications.ingest(request.get_json(force=True, silent=True))
+    except notifications.InvalidCallback:
         return Response(status=400)
-    data = {
-        'action': 'account_history',
-        'account': account,
-        'count': 10
-    }
-    transactions = requests.post(f'http://{NANO_HOST}:7076', json.dumps(data))
-    return json.dumps(transactions.json().get('history', []))
+    except notifications.QueueTimeout:
+        logger.error('Timed out queueing notifications for a node callback')
+        return Response(status=503)
+    return Response(status=200)
 
 
 @nano.route('/mobile/subscribe', methods=['POST'])
+@rate_limited('subscribe', account=_body_account)
 def mobile_subscribe():
-    account = request.json.get('account')
+    account = accounts.normalize(request.json.get('account'))
     if _is_invalid_account(account):
         logger.info(f'Invalid account {account}')
         return Response(status=400)
 
-    if not db_session.query(Subscription).filter(func.lower(Subscription.account) == func.lower(account)) \
-            .filter(Subscription.account == account).first():
-        logger.info(f'Subscribing to {account}')
-        subscription = Subscription(account=account)
-        db_session.add(subscription)
-    else:
+    if not _add_mobile_subscription(account):
         return Response(status=409)
 
     return Response(status=201)
 
 
+@nano.route('/mobile/subscribe/import', methods=['POST'])
+@rate_limited('import')
+def mobile_import_subscriptions():
+    return _import_subscriptions()
+
+
+@nano.route('/subscribe/import', methods=['POST'])
+@login_required
+@rate_limited('import')
+def import_subscriptions():
+    return _import_subscriptions(current_user.email)
+
+
+@nano.route('/subscribe/export', methods=['GET'])
+@login_required
+@read_only
+def export_subscriptions():
+    fmt = bulk.format_for(None, request.args.get('format', bulk.CSV))
+    if not fmt:
+        return Response(status=400)
+    logger.info(f'{current_user.email} exporting subscriptions as {fmt}')
+    lines = bulk.export_subscriptions(current_user.email, fmt)
+    return Response(stream_with_context(lines), mimetype=bulk.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=subscriptions.{fmt}'})
+
+
+def _import_subscriptions(email=None):
+    fmt = bulk.format_for(request.mimetype, request.args.get('format'))
+    if not fmt:
+        return Response(status=400)
+    lines = bulk.parse_accounts(request.stream, fmt)
+    try:
+        result = bulk.import_subscriptions(lines, email=email)
+    except bulk.TooManyAccounts as e:
+        db_session.rollback()
+        return Response(json.dumps({'error': str(e)}), status=413, mimetype='application/json')
+    logger.info(f'{email or "Mobile"} imported {result.imported} subscriptions')
+    return Response(json.dumps(result._asdict()), mimetype='application/json')
+
+
+def _add_mobile_subscription(account):
+    if db_session.query(Subscription).filter(Subscription.account == account).first():
+        return False
+    logger.info(f'Subscribing to {account}')
+    subscription = Subscription(account=account)
+    db_session.add(subscription)
+    return True
+
+
+def _is_recaptcha_verified():
+    # the asyncio server verifies the reCAPTCHA before handing the request over
+    verified = request.environ.get(RECAPTCHA_VERIFIED_ENVIRON)
+    if verified is None:
+        data = {'secret': RECAPTCHA_SECRET, 'response': request.form.get('g-recaptcha-response'),
+                'remoteip': request.remote_addr}
+        response = requests.post(RECAPTCHA_VERIFY_URL, data=data).json()
+        verified = bool(response.get('success'))
+    return verified
+
+
 def _is_invalid_account(account):
-    return not account or not re.match('xrb_[a-zA-Z0-9]{60}', account)
+    return not account or not accounts.is_valid(account)
 
 
-def _get_subscriptions_for_user():
-    return db_session.query(Subscription).filter(Subscription.email == current_user.email).all()
+def _get_subscriptions_page(after, prefix, limit):
+    """Return a page of the user's subscribed accounts in account order and the cursor for the next page, if any.
+
+    Pages are read with a range scan of the (email_lower, account) index from ``after`` rather than an offset.
+    """
+    query = db_session.query(Subscription.account).filter(Subscription.email_lower == current_user.email.lower())
+    if after:
+        query = query.filter(Subscription.account > after)
+    if prefix:
+        query = query.filter(Subscription.account.startswith(accounts.normalize(prefix), autoescape=True))
+    page = query.order_by(Subscription.account).limit(limit + 1).all()
+    return page[:limit], page[limit - 1].account if len(page) > limit else None
+
+
+def _render_subscriptions(**context):
+    after, prefix = request.args.get('after'), request.args.get('q')
+    subscriptions, next_after = _get_subscriptions_page(after, prefix, SUBSCRIPTIONS_PAGE_SIZE)
+    return templating.stream_template('subscribe.html', subscriptions=subscriptions, after=after, q=prefix,
+                                      next_after=next_after, **context)
 
 
 @nano.route('/subscribe', methods=['GET'])
 @login_required
+@read_only
 def get_subscribe():
     email = current_user.email
     logger.info(f'{email} getting subscriptions')
-    subscriptions = db_session.query(Subscription).filter(func.lower(Subscription.email) == func.lower(current_user.email)).all()
-    return render_template('subscribe.html', subscriptions=subscriptions)
+    return _render_subscriptions()
+
+
+@nano.route('/subscriptions', methods=['GET'])
+@login_required
+@read_only
+def get_subscriptions():
+    limit = min(request.args.get('limit', SUBSCRIPTIONS_PAGE_SIZE, type=int), SUBSCRIPTIONS_MAX_PAGE_SIZE)
+    if limit < 1:
+        return Response(status=400)
+    subscriptions, next_after = _get_subscriptions_page(request.args.get('after'), request.args.get('q'), limit)
+    return Response(json.dumps({'subscriptions': [subscription.account for subscription in subscriptions],
+                                'next': next_after}), mimetype='application/json')
 
 
 @nano.route('/settings', methods=['GET'])
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+
+from app.cache import TTLCache
+from app.config import SUBSCRIBERS_CACHE_SIZE, SUBSCRIBERS_CACHE_TTL, SUBSCRIBED_ACCOUNTS_TTL
+from app.database import db_session
+from app.metrics import register_cache
+from app.models import Subscription
+from app.users import webhooks_for
+
+Subscriber = namedtuple('Subscriber', ['email', 'webhook'])
+
+# The emails subscribed to each account. Other workers only see a change once their entry expires, so the TTL
+# bounds how stale a lookup can be
+subscribers_cache = TTLCache(maxsize=SUBSCRIBERS_CACHE_SIZE, ttl=SUBSCRIBERS_CACHE_TTL)
+register_cache('subscribers', subscribers_cache)
+
+_QUERY_CHUNK = 500
+
+
+def subscribers_for(accounts):
+    """Map each account to a tuple of its subscribers, with each subscriber's webhook, reading through the caches."""
+    emails = {}
+    missing = []
+    for account in accounts:
+        account_emails = subscribers_cache.get(account)
+        if account_emails is None:
+            missing.append(account)
+        else:
+            emails[account] = account_emails
+    for start in range(0, len(missing), _QUERY_CHUNK):
+        emails.update(_load(missing[start:start + _QUERY_CHUNK]))
+    webhooks = webhooks_for({email.lower() for account_emails in emails.values() for email in account_emails if email})
+    return {account: tuple(Subscriber(email, webhooks[email.lower()] if email else None) for email in account_emails)
+            for account, account_emails in emails.items()}
+
+
+class SubscribedAccounts:
+    """Every account with a subscription, held in memory so incoming blocks can be matched without a query.
+
+    The set is reloaded every ``ttl`` seconds to pick up other workers' subscriptions. Accounts subscribed to in
+    this process are added as soon as they are committed, unsubscribed accounts linger until the next reload.
+    """
+
+    def __init__(self, ttl=SUBSCRIBED_ACCOUNTS_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._accounts = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def matching(self, accounts):
+        """Return which of ``accounts`` have subscribers."""
+        with self._lock:
+            if self._accounts is None or self._clock() - self._loaded_at >= self.ttl:
+                self._accounts = {account for account, in db_session.query(Subscription.account).distinct()}
+                self._loaded_at = self._clock()
+            return [account for account in accounts if account in self._accounts]
+
+    def add(self, *accounts):
+        with self._lock:
+            if self._accounts is not None:
+                self._accounts.update(accounts)
+
+    def clear(self):
+        with self._lock:
+            self._accounts = None
+
+
+subscribed_accounts = SubscribedAccounts()
+
+
+def invalidate(*accounts):
+    for account in accounts:
+        subscribers_cache.delete(account)
+
+
+def mark_changed(session, accounts):
+    # For writes made with Core statements, which don't pass through the ORM flush events
+    session.info.setdefault('changed_subscription_accounts', set()).update(accounts)
+
+
+def _load(accounts):
+    loaded = {account: [] for account in accounts}
+    for account, email in db_session.query(Subscription.account, Subscription.email) \
+            .filter(Subscription.account.in_(accounts)):
+        loaded[account].append(email)
+    loaded = {account: tuple(emails) for account, emails in loaded.items()}
+    for account, emails in loaded.items():
+        subscribers_cache.set(account, emails)
+    return loaded
+
+
+@event.listens_for(db_session.session_factory, 'after_flush')
+def _collect_changed_accounts(session, flush_context):
+    changed = session.info.setdefault('changed_subscription_accounts', set())
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, Subscription):
+            changed.add(instance.account)
+
+
+@event.listens_for(db_session.session_factory, 'after_commit')
+def _invalidate_changed_accounts(session):
+    changed = session.info.pop('changed_subscription_accounts', ())
+    invalidate(*changed)
+    subscribed_accounts.add(*changed)
+
+
+@event.listens_for(db_session.session_factory, 'after_soft_rollback')
+def _discard_changed_accounts(session, previous_transaction):
+    session.info.pop('changed_subscription_accounts', None)
@@ -0,0 +1,64 @@
+import logging
+
+from flask import current_app, Response, stream_with_context
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from app.config import TEMPLATE_CACHE_DIR, TEMPLATE_STREAM_BUFFER
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache 'name' %}...{% endcache %}`` renders its body once per process and reuses the output.
+
+    Only for markup which doesn't depend on the request, so not ``url_for`` or ``static_url`` output which depends on
+    the host and script root of the request rendering it. Nothing is cached while templates auto reload so edits
+    show up in debug.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache={})
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        name = parser.parse_expression()
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cached', [name]), [], [], body).set_lineno(lineno)
+
+    def _cached(self, name, caller):
+        if self.environment.auto_reload:
+            return caller()
+        fragment = self.environment.fragment_cache.get(name)
+        if fragment is None:
+            fragment = self.environment.fragment_cache[name] = caller()
+        return fragment
+
+
+def init_app(app, cache_dir=TEMPLATE_CACHE_DIR):
+    """Set up the app's templates, compiling all of them up front unless they auto reload (in debug by default)."""
+    if cache_dir:
+        # Compiled templates are shared between workers and restarts rather than compiled by each one
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if not app.jinja_env.auto_reload:
+        compile_templates(app)
+
+
+def compile_templates(app):
+    names = app.jinja_env.list_templates(extensions=['html', 'txt'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    logger.info(f'Compiled {len(names)} templates')
+    return names
+
+
+def stream_template(name, buffer_size=TEMPLATE_STREAM_BUFFER, **context):
+    """Like ``render_template`` but sends the page as it renders, ``buffer_size`` template chunks at a time."""
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(name).stream(context)
+    stream.enable_buffering(buffer_size)
+    return Response(stream_with_context(stream), mimetype='text/html')
@@ -0,0 +1,246 @@
+import datetime
+import json
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from sqlalchemy import and_, exists, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
+
+from app import node
+from app.cache import TTLCache
+from app.config import TRANSACTION_SYNC_PAGE_SIZE, TRANSACTION_SYNC_MAX_BLOCKS, TRANSACTION_SYNC_MAX_AGE, \
+    HISTORY_CACHE_SIZE, PREFETCH_VIEW_RESOLUTION, TRANSACTION_UNSUBSCRIBED_TTL, TRANSACTION_EVICT_EVERY
+from app.database import engine
+from app.models import AccountHistory, Subscription, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Steps of _history which ask the node for ``(account, count, head)`` rather than query the database
+FETCH = object()
+
+State = namedtuple('State', ['head', 'tail', 'complete', 'synced_at'])
+
+_state = AccountHistory.__table__
+_blocks = Transaction.__table__
+_memory_lock = threading.Lock()
+# Accounts whose view this process recorded lately, so a view is written at most once per PREFETCH_VIEW_RESOLUTION
+_recent_views = TTLCache(maxsize=HISTORY_CACHE_SIZE, ttl=PREFETCH_VIEW_RESOLUTION)
+_stored = 0
+
+
+def history(account, count=10, head=None, fetch=node.account_history, max_age=0):
+    """Return ``count`` blocks of an account's history from ``head`` (or its newest block) back, newest first.
+
+    Blocks are served from the local store after fetching just the blocks added since it was last synced, unless
+    that was less than ``max_age`` seconds ago, and older blocks are only fetched the first time they are paged to.
+    """
+    steps = _history(account, count, head, max_age)
+    result = None
+    while True:
+        try:
+            step, args = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = fetch(*args) if step is FETCH else step(*args)
+
+
+async def history_async(node_client, db, account, count=10, head=None, max_age=0):
+    """:func:`history` for the event loop, fetching with an ``AsyncNodeClient`` and storing on ``db``'s threads."""
+    steps = _history(account, count, head, max_age)
+    result = None
+    while True:
+        try:
+            step, args = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = await (node_client.account_history(*args) if step is FETCH else db.run(step, *args))
+
+
+def _history(account, count, head, max_age):
+    # Yields (step, args) for the caller to run and send back the result of, so the sync and async paths share it.
+    # History behind a given head never changes so only requests from the newest block sync first
+    if not head:
+        fetched = yield from _sync(account, count, max_age)
+        if fetched is not None:
+            return fetched
+    state = yield _load_state, (account,)
+    entries = yield _read, (account, count, head)
+    if entries is None:
+        # Older than anything stored, so it's not worth walking the chain back to it
+        return (yield FETCH, (account, count, head))
+    if len(entries) < count and state and not state.complete and state.tail:
+        wanted = max(count - len(entries), TRANSACTION_SYNC_PAGE_SIZE)
+        older = _page((yield FETCH, (account, wanted + 1, state.tail)), state.tail, wanted)
+        yield _append, (account, older, len(older) < wanted)
+        entries = yield _read, (account, count, head)
+    return entries
+
+
+def _sync(account, count, max_age):
+    """Store the blocks added since the account was last synced, returning them instead if it never has been."""
+    state = yield _load_state, (account,)
+    if state is None or state.head is None:
+        blocks = _page((yield FETCH, (account, count, None)), None, count)
+        if blocks or state is None:
+            yield _replace, (account, blocks, len(blocks) < count)
+        return blocks
+    if max_age and datetime.datetime.utcnow() - state.synced_at < datetime.timedelta(seconds=max_age):
+        return None
+    blocks, found, exhausted = yield from _newer(account, state.head)
+    if not found:
+        # The stored head is no longer in the chain or is too far behind so start again from the new blocks
+        logger.info(f'Resetting stored history of {account} after {len(blocks)} blocks')
+        yield _replace, (account, blocks, exhausted)
+    elif blocks:
+        yield _prepend, (account, blocks, state.head)
+    elif TRANSACTION_SYNC_MAX_AGE:
+        # Nothing new, but the history is up to date as of now, which is only read when it may be served unsynced
+        yield _touch, (account,)
+    return None
+
+
+def _newer(account, known):
+    """Fetch the blocks added since ``known``, newest first, a single block at first as usually there are none."""
+    blocks = []
+    start, count = None, 1
+    while True:
+        page = _page((yield FETCH, (account, count + 1 if start else count, start)), start, count)
+        for block in page:
+            if block.get('hash') == known:
+                return blocks, True, False
+            blocks.append(block)
+        if len(page) < count or len(blocks) >= TRANSACTION_SYNC_MAX_BLOCKS:
+            return blocks, False, len(page) < count
+        start, count = blocks[-1].get('hash'), TRANSACTION_SYNC_PAGE_SIZE
+
+
+def _page(blocks, start, count):
+    # The node includes the ``head`` block it was asked to start from
+    if start and blocks and blocks[0].get('hash') == start:
+        blocks = blocks[1:]
+    return blocks[:count]
+
+
+def _load_state(account):
+    with _transaction() as connection:
+        state = connection.execute(select([_state.c.head, _state.c.tail, _state.c.complete, _state.c.synced_at])
+                                   .where(_state.c.account == account)).first()
+    return State(*state) if state else None
+
+
+def _read(account, count, head):
+    with _transaction() as connection:
+        query = select([_blocks.c.entry]).where(_blocks.c.account == account)
+        if head:
+            seq = connection.execute(select([_blocks.c.seq]).where(_blocks.c.account == account)
+                                     .where(_blocks.c.hash == head)).scalar()
+            if seq is None:
+                return None
+            query = query.where(_blocks.c.seq <= seq)
+        rows = connection.execute(query.order_by(_blocks.c.seq.desc()).limit(count))
+        return [json.loads(entry) for entry, in rows]
+
+
+def _replace(account, blocks, complete):
+    global _stored
+    with _writing() as connection:
+        connection.execute(_blocks.delete().where(_blocks.c.account == account))
+        _insert(connection, account, blocks, len(blocks) - 1)
+        _save_state(connection, account, head=blocks[0].get('hash') if blocks else None,
+                    tail=blocks[-1].get('hash') if blocks else None, complete=complete)
+    # Any account can be viewed so the history of those nobody subscribes to is dropped once they go unviewed
+    _stored += 1
+    if _stored % TRANSACTION_EVICT_EVERY == 0:
+        evict()
+
+
+def _prepend(account, blocks, known):
+    with _writing() as connection:
+        # Moving the head on from the one these blocks were fetched after first means a sync running alongside this
+        # one, which fetched the same blocks, finds it moved and stores nothing rather than storing them twice
+        moved = connection.execute(_state.update().where(_state.c.account == account).where(_state.c.head == known)
+                                   .values(head=blocks[0].get('hash'), synced_at=datetime.datetime.utcnow()))
+        if not moved.rowcount:
+            logger.info(f'Skipped storing blocks of {account} already stored by another worker')
+            return
+        newest = connection.execute(select([func.max(_blocks.c.seq)]).where(_blocks.c.account == account)).scalar()
+        _insert(connection, account, blocks, (newest or 0) + len(blocks))
+
+
+def _append(account, blocks, complete):
+    with _writing() as connection:
+        oldest = connection.execute(select([func.min(_blocks.c.seq)]).where(_blocks.c.account == account)).scalar()
+        _insert(connection, account, blocks, (oldest or 0) - 1)
+        _save_state(connection, account, complete=complete, **({'tail': blocks[-1].get('hash')} if blocks else {}))
+
+
+def _touch(account):
+    with _writing() as connection:
+        _save_state(connection, account)
+
+
+def mark_viewed(account):
+    """Record that an account's history was requested so the prefetcher refreshes it ahead of the others."""
+    if _recent_views.get(account):
+        return
+    _recent_views.set(account, True)
+    with _transaction() as connection:
+        connection.execute(_state.update().where(_state.c.account == account)
+                           .values(viewed_at=datetime.datetime.utcnow()))
+
+
+def evict(idle=TRANSACTION_UNSUBSCRIBED_TTL, now=None):
+    """Drop the stored history of accounts nobody subscribes to which haven't been viewed for ``idle`` seconds."""
+    since = (now or datetime.datetime.utcnow()) - datetime.timedelta(seconds=idle)
+    with _transaction() as connection:
+        accounts = [account for account, in connection.execute(select([_state.c.account]).where(and_(
+            func.coalesce(_state.c.viewed_at, _state.c.synced_at) < since,
+            ~exists().where(Subscription.account == _state.c.account))))]
+    for start in range(0, len(accounts), TRANSACTION_SYNC_PAGE_SIZE):
+        chunk = accounts[start:start + TRANSACTION_SYNC_PAGE_SIZE]
+        with _transaction() as connection:
+            connection.execute(_blocks.delete().where(_blocks.c.account.in_(chunk)))
+            connection.execute(_state.delete().where(_state.c.account.in_(chunk)))
+    if accounts:
+        logger.info(f'Evicted the stored history of {len(accounts)} unsubscribed accounts')
+    return len(accounts)
+
+
+def _insert(connection, account, blocks, first_seq):
+    if blocks:
+        connection.execute(_blocks.insert(), [
+            {'account': account, 'seq': first_seq - i, 'hash': block.get('hash'), 'entry': json.dumps(block)}
+            for i, block in enumerate(blocks)])
+
+
+def _save_state(connection, account, **values):
+    values['synced_at'] = datetime.datetime.utcnow()
+    if not connection.execute(_state.update().where(_state.c.account == account).values(**values)).rowcount:
+        connection.execute(_state.insert().values(account=account, **dict({'complete': False}, **values)))
+
+
+@contextmanager
+def _transaction():
+    # An in-memory database is a single connection shared by every thread, so their transactions mustn't overlap
+    lock = _memory_lock if isinstance(engine.pool, StaticPool) else None
+    if lock:
+        lock.acquire()
+    try:
+        with engine.begin() as connection:
+            yield connection
+    finally:
+        if lock:
+            lock.release()
+
+
+@contextmanager
+def _writing():
+    try:
+        with _transaction() as connection:
+            yield connection
+    except IntegrityError:
+        # Another worker stored the same blocks first, which serves just as well
+        logger.info('Skipped storing history already stored by another worker')
@@ -0,0 +1,71 @@
+from sqlalchemy import event
+
+from app.cache import TTLCache
+from app.config import USER_CACHE_SIZE, USER_CACHE_TTL
+from app.database import db_session
+from app.metrics import register_cache
+from app.models import User
+
+# Other workers only see a change once their entry expires, so the TTL bounds how stale a user can be
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+register_cache('user', user_cache)
+# Webhooks by lowercase email, each held as a 1-tuple so users without a webhook are cached too
+webhook_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+register_cache('webhook', webhook_cache)
+
+_QUERY_CHUNK = 500
+
+
+def load_user(email):
+    """Load a user for Flask-Login, returning a detached copy so cached state is never shared between requests."""
+    row = user_cache.get_or_load(email, lambda: _load(email))
+    return User(*row) if row else None
+
+
+def webhooks_for(emails):
+    """Map each lowercase email to its user's webhook, or ``None``, reading through the cache."""
+    result = {}
+    missing = []
+    for email in emails:
+        cached = webhook_cache.get(email)
+        if cached is None:
+            missing.append(email)
+        else:
+            result[email] = cached[0]
+    for start in range(0, len(missing), _QUERY_CHUNK):
+        chunk = missing[start:start + _QUERY_CHUNK]
+        loaded = dict.fromkeys(chunk)
+        loaded.update(db_session.query(User.email_lower, User.webhook).filter(User.email_lower.in_(chunk)))
+        for email, webhook in loaded.items():
+            webhook_cache.set(email, (webhook,))
+        result.update(loaded)
+    return result
+
+
+def invalidate(*emails):
+    for email in emails:
+        user_cache.delete(email)
+        webhook_cache.delete(email.lower())
+
+
+def _load(email):
+    user = db_session.query(User).filter(User.email == email).first()
+    return (user.email, user.password, user.webhook) if user else None
+
+
+@event.listens_for(db_session.session_factory, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_users', set())
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, User):
+            changed.add(instance.email)
+
+
+@event.listens_for(db_session.session_factory, 'after_commit')
+def _invalidate_changed_users(session):
+    invalidate(*session.info.pop('changed_users', ()))
+
+
+@event.listens_for(db_session.session_factory, 'after_soft_rollback')
+def _discard_changed_users(session, previous_transaction):
+    session.info.pop('changed_users', None)
@@ -0,0 +1,279 @@
+import datetime
+import ipaddress
+import logging
+import random
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+from app.config import WEBHOOK_WORKERS, WEBHOOK_HOST_CONCURRENCY, WEBHOOK_CONNECT_TIMEOUT, WEBHOOK_READ_TIMEOUT, \
+    WEBHOOK_MAX_ATTEMPTS, WEBHOOK_BACKOFF_BASE, WEBHOOK_BACKOFF_MAX, WEBHOOK_BATCH_SIZE, WEBHOOK_POLL_INTERVAL, \
+    WEBHOOK_ALLOW_PRIVATE
+from app.database import db_session
+from app.metrics import registry, webhook_request_duration, webhook_delivery_latency
+from app.models import Notification, WebhookDelivery
+from app.notifications import claim
+from app.subscribers import subscribers_for
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'webhook'
+
+
+class RefusedDestination(Exception):
+    """A webhook which mustn't be delivered to, retrying won't change that."""
+
+
+def backoff(attempts, base=WEBHOOK_BACKOFF_BASE, cap=WEBHOOK_BACKOFF_MAX, rand=random.random):
+    """Seconds to wait before the next attempt, exponential with full jitter so failures don't retry in step."""
+    return rand() * min(cap, base * 2 ** attempts)
+
+
+def host_of(url):
+    """The host (and port) deliveries to ``url`` are limited by."""
+    return urlsplit(url).netloc.rpartition('@')[2].lower()
+
+
+def check_destination(url, resolve=socket.getaddrinfo):
+    """Raise RefusedDestination unless ``url`` is HTTP(S) and every address its host resolves to is public.
+
+    Subscribers choose their webhooks, so without this they could have the deliverer POST to the node, the internal
+    callback or anything else on the private network.
+    """
+    parts = urlsplit(url)
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        raise RefusedDestination(f'Invalid port in {url}')
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise RefusedDestination(f'Not an HTTP URL: {url}')
+    for *_, sockaddr in resolve(parts.hostname, port, proto=socket.IPPROTO_TCP):
+        _check_address(parts.hostname, sockaddr[0])
+
+
+def _check_address(host, address):
+    address = ipaddress.ip_address(address.split('%')[0])
+    if not address.is_global or address.is_multicast:
+        raise RefusedDestination(f'{host} resolves to {address}')
+
+
+class _PublicConnection:
+    # The host is resolved again to connect, by when it may point somewhere else (DNS rebinding), so the address
+    # actually connected to is checked too before anything is sent
+    def _new_conn(self):
+        sock = super()._new_conn()
+        try:
+            _check_address(self.host, sock.getpeername()[0])
+        except RefusedDestination:
+            sock.close()
+            raise
+        return sock
+
+
+class _PublicHTTPConnection(_PublicConnection, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicConnection, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicAdapter(HTTPAdapter):
+    """Transport adapter which only sends requests over connections to public addresses."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _PublicHTTPConnectionPool,
+                                                   'https': _PublicHTTPSConnectionPool}
+
+
+def payload(account, block_hash, amount, block):
+    return {'account': account, 'hash': block_hash, 'amount': amount, 'block': block}
+
+
+class WebhookDeliverer:
+    """POSTs queued notifications to subscribers' webhooks.
+
+    Deliveries are grouped by host and at most ``host_concurrency`` are in flight to any one host, so a slow or
+    failing endpoint only holds up its own deliveries. Connections are kept alive in a pool per host. Webhooks whose
+    host resolves to a non-public address fail straight away unless ``allow_private`` is set.
+    """
+
+    def __init__(self, session=db_session, workers=WEBHOOK_WORKERS, host_concurrency=WEBHOOK_HOST_CONCURRENCY,
+                 timeout=(WEBHOOK_CONNECT_TIMEOUT, WEBHOOK_READ_TIMEOUT), max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 batch_size=WEBHOOK_BATCH_SIZE, backoff=backoff, clock=datetime.datetime.utcnow,
+                 allow_private=WEBHOOK_ALLOW_PRIVATE):
+        self.session = session
+        self.host_concurrency = host_concurrency
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.backoff = backoff
+        self.clock = clock
+        self.allow_private = allow_private
+        self.http = requests.Session()
+        adapter = (HTTPAdapter if allow_private else PublicAdapter)(pool_connections=workers,
+                                                                     pool_maxsize=host_concurrency)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._inflight = defaultdict(dict)
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    def run(self, interval=WEBHOOK_POLL_INTERVAL):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Webhook delivery failed')
+                self.session.rollback()
+            finally:
+                self.session.remove()
+            # Worker processes serve no scrapes so their metrics are written out as they go
+            registry.maybe_flush()
+            # A finished delivery frees a slot for its host so look for more work straight away
+            self._finished.wait(interval)
+            self._finished.clear()
+
+    def run_once(self):
+        """Create deliveries for new notifications then start every due delivery the host limits allow."""
+        self.expand()
+        return self.dispatch()
+
+    def close(self):
+        self._executor.shutdown()
+        self.http.close()
+
+    def expand(self):
+        """Create a delivery for each distinct webhook subscribed to the accounts of new notifications."""
+        rows = claim(self.session, CHANNEL, self.batch_size)
+        if not rows:
+            self.session.rollback()
+            return 0
+        subscribers = subscribers_for({account for _, account in rows})
+        now = self.clock()
+        deliveries = [{'notification_id': notification_id, 'url': webhook, 'host': host_of(webhook),
+                       'status': WebhookDelivery.PENDING, 'attempts': 0, 'next_attempt_at': now}
+                      for notification_id, account in rows
+                      for webhook in sorted({subscriber.webhook for subscriber in subscribers[account]} - {None, ''})]
+        if deliveries:
+            self.session.execute(WebhookDelivery.__table__.insert(), deliveries)
+        self.session.commit()
+        return len(deliveries)
+
+    def dispatch(self):
+        """Start the due deliveries, returning their futures."""
+        futures = []
+        while True:
+            with self._lock:
+                # Leave out hosts with no free slots so their backlog can't crowd other hosts out of the batch
+                busy = [host for host, inflight in self._inflight.items() if len(inflight) >= self.host_concurrency]
+            due = self._due(busy)
+            started = len(futures)
+            saturated = False
+            with self._lock:
+                for row in due:
+                    inflight = self._inflight[row.host]
+                    if row.id in inflight:
+                        continue
+                    if len(inflight) >= self.host_concurrency:
+                        saturated = True
+                        continue
+                    inflight[row.id] = row.url
+                    futures.append(self._executor.submit(self._deliver, row))
+            # Look again when a host filled up part way through a full batch, there may be other hosts behind it.
+            # The hosts which filled up are left out next time, so stop once a batch starts nothing new
+            if not saturated or len(due) < self.batch_size or len(futures) == started:
+                return futures
+
+    def _due(self, busy):
+        try:
+            return self.session.query(WebhookDelivery.id, WebhookDelivery.url, WebhookDelivery.host,
+                                      WebhookDelivery.attempts, Notification.account, Notification.hash,
+                                      Notification.amount, Notification.block, Notification.created_at) \
+                .join(Notification, Notification.id == WebhookDelivery.notification_id) \
+                .filter(WebhookDelivery.status == WebhookDelivery.PENDING) \
+                .filter(WebhookDelivery.next_attempt_at <= self.clock()) \
+                .filter(~WebhookDelivery.host.in_(busy)) \
+                .order_by(WebhookDelivery.next_attempt_at) \
+                .limit(self.batch_size) \
+                .all()
+        finally:
+            self.session.rollback()
+
+    def _deliver(self, row):
+        try:
+            if not self.allow_private:
+                try:
+                    check_destination(row.url)
+                except RefusedDestination as e:
+                    self._record(row, repr(e), permanent=True)
+                    return False
+                except OSError as e:
+                    # The name didn't resolve, which may well be temporary
+                    self._record(row, repr(e))
+                    return False
+            start = time.perf_counter()
+            error = None
+            try:
+                response = self.http.post(row.url, json=payload(row.account, row.hash, row.amount, row.block),
+                                          timeout=self.timeout, allow_redirects=False)
+                if not 200 <= response.status_code < 300:
+                    error = f'HTTP {response.status_code}'
+            except RefusedDestination as e:
+                self._record(row, repr(e), permanent=True)
+                return False
+            except RequestException as e:
+                error = repr(e)
+            webhook_request_duration.observe(time.perf_counter() - start, result='error' if error else 'success')
+            self._record(row, error)
+            return error is None
+        finally:
+            with self._lock:
+                self._inflight[row.host].pop(row.id, None)
+                if not self._inflight[row.host]:
+                    del self._inflight[row.host]
+            self._finished.set()
+
+    def _record(self, row, error, permanent=False):
+        now = self.clock()
+        attempts = row.attempts + 1
+        table = WebhookDelivery.__table__
+        if error is None:
+            values = {'status': WebhookDelivery.DELIVERED, 'delivered_at': now, 'last_error': None}
+            webhook_delivery_latency.observe((now - row.created_at).total_seconds())
+        elif permanent or attempts >= self.max_attempts:
+            logger.warning(f'Giving up on webhook delivery {row.id} to {row.url} after {attempts} attempts: {error}')
+            values = {'status': WebhookDelivery.FAILED, 'last_error': error}
+        else:
+            values = {'next_attempt_at': now + datetime.timedelta(seconds=self.backoff(attempts)), 'last_error': error}
+        try:
+            self.session.execute(table.update().where(table.c.id == row.id).values(attempts=attempts, **values))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.remove()
+
+
+if __name__ == '__main__':
+    WebhookDeliverer().run()
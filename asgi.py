@@ -0,0 +1,9 @@
+from app.aio import NanoAsgi
+from run import app as wsgi_app
+
+app = NanoAsgi(wsgi_app)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,35 @@
+"""Micro-benchmark of account validation cost per call.
+
+Run from the repository root with ``python -m bench.bench_accounts``.
+"""
+import re
+import timeit
+
+from app import accounts
+
+ACCOUNT = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+BATCH = [ACCOUNT] * 1000
+
+
+def _legacy_is_invalid(account):
+    return not account or not re.match('xrb_[a-zA-Z0-9]{60}', account)
+
+
+CASES = [
+    ('legacy re.match', lambda: _legacy_is_invalid(ACCOUNT), 1),
+    ('accounts.is_valid', lambda: accounts.is_valid(accounts.normalize(ACCOUNT), verify_checksum=False), 1),
+    ('accounts.is_valid with checksum', lambda: accounts.is_valid(ACCOUNT, verify_checksum=True), 1),
+    ('legacy re.match x1000', lambda: [_legacy_is_invalid(account) for account in BATCH], len(BATCH)),
+    ('accounts.validate_many x1000', lambda: accounts.validate_many(BATCH, verify_checksum=False), len(BATCH)),
+]
+
+
+def main(number=2000):
+    for name, case, size in CASES:
+        runs = max(number // size, 20)
+        seconds = min(timeit.repeat(case, number=runs, repeat=5))
+        print(f'{name:<36} {seconds / runs / size * 1e9:>10.0f} ns/account')
+
+
+if __name__ == '__main__':
+    main()
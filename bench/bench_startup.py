@@ -0,0 +1,93 @@
+"""Benchmark of how long the app takes to start, for a single worker process and for gunicorn with all its workers.
+
+Compares the old startup, where every worker imported the app and set up the schema, with workers which only import
+the app and with the app preloaded once by the gunicorn master and forked into the workers. Run from the repository
+root with ``python -m bench.bench_startup``.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+MODES = (
+    # name, preloaded, schema set up by each worker
+    ('init per worker', False, True),
+    ('import per worker', False, False),
+    ('preloaded', True, False),
+)
+
+CONFIG = textwrap.dedent('''
+    import os
+    import runpy
+
+    if {preload}:
+        globals().update(runpy.run_path('gunicorn.conf.py'))
+    else:
+        preload_app = False
+
+
+    def post_worker_init(worker):
+        if {init}:
+            from app.database import init_db
+            init_db()
+        open(os.path.join({ready!r}, str(os.getpid())), 'w').close()
+''')
+
+
+def environment(database_url):
+    return dict(os.environ, DATABASE_URL=database_url,
+                PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+
+
+def import_time(env, init):
+    code = 'import run' + ('; from app.database import init_db; init_db()' if init else '')
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', code], env=env, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def gunicorn_time(env, directory, workers, preload, init):
+    ready = tempfile.mkdtemp(dir=directory)
+    config = os.path.join(directory, 'gunicorn_startup.py')
+    with open(config, 'w') as f:
+        f.write(CONFIG.format(preload=preload, init=init, ready=ready))
+    start = time.perf_counter()
+    process = subprocess.Popen(['gunicorn', '-c', config, '-w', str(workers), '-b', '127.0.0.1:0', 'run:app'],
+                               env=env, stderr=subprocess.DEVNULL)
+    try:
+        while len(os.listdir(ready)) < workers:
+            if process.poll() is not None:
+                raise RuntimeError('gunicorn exited while starting')
+            time.sleep(0.005)
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(30)
+        shutil.rmtree(ready)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        env = environment(f'sqlite:///{os.path.join(directory, "nanotify.db")}')
+        subprocess.check_call([sys.executable, '-m', 'app.manage', 'init-db'], env=env, stderr=subprocess.DEVNULL)
+        print(f'{"mode":>18} {"worker import":>14} {f"gunicorn -w {args.workers}":>14}')
+        for name, preload, init in MODES:
+            worker = '' if preload else f'{min(import_time(env, init) for _ in range(args.repeat)) * 1000:>12.0f}ms'
+            server = min(gunicorn_time(env, directory, args.workers, preload, init) for _ in range(args.repeat))
+            print(f'{name:>18} {worker:>14} {server * 1000:>12.0f}ms')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
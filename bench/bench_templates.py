@@ -0,0 +1,60 @@
+"""Micro-benchmark of rendering the subscription page against the number of subscriptions listed.
+
+Compares the old rendering (templates auto reloading, nothing cached) with the production mode (compiled once,
+layout fragments cached) and the streamed response, for which time to the first chunk is what the browser waits on.
+Run from the repository root with ``python -m bench.bench_templates``.
+"""
+import time
+from collections import namedtuple
+
+from flask import render_template
+
+from app import templating
+from run import app
+
+Row = namedtuple('Row', ['account'])
+COUNTS = (10, 100, 1000, 10000)
+
+
+def rows(count):
+    return [Row(f'xrb_{i:060d}') for i in range(count)]
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def first_chunk(subscriptions):
+    start = time.perf_counter()
+    response = templating.stream_template('subscribe.html', subscriptions=subscriptions, next_after=None)
+    iterator = iter(response.response)
+    next(iterator)
+    elapsed = time.perf_counter() - start
+    for _ in iterator:
+        pass
+    return elapsed
+
+
+def main(repeat=20):
+    print(f'{"rows":>6} {"auto reload":>12} {"production":>12} {"streamed":>12} {"first chunk":>12}')
+    for count in COUNTS:
+        subscriptions = rows(count)
+        results = []
+        with app.test_request_context('/subscribe'):
+            for auto_reload in (True, False):
+                app.jinja_env.auto_reload = auto_reload
+                results.append(best(lambda: render_template('subscribe.html', subscriptions=subscriptions,
+                                                            next_after=None), repeat))
+            results.append(best(lambda: ''.join(templating.stream_template(
+                'subscribe.html', subscriptions=subscriptions, next_after=None).response), repeat))
+            results.append(min(first_chunk(subscriptions) for _ in range(repeat)))
+        print(f'{count:>6}' + ''.join(f'{seconds * 1000:>10.2f}ms' for seconds in results))
+
+
+if __name__ == '__main__':
+    main()
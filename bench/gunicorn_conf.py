@@ -0,0 +1,38 @@
+"""Gunicorn configuration used by the load test to count requests and database queries per route.
+
+Each worker writes its counts to ``$BENCH_STATS_DIR/<pid>.json`` when it exits.
+"""
+import json
+import os
+from collections import Counter
+
+_requests = Counter()
+_queries = Counter()
+
+
+def post_worker_init(worker):
+    import flask
+    from sqlalchemy import event
+
+    from app.database import engine
+    from run import app
+
+    def route():
+        if flask.has_request_context() and flask.request.url_rule:
+            return f'{flask.request.method} {flask.request.url_rule.rule}'
+        return 'other'
+
+    @app.before_request
+    def count_request():
+        _requests[route()] += 1
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        _queries[route()] += 1
+
+
+def worker_exit(server, worker):
+    directory = os.environ.get('BENCH_STATS_DIR')
+    if directory:
+        with open(os.path.join(directory, f'{os.getpid()}.json'), 'w') as f:
+            json.dump({'requests': _requests, 'queries': _queries}, f)
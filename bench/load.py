@@ -0,0 +1,240 @@
+"""Load test and latency benchmark for the nano blueprint.
+
+Starts a stand-in Nano node and the app under gunicorn, drives each route at the requested concurrency and
+reports p50/p95/p99 latency, throughput, errors and database queries per request. Run from the repository root::
+
+    python -m bench.load --concurrency 16 --requests 500 --save bench/baselines/local.json
+    python -m bench.load --compare bench/baselines/local.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.accounts import ALPHABET
+from tests.stub_node import StubNode
+
+ROUTES = {
+    'login': 'POST /',
+    'subscribe': 'POST /subscribe',
+    'transactions': 'GET /transactions/<account>',
+    'mobile_subscribe': 'POST /mobile/subscribe',
+}
+PASSWORD = 'benchmark-password'
+
+
+def random_account():
+    return 'xrb_' + random.choice('13') + ''.join(random.choice(ALPHABET) for _ in range(59))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Server:
+
+    def __init__(self, workers, node_port, stats_dir, database_url, bcrypt_rounds, rate_limit=False):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.env = dict(os.environ, NANO_HOST='127.0.0.1', NANO_PORT=str(node_port), DATABASE_URL=database_url,
+                        BENCH_STATS_DIR=stats_dir, BCRYPT_ROUNDS=str(bcrypt_rounds),
+                        # A few clients send every request, which the rate limits would mostly answer with 429
+                        RATE_LIMIT_ENABLED='true' if rate_limit else 'false',
+                        PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+        self.command = ['gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{self.port}',
+                        '-c', os.path.join(os.path.dirname(__file__), 'gunicorn_conf.py'), 'run:app']
+        self.process = None
+
+    def start(self):
+        subprocess.check_call([sys.executable, '-c', 'from app.database import init_db; init_db()'], env=self.env)
+        self.process = subprocess.Popen(self.command, env=self.env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                requests.get(self.url, timeout=1)
+                return self
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        raise RuntimeError('gunicorn did not start')
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait(30)
+
+
+class Client:
+
+    def __init__(self, url, accounts):
+        self.url = url
+        self.accounts = accounts
+        self.session = requests.Session()
+        self.email = f'bench-{random.getrandbits(64):x}@example.com'
+
+    def setup(self):
+        self.session.post(f'{self.url}/register', data={'email': self.email, 'password': PASSWORD})
+        self.login()
+
+    def login(self):
+        return self.session.post(f'{self.url}/', data={'email': self.email, 'password': PASSWORD},
+                                 allow_redirects=False)
+
+    def subscribe(self):
+        return self.session.post(f'{self.url}/subscribe', data={'account': random_account(), 'action': 'subscribe'})
+
+    def transactions(self):
+        return self.session.get(f'{self.url}/transactions/{random.choice(self.accounts)}')
+
+    def mobile_subscribe(self):
+        return self.session.post(f'{self.url}/mobile/subscribe', json={'account': random_account()})
+
+
+def drive(clients, route, total):
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+    remaining = iter(range(total))
+
+    def worker(client):
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = getattr(client, route)()
+                status = response.status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status not in (200, 201, 302):
+                    errors[str(status)] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        list(executor.map(worker, clients))
+    duration = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': dict(errors)
+    }
+
+
+def collect_query_counts(stats_dir):
+    requests_by_route, queries_by_route = Counter(), Counter()
+    for name in os.listdir(stats_dir):
+        with open(os.path.join(stats_dir, name)) as f:
+            stats = json.load(f)
+        requests_by_route.update(stats['requests'])
+        queries_by_route.update(stats['queries'])
+    return requests_by_route, queries_by_route
+
+
+def run(args):
+    accounts = [random_account() for _ in range(args.hot_accounts)]
+    history = [{'type': 'receive', 'account': random_account(), 'amount': '1000000000000000000000000',
+                'hash': '%064X' % random.getrandbits(256)} for _ in range(10)]
+    node = StubNode(histories={account: history for account in accounts}, latency=args.node_latency,
+                    failure_rate=args.node_failure_rate).start()
+    work_dir = tempfile.mkdtemp(prefix='nanotify-bench-')
+    stats_dir = os.path.join(work_dir, 'stats')
+    os.mkdir(stats_dir)
+    database_url = args.database_url or f'sqlite:///{os.path.join(work_dir, "bench.db")}'
+    server = Server(args.workers, node.port, stats_dir, database_url, args.bcrypt_rounds, args.rate_limit)
+    try:
+        server.start()
+        clients = [Client(server.url, accounts) for _ in range(args.concurrency)]
+        for client in clients:
+            client.setup()
+        results = {route: drive(clients, route, args.requests) for route in args.routes}
+    finally:
+        server.stop()
+        node.stop()
+    requests_by_route, queries_by_route = collect_query_counts(stats_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    for route, result in results.items():
+        served = requests_by_route.get(ROUTES[route], 0)
+        result['db_queries_per_request'] = queries_by_route.get(ROUTES[route], 0) / served if served else None
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')},
+        'routes': results
+    }
+
+
+def compare(current, baseline, tolerance):
+    regressions = []
+    for route, result in current['routes'].items():
+        previous = baseline['routes'].get(route)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f'{route} {metric} {previous[metric]:.1f} -> {result[metric]:.1f}')
+        if result['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(f'{route} throughput {previous["throughput"]:.1f} -> {result["throughput"]:.1f}')
+    return regressions
+
+
+def report(results):
+    print(f'{"route":<18}{"req":>7}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}  errors')
+    for route, result in results['routes'].items():
+        queries = result['db_queries_per_request']
+        print(f'{route:<18}{result["requests"]:>7}{result["throughput"]:>10.1f}{result["p50_ms"]:>10.1f}'
+              f'{result["p95_ms"]:>10.1f}{result["p99_ms"]:>10.1f}'
+              f'{"-" if queries is None else format(queries, ".1f"):>9}  {result["errors"] or ""}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--hot-accounts', type=int, default=20, help='accounts requested from /transactions')
+    parser.add_argument('--node-latency', type=float, default=0.05, help='stand-in node latency in seconds')
+    parser.add_argument('--node-failure-rate', type=float, default=0.0)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--rate-limit', action='store_true', help='keep the rate limits on')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--save', help='write the results to this JSON baseline')
+    parser.add_argument('--compare', help='compare the results with this JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
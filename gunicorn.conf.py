@@ -0,0 +1,15 @@
+"""Gunicorn configuration, ``gunicorn -c gunicorn.conf.py run:app``.
+
+The app is imported once by the master and forked into the workers, so a worker is ready as soon as it is forked
+rather than after importing and setting up the app itself. Each worker serves requests on ``GUNICORN_THREADS``
+threads so one waiting on bcrypt or the node doesn't hold up the others.
+"""
+import os
+
+preload_app = True
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+
+def post_fork(server, worker):
+    from run import after_fork
+    after_fork()
@@ -5,38 +5,59 @@ from flask import Flask, send_from_directory, request
 from flask_login import LoginManager
 from werkzeug.utils import redirect
 
-from app.config import BCRYPT_SECRET
-from app.database import init_db
-from app.models import User
+from app.config import BCRYPT_SECRET, DATABASE_URL, ROBOTS_MAX_AGE, TEMPLATES_AUTO_RELOAD
+from app.database import MEMORY_URLS, dispose_engines, init_db
+from app import process, templating, users
 from app.routes import nano
 
-app = Flask(__name__)
 PERMANENT_SESSION_LIFETIME = datetime.timedelta(minutes=30)
-app.secret_key = BCRYPT_SECRET
-app.register_blueprint(nano)
-app.config['TEMPLATES_AUTO_RELOAD'] = True
-login_manager = LoginManager()
-login_manager.init_app(app)
-init_db()
 
 
-@login_manager.user_loader
-def load_user(email):
-    return User.query.filter(User.email == email).first()
+def create_app(config=None):
+    """Create the app, with ``config`` overriding its Flask settings.
 
+    The database schema isn't touched, it is set up once per deploy with ``python -m app.manage init-db`` rather than
+    by every worker, except for an in-memory database which no other process can reach.
+    """
+    app = Flask(__name__)
+    app.secret_key = BCRYPT_SECRET
+    # Left unset templates only reload in debug, otherwise every render checks the template files for changes
+    app.config['TEMPLATES_AUTO_RELOAD'] = TEMPLATES_AUTO_RELOAD
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+    app.config.update(config or {})
+    # Registering the blueprint creates the template environment so it has to come after the config it reads
+    app.register_blueprint(nano)
 
-@login_manager.unauthorized_handler
-def unauthorized_callback():
-    return redirect('/')
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.user_loader(users.load_user)
 
+    @login_manager.unauthorized_handler
+    def unauthorized_callback():
+        return redirect('/')
 
-@app.route('/robots.txt')
-@app.route('/sitemap.xml')
-def static_from_root():
-    return send_from_directory(app.static_folder, request.path[1:])
+    @app.route('/robots.txt')
+    @app.route('/sitemap.xml')
+    def static_from_root():
+        return send_from_directory(app.static_folder, request.path[1:], cache_timeout=ROBOTS_MAX_AGE)
+
+    templating.init_app(app)
+    if DATABASE_URL in MEMORY_URLS:
+        init_db()
+    return app
+
+
+def after_fork():
+    """Drop what a worker forked from a preloaded parent mustn't share with it, pooled connections, sessions and
+    threads."""
+    dispose_engines()
+    process.reset()
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
+    init_db()
     app.run(host='0.0.0.0')
     app.run(debug=True, use_reloader=True)
-
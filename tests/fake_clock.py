@@ -0,0 +1,8 @@
+class FakeClock:
+    """A clock for code taking a ``clock`` or ``timer`` callable, which only moves when a test sets ``now``."""
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,85 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class StubNode:
+    """Stand-in Nano node RPC server with configurable latency and failure rate."""
+
+    def __init__(self, histories=None, latency=0, failure_rate=0, host='127.0.0.1', port=0):
+        self.histories = histories or {}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+                stub.requests.append(body)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.failure_rate and random.random() < stub.failure_rate:
+                    return self._send(500, {'error': 'stub failure'})
+                self._send(200, stub.handle(body))
+
+            def _send(self, status, data):
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def url(self):
+        return f'http://{self._server.server_address[0]}:{self.port}'
+
+    def handle(self, body):
+        if body.get('action') == 'account_history':
+            history = self.histories.get(body['account'], [])
+            return {'account': body['account'], 'history': history[:int(body.get('count', len(history)))]}
+        if body.get('action') == 'block_count':
+            return {'count': '1000', 'unchecked': '0'}
+        return {'error': 'Unknown command'}
+
+    @staticmethod
+    def callback(url, block_hash, account, block, amount='0', **extra):
+        """POST a confirmed block to ``url`` the way the node's HTTP callback does, returning the status code."""
+        body = dict(extra, account=account, hash=block_hash, block=json.dumps(block), amount=amount)
+        request = urllib.request.Request(url, json.dumps(body).encode(), {'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,73 @@
+import socketserver
+import threading
+from email import message_from_bytes, policy
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubSMTP:
+    """Local SMTP sink which accepts every message, except to ``refused`` recipients, and keeps it in ``messages``."""
+
+    def __init__(self, refused=(), host='127.0.0.1', port=0):
+        self.refused = set(refused)
+        self.messages = []
+        self.connections = 0
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                stub.connections += 1
+                self.reply('220 stub ESMTP')
+                recipients = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip()
+                    verb = command[:4].upper()
+                    if verb in ('EHLO', 'HELO'):
+                        self.reply('250 stub')
+                    elif verb == 'MAIL':
+                        recipients = []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipient = command[command.index('<') + 1:command.index('>')]
+                        if recipient in stub.refused:
+                            self.reply('550 No such user')
+                        else:
+                            recipients.append(recipient)
+                            self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                        stub.messages.append((recipients, message_from_bytes(data, policy=policy.default)))
+                        self.reply('250 OK')
+                    elif verb in ('RSET', 'NOOP'):
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+            def reply(self, text):
+                self.wfile.write(f'{text}\r\n'.encode())
+
+        self._server = _Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,49 @@
+import unittest
+
+from app import accounts
+
+ACCOUNT = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+BAD_CHECKSUM_ACCOUNT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44op'
+
+
+class TestAccounts(unittest.TestCase):
+
+    def test_normalize_nano_prefix_and_case(self):
+        # When
+        account = accounts.normalize(' NANO_3TXM99YB6YQ1T56IZNZTHBMJY9WNTG61ITXUSQKHIIXH4FZ38I7RHSMYJT7A ')
+
+        # Then
+        assert ACCOUNT == account
+
+    def test_is_valid(self):
+        # Then
+        assert accounts.is_valid(ACCOUNT)
+        assert not accounts.is_valid(ACCOUNT + 'a')
+        assert not accounts.is_valid(ACCOUNT + '\n')
+        assert not accounts.is_valid(ACCOUNT[:-1] + 'l')
+        assert not accounts.is_valid('xrb_2' + ACCOUNT[5:])
+        assert not accounts.is_valid(None)
+
+    def test_is_valid_with_checksum(self):
+        # Then
+        assert accounts.is_valid(ACCOUNT, verify_checksum=True)
+        assert accounts.is_valid(BAD_CHECKSUM_ACCOUNT, verify_checksum=False)
+        assert not accounts.is_valid(BAD_CHECKSUM_ACCOUNT, verify_checksum=True)
+
+    def test_public_key(self):
+        # When
+        key = accounts.public_key('xrb_1111111111111111111111111111111111111111111111111111hifc8npp')
+
+        # Then
+        assert bytes(32) == key
+
+    def test_validate_many(self):
+        # Given
+        requested = [ACCOUNT.upper(), 'nano_account', None, ACCOUNT + '\n' + ACCOUNT, BAD_CHECKSUM_ACCOUNT]
+
+        # When
+        valid, invalid = accounts.validate_many(requested, verify_checksum=True)
+
+        # Then
+        assert [ACCOUNT] == valid
+        assert ['nano_account', None, ACCOUNT + '\n' + ACCOUNT, BAD_CHECKSUM_ACCOUNT] == invalid
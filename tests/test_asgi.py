@@ -0,0 +1,362 @@
+import asyncio
+import json
+import time
+import unittest
+
+from app.accounts import ALPHABET
+from app.aio import NanoAsgi, AsyncHTTPClient, AsyncNodeClient
+from app.database import init_db, db_session
+from app.feed import FeedHub, Watcher
+from app.history import history_cache
+from app.models import AccountHistory, Transaction
+from app.node import NodeError
+from app.ratelimit import limiter, Limit
+from run import app
+from stub_node import StubNode
+
+ACCOUNT = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+OTHER_ACCOUNT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+HISTORY = [
+    {
+        "type": "receive",
+        "account": ACCOUNT,
+        "amount": "120568492000000000000000000000",
+        "hash": "89F14F380D84746B014323E78985FC1750D64C1345A9870AC4F749250AA6C82D"
+    }
+]
+
+
+class TestAsgi(unittest.TestCase):
+    """Parity tests for the asyncio serving mode against the behaviour in test_routes."""
+
+    def setUp(self):
+        app.testing = True
+        with app.app_context():
+            init_db()
+        for model in (Transaction, AccountHistory):
+            db_session.query(model).delete()
+        db_session.commit()
+        history_cache.clear()
+        limiter.store.clear()
+        self.node = StubNode(histories={ACCOUNT: HISTORY}).start()
+        self.loop = asyncio.new_event_loop()
+        self.asgi = NanoAsgi(app, node=AsyncNodeClient(self.node.url, backoff=0))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.asgi.close())
+        self.loop.close()
+        self.node.stop()
+
+    def request(self, method, path, body=b'', content_type=None, headers=(), query=b''):
+        return self.loop.run_until_complete(self._request(method, path, body, content_type, headers, query))
+
+    async def _request(self, method, path, body, content_type, headers=(), query=b''):
+        headers = [(b'content-type', content_type.encode())] + list(headers) if content_type else list(headers)
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'path': path, 'query_string': query,
+                 'headers': headers, 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if not messages:
+                # The client stays connected until the response is complete
+                await asyncio.Event().wait()
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.asgi(scope, receive, send)
+        status = sent[0]['status']
+        headers = dict(sent[0]['headers'])
+        return status, headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+    def test_get_home(self):
+        # When
+        status, _, body = self.request('GET', '/')
+
+        # Then
+        assert 200 == status
+        assert b'Sign Up' in body
+        assert b'Login' in body
+
+    def test_register_invalid_email(self):
+        # When
+        status, _, body = self.request('POST', '/register', b'email=%40example.com&password=password',
+                                       'application/x-www-form-urlencoded')
+
+        # Then
+        assert b'Enter a valid email and password' in body
+
+    def test_register_account(self):
+        # When
+        status, headers, _ = self.request('POST', '/register', b'email=asgi%40example.com&password=password',
+                                          'application/x-www-form-urlencoded')
+
+        # Then
+        assert 302 == status
+        assert b'http://localhost/' == headers[b'location']
+
+    def test_get_transaction_history(self):
+        # When
+        status, _, body = self.request('GET', f'/transactions/{ACCOUNT}')
+
+        # Then
+        assert 200 == status
+        assert HISTORY == json.loads(body.decode())
+        assert {'action': 'account_history', 'account': ACCOUNT, 'count': 10} == self.node.requests[0]
+
+    def test_get_unchanged_transaction_history_is_not_modified(self):
+        # Given
+        _, headers, _ = self.request('GET', f'/transactions/{ACCOUNT}')
+
+        # When
+        status, _, body = self.request('GET', f'/transactions/{ACCOUNT}',
+                                       headers=[(b'if-none-match', headers[b'etag'])])
+
+        # Then
+        assert 304 == status
+        assert b'' == body
+
+    def test_get_transaction_history_invalid_account(self):
+        # When
+        status, _, _ = self.request('GET', '/transactions/nano_account')
+
+        # Then
+        assert 400 == status
+
+    def test_get_transaction_history_raises_exception(self):
+        # Given
+        self.node.failure_rate = 1
+
+        # When
+        status, _, _ = self.request('GET', f'/transactions/{ACCOUNT}')
+
+        # Then
+        assert 500 == status
+
+    def test_get_transaction_history_batch(self):
+        # Given
+        body = json.dumps({'accounts': [ACCOUNT, OTHER_ACCOUNT], 'count': 5}).encode()
+
+        # When
+        status, _, data = self.request('POST', '/transactions', body, 'application/json')
+
+        # Then
+        assert 200 == status
+        assert {ACCOUNT: HISTORY, OTHER_ACCOUNT: []} == json.loads(data.decode())
+
+    def test_get_transaction_history_batch_invalid_account(self):
+        # Given
+        body = json.dumps({'accounts': [ACCOUNT, 'nano_account']}).encode()
+
+        # When
+        status, _, data = self.request('POST', '/transactions', body, 'application/json')
+
+        # Then
+        assert 400 == status
+        assert {'invalid': ['nano_account']} == json.loads(data.decode())
+
+    def test_get_transaction_history_batch_invalid_head(self):
+        # Given
+        body = json.dumps({'accounts': [ACCOUNT], 'head': {ACCOUNT: ['x']}}).encode()
+
+        # When
+        status, _, _ = self.request('POST', '/transactions', body, 'application/json')
+
+        # Then
+        assert 400 == status
+
+    def test_transaction_history_batch_takes_a_token_per_account(self):
+        # Given
+        limits = dict(limiter.limits)
+        limiter.limits[('transactions', 'ip')] = Limit(3, 60)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        body = json.dumps({'accounts': [ACCOUNT, OTHER_ACCOUNT]}).encode()
+        self.request('POST', '/transactions', body, 'application/json')
+
+        # When
+        status, headers, _ = self.request('POST', '/transactions', body, 'application/json')
+
+        # Then
+        assert 429 == status
+        assert b'20' == headers[b'retry-after']
+
+    def test_mobile_import_is_rate_limited_before_reading_the_body(self):
+        # Given
+        limits = dict(limiter.limits)
+        limiter.limits[('import', 'ip')] = Limit(1, 3600)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        first, _, _ = self.request('POST', '/mobile/subscribe/import', b'', 'application/x-ndjson')
+
+        # When
+        status, headers, _ = self.request('POST', '/mobile/subscribe/import', b'', 'application/x-ndjson')
+
+        # Then
+        assert 200 == first
+        assert 429 == status
+        assert b'3600' == headers[b'retry-after']
+
+    def test_mobile_subscribe_to_invalid_format_account(self):
+        # When
+        status, _, _ = self.request('POST', '/mobile/subscribe',
+                                    json.dumps({'account': 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6z_my_account'}).encode(),
+                                    'application/json')
+
+        # Then
+        assert 400 == status
+
+    def test_mobile_double_subscribe_to_account(self):
+        # Given
+        body = json.dumps({'account': 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqasgi'}).encode()
+
+        # When
+        first, _, _ = self.request('POST', '/mobile/subscribe', body, 'application/json')
+        second, _, _ = self.request('POST', '/mobile/subscribe', body, 'application/json')
+
+        # Then
+        assert 201 == first
+        assert 409 == second
+
+    def test_get_transaction_history_is_rate_limited_per_client(self):
+        # Given
+        limits = dict(limiter.limits)
+        limiter.limits[('transactions', 'ip')] = Limit(2, 60)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        self.request('GET', f'/transactions/{ACCOUNT}')
+        self.request('GET', f'/transactions/{OTHER_ACCOUNT}')
+
+        # When
+        status, headers, _ = self.request('GET', f'/transactions/{ACCOUNT}')
+
+        # Then
+        assert 429 == status
+        assert b'30' == headers[b'retry-after']
+
+    def test_node_response_over_the_size_limit_is_refused(self):
+        # Given
+        node = AsyncNodeClient(self.node.url, http=AsyncHTTPClient(max_size=100), retries=0)
+
+        # When
+        with self.assertRaises(NodeError):
+            self.loop.run_until_complete(node.account_history(ACCOUNT))
+
+        # Then
+        self.loop.run_until_complete(node.close())
+
+    def test_mobile_import_body_without_content_length_reaches_flask(self):
+        # Given
+        account = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqasim'
+        lines = (json.dumps({'account': account}) + '\n').encode()
+
+        # When
+        status, _, data = self.request('POST', '/mobile/subscribe/import', lines, 'application/x-ndjson')
+
+        # Then
+        assert 200 == status
+        assert 1 == json.loads(data.decode())['imported']
+
+    def test_concurrent_slow_node_requests_do_not_block(self):
+        # Given
+        self.node.latency = 0.2
+        accounts = ['xrb_1' + ALPHABET[i % 32] + ALPHABET[i // 32] * 58 for i in range(50)]
+
+        async def fetch_all():
+            return await asyncio.gather(*[self._request('GET', f'/transactions/{account}', b'', None)
+                                          for account in accounts])
+
+        # When
+        start = time.monotonic()
+        responses = self.loop.run_until_complete(fetch_all())
+        elapsed = time.monotonic() - start
+
+        # Then
+        assert [200] * 50 == [status for status, _, _ in responses]
+        assert elapsed < 0.2 * 50 / 5
+
+    def test_poll_transactions_returns_new_history(self):
+        # Given
+        self.asgi.feed = FeedHub(load=lambda accounts, count: {account: HISTORY for account in accounts},
+                                 interval=0.01)
+
+        # When
+        changed, _, body = self.request('GET', f'/transactions/{ACCOUNT}/poll', query=b'head=0000&timeout=1')
+        unchanged, _, _ = self.request('GET', f'/transactions/{ACCOUNT}/poll',
+                                       query=f'head={HISTORY[0]["hash"]}&timeout=0.05'.encode())
+
+        # Then
+        assert 200 == changed
+        assert HISTORY == json.loads(body.decode())
+        assert 204 == unchanged
+        assert {'accounts': 0, 'watchers': 0} == self.asgi.feed.stats()
+
+    def test_poll_transactions_is_limited_per_client_and_per_process(self):
+        # Given
+        self.asgi.feed = FeedHub(load=lambda accounts, count: {}, interval=0.01, max_accounts=1, max_client_watches=1)
+        self.asgi.feed.watch(Watcher(ACCOUNT, client='10.0.0.1'))
+
+        # When
+        full_status, full_headers, _ = self.request('GET', f'/transactions/{OTHER_ACCOUNT}/poll', query=b'timeout=0.05')
+        self.asgi.feed.watch(Watcher(ACCOUNT, client='127.0.0.1'))
+        client_status, client_headers, _ = self.request('GET', f'/transactions/{ACCOUNT}/poll', query=b'timeout=0.05')
+
+        # Then
+        assert 503 == full_status
+        assert 429 == client_status
+        assert b'retry-after' in full_headers and b'retry-after' in client_headers
+
+    def test_poll_transactions_is_rate_limited(self):
+        # Given
+        self.asgi.feed = FeedHub(load=lambda accounts, count: {}, interval=0.01)
+        limits = dict(limiter.limits)
+        limiter.limits[('transactions', 'ip')] = Limit(1, 60)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        self.request('GET', f'/transactions/{ACCOUNT}/poll', query=b'timeout=0.01')
+
+        # When
+        status, _, _ = self.request('GET', f'/transactions/{ACCOUNT}/poll', query=b'timeout=0.01')
+
+        # Then
+        assert 429 == status
+
+    def test_transaction_events_fan_out_without_threads(self):
+        # Given
+        loads = []
+
+        def load(accounts, count):
+            loads.append(accounts)
+            return {account: HISTORY for account in accounts}
+
+        self.asgi.feed = FeedHub(load=load, interval=0.01, max_client_watches=100)
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'path': f'/transactions/{ACCOUNT}/events',
+                 'query_string': b'', 'headers': [], 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+
+        async def watch():
+            disconnect = asyncio.Event()
+            sent = []
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if b'event: history' in message.get('body', b''):
+                    disconnect.set()
+
+            await self.asgi(scope, receive, send)
+            return sent
+
+        async def watch_all():
+            return await asyncio.gather(*[watch() for _ in range(100)])
+
+        # When
+        responses = self.loop.run_until_complete(watch_all())
+
+        # Then
+        for sent in responses:
+            assert 200 == sent[0]['status']
+            assert (b'content-type', b'text/event-stream') in sent[0]['headers']
+            assert f'data: {json.dumps(HISTORY)}'.encode() in sent[-1]['body']
+        assert all(accounts == [ACCOUNT] for accounts in loads)
+        assert {'accounts': 0, 'watchers': 0} == self.asgi.feed.stats()
@@ -0,0 +1,72 @@
+import unittest
+
+from app import bulk
+from app.accounts import ALPHABET
+from app.database import init_db, db_session
+from app.models import Subscription
+
+EMAIL = 'bulk@example.com'
+ACCOUNTS = ['xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqbqk' + ALPHABET[i] for i in range(5)]
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        init_db()
+        db_session.query(Subscription).filter(Subscription.account.in_(ACCOUNTS)).delete(synchronize_session=False)
+        db_session.commit()
+
+    def tearDown(self):
+        db_session.rollback()
+        db_session.remove()
+
+    def test_parse_csv_with_header(self):
+        # Given
+        lines = [b'account,label\r\n', f'{ACCOUNTS[0]},cold wallet\r\n'.encode(), b'\r\n', f'{ACCOUNTS[1]}\n'.encode()]
+
+        # When
+        accounts = list(bulk.parse_accounts(lines, bulk.CSV))
+
+        # Then
+        assert ACCOUNTS[:2] == accounts
+
+    def test_parse_json_lines(self):
+        # Given
+        lines = [f'{{"account": "{ACCOUNTS[0]}"}}\n'.encode(), f'"{ACCOUNTS[1]}"\n'.encode(), b'not json\n']
+
+        # When
+        accounts = list(bulk.parse_accounts(lines, bulk.JSON_LINES))
+
+        # Then
+        assert ACCOUNTS[:2] + [None] == accounts
+
+    def test_import_deduplicates_and_validates(self):
+        # Given
+        db_session.add(Subscription(account=ACCOUNTS[0], email=EMAIL))
+        db_session.commit()
+        accounts = ACCOUNTS + [ACCOUNTS[1], 'nano_account', None]
+
+        # When
+        result = bulk.import_subscriptions(accounts, email=EMAIL, batch_size=2)
+        db_session.commit()
+
+        # Then
+        assert bulk.ImportResult(imported=4, duplicates=2, invalid=2) == result
+        subscriptions = db_session.query(Subscription).filter(Subscription.email_lower == EMAIL).all()
+        assert sorted(ACCOUNTS) == sorted(subscription.account for subscription in subscriptions)
+
+    def test_import_limits_number_of_accounts(self):
+        # When / Then
+        with self.assertRaises(bulk.TooManyAccounts):
+            bulk.import_subscriptions(ACCOUNTS, email=EMAIL, max_accounts=2)
+
+    def test_export_json_lines(self):
+        # Given
+        bulk.import_subscriptions(ACCOUNTS[:2], email=EMAIL)
+        db_session.commit()
+
+        # When
+        lines = list(bulk.export_subscriptions(EMAIL.upper(), bulk.JSON_LINES))
+
+        # Then
+        assert [f'{{"account": "{account}"}}\n' for account in ACCOUNTS[:2]] == lines
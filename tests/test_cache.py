@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+
+from app.cache import TTLCache
+from fake_clock import FakeClock
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_or_load_caches_value(self):
+        # Given
+        self.cache.get_or_load('key', lambda: 'value')
+
+        # When
+        value = self.cache.get_or_load('key', lambda: 'other')
+
+        # Then
+        assert 'value' == value
+        assert 1 == self.cache.hits
+        assert 1 == self.cache.misses
+
+    def test_entry_expires_after_ttl(self):
+        # Given
+        self.cache.set('key', 'value')
+
+        # When
+        self.clock.now = 10
+
+        # Then
+        assert self.cache.get('key') is None
+
+    def test_least_recently_used_entry_is_evicted(self):
+        # Given
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+
+        # When
+        self.cache.set('c', 3)
+
+        # Then
+        assert 1 == self.cache.get('a')
+        assert self.cache.get('b') is None
+        assert 1 == self.cache.stats()['evictions']
+
+    def test_loader_error_is_not_cached(self):
+        # Given
+        def fail():
+            raise ValueError('node down')
+
+        # When
+        with self.assertRaises(ValueError):
+            self.cache.get_or_load('key', fail)
+
+        # Then
+        assert 'value' == self.cache.get_or_load('key', lambda: 'value')
+
+    def test_concurrent_misses_are_coalesced(self):
+        # Given
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(self.cache.get_or_load('key', slow_loader)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(self.cache.get_or_load('key', slow_loader)))
+                     for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while self.cache.stats()['coalesced'] < 3:
+            time.sleep(0.001)
+
+        # When
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        # Then
+        assert ['value'] * 4 == results
+        assert 1 == len(calls)
+        assert 3 == self.cache.coalesced
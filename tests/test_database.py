@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask, g
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import create_db_engine, RoutingSession
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_in_memory_sqlite_shares_one_connection(self):
+        # When
+        engine = create_db_engine('sqlite://')
+
+        # Then
+        assert isinstance(engine.pool, StaticPool)
+
+    def test_file_sqlite_uses_wal(self):
+        # Given
+        engine = create_db_engine(f'sqlite:///{os.path.join(self.directory, "nanotify.db")}',
+                                  statement_timeout_ms=2500)
+
+        # When
+        journal_mode = engine.execute('PRAGMA journal_mode').scalar()
+        synchronous = engine.execute('PRAGMA synchronous').scalar()
+        busy_timeout = engine.execute('PRAGMA busy_timeout').scalar()
+
+        # Then
+        assert 'wal' == journal_mode
+        assert 1 == synchronous
+        assert 2500 == busy_timeout
+
+    def test_read_only_views_query_the_read_engine(self):
+        # Given
+        primary = create_db_engine(f'sqlite:///{os.path.join(self.directory, "primary.db")}')
+        replica = create_db_engine(f'sqlite:///{os.path.join(self.directory, "replica.db")}')
+        session = sessionmaker(class_=RoutingSession, bind=primary, read_bind=replica)()
+
+        # When
+        with Flask(__name__).app_context():
+            write_bind = session.get_bind()
+            g.read_only = True
+            read_bind = session.get_bind()
+
+        # Then
+        assert primary is write_bind
+        assert replica is read_bind
+
+    def test_read_only_views_without_replica_query_the_primary(self):
+        # Given
+        primary = create_db_engine('sqlite://')
+        session = sessionmaker(class_=RoutingSession, bind=primary)()
+
+        # When
+        with Flask(__name__).app_context():
+            g.read_only = True
+            bind = session.get_bind()
+
+        # Then
+        assert primary is bind
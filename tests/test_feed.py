@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import unittest
+
+from app.feed import FeedHub, FeedFull, TooManyWatches, Watcher, AsyncWatcher, event
+
+ACCOUNT = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+OTHER_ACCOUNT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+FIRST = [{'type': 'receive', 'hash': 'A' * 64}]
+SECOND = [{'type': 'send', 'hash': 'B' * 64}] + FIRST
+
+
+class StubLoad:
+
+    def __init__(self, histories):
+        self.histories = histories
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, accounts, count):
+        with self.lock:
+            self.calls.append(sorted(accounts))
+        return {account: self.histories[account] for account in accounts if account in self.histories}
+
+
+class TestFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.load = StubLoad({ACCOUNT: FIRST, OTHER_ACCOUNT: FIRST})
+        self.hub = FeedHub(load=self.load, interval=0.01)
+
+    def test_watchers_of_an_account_share_one_upstream_load(self):
+        # Given
+        watchers = [self.hub.watch(Watcher(ACCOUNT)) for _ in range(50)]
+        self.hub.watch(Watcher(OTHER_ACCOUNT))
+
+        # When
+        histories = [watcher.next(1) for watcher in watchers]
+
+        # Then
+        assert [FIRST] * 50 == histories
+        assert all(len(accounts) <= 2 for accounts in self.load.calls)
+        assert {'accounts': 2, 'watchers': 51} == self.hub.stats()
+
+    def test_watcher_is_only_notified_when_head_changes(self):
+        # Given
+        watcher = self.hub.watch(Watcher(ACCOUNT))
+        assert FIRST == watcher.next(1)
+
+        # When
+        unchanged = watcher.next(0.05)
+        self.load.histories[ACCOUNT] = SECOND
+        changed = watcher.next(1)
+
+        # Then
+        assert unchanged is None
+        assert SECOND == changed
+
+    def test_reconnecting_watcher_skips_history_it_has_seen(self):
+        # Given
+        self.hub.watch(Watcher(ACCOUNT)).next(1)
+
+        # When
+        watcher = self.hub.watch(Watcher(ACCOUNT, head=FIRST[0]['hash']))
+
+        # Then
+        assert watcher.next(0.05) is None
+
+    def test_unwatched_accounts_are_no_longer_polled(self):
+        # Given
+        watcher = self.hub.watch(Watcher(ACCOUNT))
+        watcher.next(1)
+
+        # When
+        self.hub.unwatch(watcher)
+        calls = len(self.load.calls)
+        self.hub.poll()
+
+        # Then
+        assert calls == len(self.load.calls)
+        assert {'accounts': 0, 'watchers': 0} == self.hub.stats()
+
+    def test_watches_are_capped_per_client_and_per_process(self):
+        # Given
+        hub = FeedHub(load=self.load, interval=0.01, max_accounts=1, max_client_watches=1)
+        watcher = hub.watch(Watcher(ACCOUNT, client='client'))
+
+        # When / Then
+        with self.assertRaises(TooManyWatches):
+            hub.watch(Watcher(ACCOUNT, client='client'))
+        with self.assertRaises(FeedFull):
+            hub.watch(Watcher(OTHER_ACCOUNT, client='other'))
+        hub.watch(Watcher(ACCOUNT, client='other'))
+        hub.unwatch(watcher)
+        hub.watch(Watcher(ACCOUNT, client='client'))
+
+    def test_event_is_identified_by_its_head(self):
+        # When
+        sent = event(FIRST)
+
+        # Then
+        assert sent.startswith(f'id: {FIRST[0]["hash"]}\nevent: history\ndata: ')
+        assert sent.endswith('\n\n')
+
+    def test_async_watcher_is_woken_from_the_poller(self):
+        # Given
+        loop = asyncio.new_event_loop()
+
+        async def watch():
+            watcher = self.hub.watch(AsyncWatcher(ACCOUNT, loop=loop))
+            return await watcher.next_async(1)
+
+        # When
+        history = loop.run_until_complete(watch())
+        loop.close()
+
+        # Then
+        assert FIRST == history
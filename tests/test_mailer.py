@@ -0,0 +1,121 @@
+import datetime
+import socket
+import unittest
+
+from app.database import init_db, db_session
+from app.mailer import DigestSender, PersistentSMTP
+from app.models import EmailDelivery, Notification, NotificationClaim, NotificationCursor, Subscription
+from app.subscribers import subscribers_cache
+from app.users import webhook_cache
+from stub_smtp import StubSMTP
+
+ACCOUNT = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+OTHER_ACCOUNT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+
+
+class TestMailer(unittest.TestCase):
+
+    def setUp(self):
+        init_db()
+        for model in (EmailDelivery, NotificationClaim, NotificationCursor, Notification):
+            db_session.query(model).delete()
+        db_session.query(Subscription).filter(Subscription.account.in_([ACCOUNT, OTHER_ACCOUNT])).delete(
+            synchronize_session=False)
+        db_session.commit()
+        subscribers_cache.clear()
+        webhook_cache.clear()
+        self.smtp = StubSMTP(refused={'refused@example.com'}).start()
+        self.now = datetime.datetime(2018, 1, 1)
+        self.sender = DigestSender(smtp=PersistentSMTP('127.0.0.1', self.smtp.port), window=60,
+                                   clock=lambda: self.now)
+
+    def tearDown(self):
+        self.sender.close()
+        self.smtp.stop()
+        db_session.remove()
+
+    def subscribe(self, account, *emails):
+        for email in emails:
+            db_session.add(Subscription(account=account, email=email))
+        db_session.commit()
+
+    def notify(self, account, count=1):
+        for i in range(count):
+            db_session.add(Notification(account=account, hash=f'{account[-4:]}{i:060X}', amount='1000', block='{}'))
+        db_session.commit()
+
+    def test_notifications_are_coalesced_into_one_digest_per_recipient(self):
+        # Given
+        self.subscribe(ACCOUNT, 'test@example.com', 'other@example.com')
+        self.subscribe(OTHER_ACCOUNT, 'TEST@example.com')
+        self.notify(ACCOUNT, count=50)
+        self.notify(OTHER_ACCOUNT, count=50)
+
+        # When
+        before_window = self.sender.run_once()
+        self.now += datetime.timedelta(seconds=60)
+        after_window = self.sender.run_once()
+
+        # Then
+        assert 0 == before_window
+        assert 2 == after_window
+        assert 1 == self.smtp.connections
+        digests = {recipients[0].lower(): message for recipients, message in self.smtp.messages}
+        assert {'test@example.com', 'other@example.com'} == set(digests)
+        assert '100 new Nano transactions' == digests['test@example.com']['Subject']
+        assert '50 new Nano transactions' == digests['other@example.com']['Subject']
+        html = digests['other@example.com'].get_body(('html',)).get_content()
+        assert ACCOUNT in html and f'{ACCOUNT[-4:]}{49:060X}' in html
+
+    def test_sent_notifications_are_not_sent_again(self):
+        # Given
+        self.subscribe(ACCOUNT, 'test@example.com')
+        self.notify(ACCOUNT)
+        self.sender.run_once()
+        self.now += datetime.timedelta(seconds=60)
+        self.sender.run_once()
+
+        # When
+        sent = self.sender.run_once()
+
+        # Then
+        assert 0 == sent
+        assert 1 == len(self.smtp.messages)
+        assert [(EmailDelivery.SENT,)] == db_session.query(EmailDelivery.status).all()
+
+    def test_refused_recipient_does_not_block_others(self):
+        # Given
+        self.subscribe(ACCOUNT, 'refused@example.com', 'test@example.com')
+        self.notify(ACCOUNT)
+        self.sender.expand()
+        self.now += datetime.timedelta(seconds=60)
+
+        # When
+        sent = self.sender.run_once()
+
+        # Then
+        assert 1 == sent
+        assert [['test@example.com']] == [recipients for recipients, _ in self.smtp.messages]
+        assert {('refused@example.com', EmailDelivery.FAILED), ('test@example.com', EmailDelivery.SENT)} == \
+            set(db_session.query(EmailDelivery.email, EmailDelivery.status))
+
+    def test_connection_is_reopened_when_the_server_drops_it(self):
+        # Given
+        self.subscribe(ACCOUNT, 'test@example.com')
+        self.notify(ACCOUNT)
+        self.sender.expand()
+        self.now += datetime.timedelta(seconds=60)
+        self.sender.send_due()
+        self.sender.smtp._smtp.sock.shutdown(socket.SHUT_RDWR)
+        self.subscribe(OTHER_ACCOUNT, 'other@example.com')
+        self.notify(OTHER_ACCOUNT)
+        self.sender.expand()
+        self.now += datetime.timedelta(seconds=60)
+
+        # When
+        sent = self.sender.send_due()
+
+        # Then
+        assert 1 == sent
+        assert 2 == len(self.smtp.messages)
+        assert 2 == self.smtp.connections
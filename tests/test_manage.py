@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestManage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'nanotify.db')
+        self.env = dict(os.environ, DATABASE_URL=f'sqlite:///{self.path}',
+                        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_python(self, *args):
+        subprocess.check_call([sys.executable, *args], cwd=ROOT, env=self.env, stderr=subprocess.DEVNULL)
+
+    def tables(self):
+        with sqlite3.connect(self.path) as connection:
+            return {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def test_importing_the_app_leaves_the_schema_alone(self):
+        # When
+        self.run_python('-c', 'import run')
+
+        # Then
+        assert set() == self.tables()
+
+    def test_init_db_creates_the_schema_once(self):
+        # Given
+        self.run_python('-m', 'app.manage', 'init-db')
+
+        # When
+        self.run_python('-m', 'app.manage', 'init-db')
+        self.run_python('-m', 'app.manage', 'migrate')
+
+        # Then
+        assert {'subscription', 'user', 'schema_migration', 'account_history'} <= self.tables()
+        with sqlite3.connect(self.path) as connection:
+            versions = connection.execute('SELECT version FROM schema_migration ORDER BY version').fetchall()
+            assert [(1,), (2,), (3,), (4,), (5,), (6,), (7,)] == versions
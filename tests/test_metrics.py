@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from app.metrics import Registry, render
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_render_counter(self):
+        # Given
+        registry = Registry(directory=None)
+        errors = registry.counter('node_errors_total', 'Node errors', ['action'])
+        errors.inc(action='account_history')
+        errors.inc(action='account_history')
+
+        # When
+        text = registry.render()
+
+        # Then
+        assert '# TYPE node_errors_total counter' in text
+        assert 'node_errors_total{action="account_history"} 2.0' in text
+
+    def test_render_histogram(self):
+        # Given
+        registry = Registry(directory=None)
+        latency = registry.histogram('latency_seconds', 'Latency', ['endpoint'], buckets=(0.1, 1))
+        latency.observe(0.05, endpoint='profile.login')
+        latency.observe(0.5, endpoint='profile.login')
+        latency.observe(5, endpoint='profile.login')
+
+        # When
+        text = registry.render()
+
+        # Then
+        assert 'latency_seconds_bucket{endpoint="profile.login",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{endpoint="profile.login",le="1.0"} 2' in text
+        assert 'latency_seconds_bucket{endpoint="profile.login",le="+Inf"} 3' in text
+        assert 'latency_seconds_count{endpoint="profile.login"} 3' in text
+        assert 'latency_seconds_sum{endpoint="profile.login"} 5.55' in text
+
+    def test_aggregates_across_processes(self):
+        # Given
+        directory = tempfile.mkdtemp()
+        other_worker = Registry(directory=None)
+        other_worker.counter('requests_total', 'Requests').inc(3)
+        other_worker.histogram('latency_seconds', 'Latency', buckets=(1,)).observe(0.5)
+        with open(os.path.join(directory, '1.json'), 'w') as f:
+            json.dump(other_worker.snapshot(), f)
+        registry = Registry(directory=directory)
+        registry.counter('requests_total', 'Requests').inc(2)
+        registry.histogram('latency_seconds', 'Latency', buckets=(1,)).observe(2)
+
+        # When
+        text = registry.render()
+
+        # Then
+        assert 'requests_total 5.0' in text
+        assert 'latency_seconds_bucket{le="1.0"} 1' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+        assert os.path.exists(os.path.join(directory, f'{registry.key}.json'))
+
+    def test_snapshot_key_is_unique_to_the_process(self):
+        # Given
+        first, second = Registry(directory=None), Registry(directory=None)
+
+        # Then
+        assert first.key != second.key
+        assert first.key.startswith(f'{os.getpid()}-')
+        assert first.key == first.key
+
+    def test_exited_processes_are_folded_into_the_dead_totals(self):
+        # Given
+        directory = tempfile.mkdtemp()
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        exited = Registry(directory=None)
+        exited.counter('requests_total', 'Requests').inc(3)
+        exited.histogram('latency_seconds', 'Latency', buckets=(1,)).observe(0.5)
+        for name in (f'{process.pid}-a.json', f'{process.pid}-b.json'):
+            with open(os.path.join(directory, name), 'w') as f:
+                json.dump(exited.snapshot(), f)
+        registry = Registry(directory=directory)
+        registry.counter('requests_total', 'Requests').inc(2)
+        registry.histogram('latency_seconds', 'Latency', buckets=(1,))
+
+        # When
+        text = registry.render()
+        again = registry.render()
+
+        # Then
+        assert 'requests_total 8.0' in text
+        assert 'latency_seconds_bucket{le="1.0"} 2' in text
+        assert text == again
+        assert sorted([f'{registry.key}.json', 'dead.json']) == sorted(
+            name for name in os.listdir(directory) if name.endswith('.json'))
+
+    def test_escapes_label_values(self):
+        # Given
+        registry = Registry(directory=None)
+        registry.counter('errors_total', 'Errors', ['error']).inc(error='say "hi"\n')
+
+        # When
+        text = render(registry.snapshot())
+
+        # Then
+        assert 'errors_total{error="say \\"hi\\"\\n"} 1.0' in text
@@ -0,0 +1,166 @@
+import unittest
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Query
+
+from app.database import Base
+from app.migrations import upgrade
+from app.models import Subscription, User
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE subscription (id VARCHAR NOT NULL PRIMARY KEY, email VARCHAR, webhook VARCHAR, '
+    'account VARCHAR NOT NULL)',
+    'CREATE TABLE user (email VARCHAR NOT NULL PRIMARY KEY, password VARCHAR NOT NULL, webhook VARCHAR)',
+    "INSERT INTO user (email, password) VALUES ('TEST@example.com', 'password')",
+    "INSERT INTO subscription (id, email, account) VALUES ('1', 'TEST@example.com', 'xrb_1')",
+    "INSERT INTO subscription (id, account) VALUES ('2', 'xrb_2')",
+]
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def query_plan(self, query):
+        statement = query.statement.compile(self.engine, compile_kwargs={'literal_binds': True})
+        return ' '.join(row[-1] for row in self.engine.execute(f'EXPLAIN QUERY PLAN {statement}'))
+
+    def test_upgrade_existing_database(self):
+        # Given
+        for statement in LEGACY_SCHEMA:
+            self.engine.execute(statement)
+
+        # When
+        upgrade(self.engine)
+
+        # Then
+        assert [('test@example.com',)] == self.engine.execute('SELECT email_lower FROM user').fetchall()
+        assert [('test@example.com',), (None,)] == \
+            self.engine.execute('SELECT email_lower FROM subscription ORDER BY id').fetchall()
+        indexes = {index['name'] for index in inspect(self.engine).get_indexes('subscription')}
+        assert {'ix_subscription_email_lower_account', 'ix_subscription_account'} <= indexes
+
+    def test_upgrade_moves_webhooks_to_users(self):
+        # Given
+        for statement in LEGACY_SCHEMA + [
+            "INSERT INTO user (email, password) VALUES ('hook@example.com', 'password')",
+            "INSERT INTO subscription (id, email, webhook, account) VALUES ('3', 'hook@example.com', 'http://a', 'xrb_1')",
+            "INSERT INTO subscription (id, email, webhook, account) VALUES ('4', 'HOOK@example.com', 'http://a', 'xrb_1')",
+            "INSERT INTO subscription (id, email, webhook, account) VALUES ('5', 'hook@example.com', 'http://a', 'xrb_2')",
+        ]:
+            self.engine.execute(statement)
+
+        # When
+        upgrade(self.engine)
+
+        # Then
+        assert 'webhook' not in {column['name'] for column in inspect(self.engine).get_columns('subscription')}
+        assert [('http://a',)] == \
+            self.engine.execute("SELECT webhook FROM user WHERE email = 'hook@example.com'").fetchall()
+        assert [('1',), ('2',), ('3',), ('5',)] == self.engine.execute('SELECT id FROM subscription ORDER BY id').fetchall()
+
+    def test_upgrade_normalizes_subscription_accounts(self):
+        # Given
+        for statement in LEGACY_SCHEMA + [
+            "INSERT INTO subscription (id, account) VALUES ('3', 'XRB_2')",
+            "INSERT INTO subscription (id, email, account) VALUES ('4', 'test@example.com', 'nano_1')",
+            "INSERT INTO subscription (id, account) VALUES ('5', ' NANO_3')",
+        ]:
+            self.engine.execute(statement)
+
+        # When
+        upgrade(self.engine)
+
+        # Then
+        assert [('1', 'xrb_1'), ('2', 'xrb_2'), ('5', 'xrb_3')] == \
+            self.engine.execute('SELECT id, account FROM subscription ORDER BY id').fetchall()
+
+    def test_upgrade_adds_viewed_at_to_account_history(self):
+        # Given
+        for statement in LEGACY_SCHEMA + [
+            'CREATE TABLE account_history (account VARCHAR NOT NULL PRIMARY KEY, head VARCHAR, tail VARCHAR, '
+            'complete BOOLEAN NOT NULL, synced_at DATETIME NOT NULL)',
+        ]:
+            self.engine.execute(statement)
+
+        # When
+        upgrade(self.engine)
+
+        # Then
+        assert 'viewed_at' in {column['name'] for column in inspect(self.engine).get_columns('account_history')}
+        assert 'ix_account_history_viewed_at' in \
+            {index['name'] for index in inspect(self.engine).get_indexes('account_history')}
+
+    def test_upgrade_drops_histories_with_duplicate_blocks(self):
+        # Given
+        for statement in LEGACY_SCHEMA + [
+            'CREATE TABLE account_history (account VARCHAR NOT NULL PRIMARY KEY, head VARCHAR, tail VARCHAR, '
+            'complete BOOLEAN NOT NULL, synced_at DATETIME NOT NULL)',
+            'CREATE TABLE account_transaction (id INTEGER NOT NULL PRIMARY KEY, account VARCHAR NOT NULL, '
+            'seq INTEGER NOT NULL, hash VARCHAR NOT NULL, entry TEXT NOT NULL)',
+            'CREATE INDEX ix_account_transaction_account_hash ON account_transaction (account, hash)',
+            "INSERT INTO account_history VALUES ('xrb_1', 'H1', 'H0', 1, '2020-01-01')",
+            "INSERT INTO account_history VALUES ('xrb_2', 'H0', 'H0', 1, '2020-01-01')",
+            "INSERT INTO account_transaction VALUES (1, 'xrb_1', 0, 'H0', '{}')",
+            "INSERT INTO account_transaction VALUES (2, 'xrb_1', 1, 'H1', '{}')",
+            "INSERT INTO account_transaction VALUES (3, 'xrb_1', 2, 'H1', '{}')",
+            "INSERT INTO account_transaction VALUES (4, 'xrb_2', 0, 'H0', '{}')",
+        ]:
+            self.engine.execute(statement)
+
+        # When
+        upgrade(self.engine)
+
+        # Then
+        assert [('xrb_2',)] == self.engine.execute('SELECT account FROM account_history').fetchall()
+        assert [(4,)] == self.engine.execute('SELECT id FROM account_transaction').fetchall()
+        indexes = {index['name']: index['unique'] for index in inspect(self.engine).get_indexes('account_transaction')}
+        assert indexes.get('ux_account_transaction_account_hash')
+        assert 'ix_account_transaction_account_hash' not in indexes
+
+    def test_upgrade_is_idempotent(self):
+        # Given
+        Base.metadata.create_all(bind=self.engine)
+        upgrade(self.engine)
+
+        # When
+        upgrade(self.engine)
+
+        # Then
+        versions = self.engine.execute('SELECT version FROM schema_migration ORDER BY version').fetchall()
+        assert [(1,), (2,), (3,), (4,), (5,), (6,), (7,)] == versions
+
+    def test_login_lookup_uses_index(self):
+        # Given
+        Base.metadata.create_all(bind=self.engine)
+        upgrade(self.engine)
+
+        # When
+        plan = self.query_plan(Query(User).filter(User.email_lower == 'test@example.com'))
+
+        # Then
+        assert 'USING INDEX ix_user_email_lower' in plan
+
+    def test_subscription_lookup_uses_index(self):
+        # Given
+        Base.metadata.create_all(bind=self.engine)
+        upgrade(self.engine)
+
+        # When
+        plan = self.query_plan(Query(Subscription).filter(Subscription.email_lower == 'test@example.com')
+                               .filter(Subscription.account == 'xrb_1'))
+
+        # Then
+        assert 'USING INDEX ix_subscription_email_lower_account' in plan
+
+    def test_account_lookup_uses_index(self):
+        # Given
+        Base.metadata.create_all(bind=self.engine)
+        upgrade(self.engine)
+
+        # When
+        plan = self.query_plan(Query(Subscription).filter(Subscription.account == 'xrb_1'))
+
+        # Then
+        assert 'USING INDEX ix_subscription_account' in plan
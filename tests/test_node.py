@@ -0,0 +1,94 @@
+import json
+import unittest
+
+import requests_mock
+from requests import ConnectTimeout
+
+from app.node import NodeClient, CircuitBreaker, NodeError, NodeUnavailable
+from fake_clock import FakeClock
+
+NODE_URL = 'http://[::1]:7076'
+
+
+class TestNodeClient(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=30, clock=self.clock)
+        self.client = NodeClient(NODE_URL, retries=2, backoff=0, breaker=self.breaker)
+
+    @requests_mock.mock()
+    def test_call_posts_action(self, mock_request):
+        # Given
+        mock_request.post(NODE_URL, text=json.dumps({'count': '100'}))
+
+        # When
+        result = self.client.call('block_count')
+
+        # Then
+        assert {'count': '100'} == result
+        assert {'action': 'block_count'} == mock_request.last_request.json()
+
+    @requests_mock.mock()
+    def test_idempotent_action_is_retried(self, mock_request):
+        # Given
+        mock_request.post(NODE_URL, [{'exc': ConnectTimeout}, {'text': json.dumps({'history': []})}])
+
+        # When
+        result = self.client.call('account_history', account='xrb_1', count=10)
+
+        # Then
+        assert {'history': []} == result
+        assert 2 == mock_request.call_count
+
+    @requests_mock.mock()
+    def test_non_idempotent_action_is_not_retried(self, mock_request):
+        # Given
+        mock_request.post(NODE_URL, exc=ConnectTimeout)
+
+        # When
+        with self.assertRaises(ConnectTimeout):
+            self.client.call('send', wallet='wallet')
+
+        # Then
+        assert 1 == mock_request.call_count
+
+    @requests_mock.mock()
+    def test_invalid_response_raises_node_error(self, mock_request):
+        # Given
+        mock_request.post(NODE_URL, text='not json')
+
+        # When / Then
+        with self.assertRaises(NodeError):
+            self.client.call('block_count')
+
+    @requests_mock.mock()
+    def test_breaker_opens_and_fails_fast(self, mock_request):
+        # Given
+        mock_request.post(NODE_URL, exc=ConnectTimeout)
+        for _ in range(2):
+            with self.assertRaises(ConnectTimeout):
+                self.client.call('send')
+
+        # When
+        with self.assertRaises(NodeUnavailable):
+            self.client.call('send')
+
+        # Then
+        assert 2 == mock_request.call_count
+        assert CircuitBreaker.OPEN == self.breaker.state
+
+    @requests_mock.mock()
+    def test_breaker_closes_after_successful_trial(self, mock_request):
+        # Given
+        mock_request.post(NODE_URL, [{'exc': ConnectTimeout}, {'exc': ConnectTimeout}, {'text': '{}'}])
+        for _ in range(2):
+            with self.assertRaises(ConnectTimeout):
+                self.client.call('send')
+
+        # When
+        self.clock.now = 30
+        self.client.call('send')
+
+        # Then
+        assert CircuitBreaker.CLOSED == self.breaker.state
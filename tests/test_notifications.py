@@ -0,0 +1,191 @@
+import datetime
+import json
+import threading
+import unittest
+
+from werkzeug.serving import make_server
+
+from app.database import init_db, db_session
+from app.models import Notification, NotificationClaim, NotificationCursor, Subscription
+from app.notifications import parse_callback, claim, InvalidCallback, NotificationQueue
+from app.subscribers import subscribed_accounts
+from run import app
+from stub_node import StubNode
+
+SENDER = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+RECIPIENT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+HASH = '89F14F380D84746B014323E78985FC1750D64C1345A9870AC4F749250AA6C82D'
+STATE_SEND = {'type': 'state', 'account': SENDER, 'link_as_account': RECIPIENT, 'balance': '0'}
+
+
+class TestParseCallback(unittest.TestCase):
+
+    def test_state_send_notifies_sender_and_recipient(self):
+        # When
+        notifications = parse_callback({'account': SENDER, 'hash': HASH, 'amount': '1', 'is_send': 'true',
+                                         'block': json.dumps(STATE_SEND)})
+
+        # Then
+        assert [SENDER, RECIPIENT] == [notification['account'] for notification in notifications]
+        assert STATE_SEND == json.loads(notifications[0]['block'])
+
+    def test_state_receive_only_notifies_account(self):
+        # When
+        notifications = parse_callback({'account': SENDER, 'hash': HASH, 'subtype': 'receive',
+                                         'block': json.dumps(dict(STATE_SEND, link_as_account=RECIPIENT))})
+
+        # Then
+        assert [SENDER] == [notification['account'] for notification in notifications]
+
+    def test_legacy_send_notifies_destination(self):
+        # When
+        notifications = parse_callback({'account': SENDER.replace('xrb_', 'nano_'), 'hash': HASH,
+                                         'block': json.dumps({'type': 'send', 'destination': RECIPIENT})})
+
+        # Then
+        assert [SENDER, RECIPIENT] == [notification['account'] for notification in notifications]
+
+    def test_invalid_callback(self):
+        for body in (None, [], {'hash': HASH}, {'account': SENDER, 'hash': HASH, 'block': '{'}):
+            with self.assertRaises(InvalidCallback):
+                parse_callback(body)
+
+
+class TestNodeCallback(unittest.TestCase):
+
+    def setUp(self):
+        app.testing = True
+        with app.app_context():
+            init_db()
+        db_session.query(Notification).delete()
+        db_session.query(Subscription).filter(Subscription.account.in_([SENDER, RECIPIENT])).delete(
+            synchronize_session=False)
+        db_session.add(Subscription(account=RECIPIENT, email='test@example.com'))
+        db_session.commit()
+        subscribed_accounts.clear()
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/internal/callback'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        db_session.remove()
+
+    def notifications(self):
+        db_session.remove()
+        return db_session.query(Notification.account, Notification.hash).all()
+
+    def test_callback_queues_blocks_for_subscribed_accounts(self):
+        # When
+        status = StubNode.callback(self.url, HASH, SENDER, STATE_SEND, amount='1', is_send='true')
+
+        # Then
+        assert 200 == status
+        assert [(RECIPIENT, HASH)] == self.notifications()
+
+    def test_callback_ignores_unsubscribed_accounts(self):
+        # When
+        status = StubNode.callback(self.url, HASH, SENDER, dict(STATE_SEND, link_as_account=SENDER))
+
+        # Then
+        assert 200 == status
+        assert [] == self.notifications()
+
+    def test_repeated_callback_is_queued_once(self):
+        # When
+        for _ in range(2):
+            StubNode.callback(self.url, HASH, SENDER, STATE_SEND, is_send='true')
+
+        # Then
+        assert [(RECIPIENT, HASH)] == self.notifications()
+
+    def test_invalid_callback(self):
+        # When
+        status = StubNode.callback(self.url, HASH, SENDER, '{')
+
+        # Then
+        assert 400 == status
+
+    def test_burst_of_callbacks_is_queued(self):
+        # Given
+        hashes = [f'{i:064X}' for i in range(100)]
+        statuses = []
+        threads = [threading.Thread(target=lambda block_hash: statuses.append(
+            StubNode.callback(self.url, block_hash, SENDER, STATE_SEND, is_send='true')), args=(block_hash,))
+            for block_hash in hashes]
+
+        # When
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Then
+        assert [200] * 100 == statuses
+        assert sorted((RECIPIENT, block_hash) for block_hash in hashes) == sorted(self.notifications())
+
+    def test_queue_skips_notifications_already_queued(self):
+        # Given
+        queue = NotificationQueue()
+        notification = {'account': RECIPIENT, 'hash': HASH, 'amount': '1', 'block': '{}'}
+
+        # When
+        first = queue.write([notification, notification])
+        second = queue.write([notification])
+
+        # Then
+        assert 1 == first
+        assert 0 == second
+        assert [(RECIPIENT, HASH)] == self.notifications()
+
+
+class TestClaim(unittest.TestCase):
+
+    def setUp(self):
+        init_db()
+        for model in (NotificationClaim, NotificationCursor, Notification):
+            db_session.query(model).delete()
+        db_session.commit()
+        self.now = datetime.datetime(2018, 1, 1)
+
+    def tearDown(self):
+        db_session.remove()
+
+    def queue(self, *ids, age=0):
+        for notification_id in ids:
+            db_session.add(Notification(id=notification_id, account=SENDER, hash=f'{notification_id:064X}',
+                                        created_at=self.now - datetime.timedelta(seconds=age)))
+        db_session.commit()
+
+    def claim(self):
+        rows = claim(db_session, 'test', 10, settle=60, clock=lambda: self.now)
+        db_session.commit()
+        return [notification_id for notification_id, _ in rows]
+
+    def test_notification_committed_after_a_higher_id_is_claimed(self):
+        # Given
+        self.queue(2)
+        first = self.claim()
+
+        # When
+        self.queue(1)
+        second = self.claim()
+
+        # Then
+        assert [2] == first
+        assert [1] == second
+        assert [] == self.claim()
+
+    def test_cursor_moves_past_settled_claims(self):
+        # Given
+        self.queue(1, 2, age=120)
+        self.queue(3)
+
+        # When
+        claimed = self.claim()
+
+        # Then
+        assert [1, 2, 3] == claimed
+        assert 2 == db_session.query(NotificationCursor.last_id).filter(NotificationCursor.channel == 'test').scalar()
+        assert [(3,)] == db_session.query(NotificationClaim.notification_id).all()
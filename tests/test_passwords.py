@@ -0,0 +1,121 @@
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import unittest
+
+import bcrypt
+
+from app.passwords import PasswordHasher, HashingOverloaded
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.hasher = PasswordHasher(rounds=4, workers=1, max_queue=1, directory=self.directory)
+
+    def test_hash_and_check(self):
+        # Given
+        hashed = self.hasher.hash('password')
+
+        # When / Then
+        assert self.hasher.check('password', hashed)
+        assert not self.hasher.check('wrong', hashed)
+
+    def test_needs_rehash_when_rounds_change(self):
+        # Given
+        hashed = bcrypt.hashpw(b'password', bcrypt.gensalt(5))
+
+        # When / Then
+        assert self.hasher.needs_rehash(hashed)
+        assert not self.hasher.needs_rehash(self.hasher.hash('password'))
+
+    def test_sheds_load_when_queue_is_full(self):
+        # Given
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash(*args):
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=self.hasher._run, args=('hash', slow_hash))
+        thread.start()
+        started.wait(5)
+
+        # When
+        with self.assertRaises(HashingOverloaded):
+            self.hasher.hash('password')
+
+        # Then
+        release.set()
+        thread.join(5)
+        assert 0 == self.hasher.pending
+
+    def test_sheds_load_when_no_hashing_slot_frees_in_time(self):
+        # Given
+        hasher = PasswordHasher(rounds=4, workers=1, max_queue=2, timeout=0.05, directory=self.directory)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash(*args):
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=hasher._run, args=('hash', slow_hash))
+        thread.start()
+        started.wait(5)
+
+        # When
+        with self.assertRaises(HashingOverloaded):
+            hasher.hash('password')
+
+        # Then
+        release.set()
+        thread.join(5)
+        assert hasher.check('password', hasher.hash('password'))
+
+    def test_waits_for_whichever_hashing_slot_frees_first(self):
+        # Given
+        hasher = PasswordHasher(rounds=4, workers=2, max_queue=3, timeout=5, directory=self.directory)
+        started = [threading.Event(), threading.Event()]
+        release = [threading.Event(), threading.Event()]
+        threads = [threading.Thread(target=hasher._run, args=('hash', _wait, started[i], release[i])) for i in range(2)]
+        for i, thread in enumerate(threads):
+            thread.start()
+            started[i].wait(5)
+
+        # When
+        release[1].set()
+        hashed = hasher.hash('password')
+
+        # Then
+        assert threads[0].is_alive()
+        release[0].set()
+        threads[0].join(5)
+        assert hasher.check('password', hashed)
+
+    def test_queue_is_shared_with_other_processes(self):
+        # Given
+        context = multiprocessing.get_context('fork')
+        started = context.Event()
+        release = context.Event()
+        process = context.Process(target=self.hasher._run, args=('hash', _wait, started, release))
+        process.start()
+        started.wait(5)
+
+        # When
+        with self.assertRaises(HashingOverloaded):
+            self.hasher.hash('password')
+
+        # Then
+        release.set()
+        process.join(5)
+        assert self.hasher.check('password', self.hasher.hash('password'))
+
+
+def _wait(started, release):
+    started.set()
+    release.wait(5)
@@ -0,0 +1,69 @@
+import datetime
+import unittest
+
+from app.database import init_db, db_session
+from app.models import AccountHistory, EmailDelivery, Notification, NotificationClaim, NotificationCursor, \
+    Subscription, WebhookDelivery
+from app.prefetch import Prefetcher
+from fake_clock import FakeClock
+
+
+class TestPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        init_db()
+        for model in (WebhookDelivery, EmailDelivery, NotificationClaim, NotificationCursor, Notification,
+                      AccountHistory, Subscription):
+            db_session.query(model).delete()
+        db_session.commit()
+        self.now = datetime.datetime(2018, 1, 1)
+        self.timer = FakeClock()
+        self.latency = 0.5
+        self.failing = set()
+        self.batches = []
+        self.sleeps = []
+        self.prefetcher = Prefetcher(refresh=self.refresh, batch_size=2, recent=3600, node_share=0.25, max_delay=60,
+                                     clock=lambda: self.now, timer=self.timer, sleep=self.sleeps.append)
+
+    def tearDown(self):
+        db_session.remove()
+
+    def refresh(self, accounts, count):
+        self.batches.append(accounts)
+        self.timer.now += self.latency
+        return {account: [] for account in accounts if account not in self.failing}
+
+    def subscribe(self, *accounts):
+        for account in accounts:
+            db_session.add(Subscription(account=account, email='test@example.com'))
+        db_session.commit()
+
+    def test_recently_viewed_and_active_accounts_are_prefetched_first(self):
+        # Given
+        self.subscribe('xrb_a', 'xrb_b', 'xrb_c', 'xrb_d', 'xrb_e')
+        db_session.add(AccountHistory(account='xrb_c', viewed_at=self.now - datetime.timedelta(minutes=10)))
+        db_session.add(AccountHistory(account='xrb_e', viewed_at=self.now - datetime.timedelta(days=1)))
+        db_session.add(AccountHistory(account='xrb_unsubscribed', viewed_at=self.now))
+        db_session.add(Notification(account='xrb_d', hash='1', created_at=self.now - datetime.timedelta(minutes=1)))
+        db_session.commit()
+
+        # When
+        refreshed = self.prefetcher.run_once()
+
+        # Then
+        assert 5 == refreshed
+        assert [['xrb_d', 'xrb_c'], ['xrb_a', 'xrb_b'], ['xrb_e']] == self.batches
+
+    def test_pause_scales_with_node_latency_and_backs_off_on_failures(self):
+        # Given
+        self.subscribe('xrb_a', 'xrb_b')
+        self.prefetcher.run_once()
+        self.failing = {'xrb_b'}
+        self.latency = 2
+
+        # When
+        self.prefetcher.run_once()
+        self.prefetcher.run_once()
+
+        # Then
+        assert [1.5, 3, 6] == self.sleeps
@@ -0,0 +1,54 @@
+import os
+import unittest
+
+from app import process
+from app.process import PerProcess
+
+
+class TestPerProcess(unittest.TestCase):
+
+    def test_value_is_created_once_per_process(self):
+        # Given
+        value = PerProcess(object)
+
+        # When
+        first = value.get()
+
+        # Then
+        assert first is value.get()
+
+    def test_reset_closes_the_value_and_creates_another(self):
+        # Given
+        closed = []
+        value = PerProcess(object, close=closed.append)
+        first = value.get()
+
+        # When
+        process.reset()
+
+        # Then
+        assert [first] == closed
+        assert first is not value.get()
+
+    def test_forked_process_creates_its_own_value_without_closing_the_parents(self):
+        # Given
+        closed = []
+        value = PerProcess(object, close=closed.append)
+        parent = value.get()
+        read, write = os.pipe()
+
+        # When
+        pid = os.fork()
+        if pid == 0:
+            try:
+                process.reset()
+                os.write(write, b'1' if not closed and value.get() is not parent else b'0')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        # Then
+        assert b'1' == os.read(read, 1)
+        assert parent is value.get()
+        os.close(read)
+        os.close(write)
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from app.ratelimit import Limit, MemoryStore, SQLiteStore, RateLimiter, client_ip, retry_after
+from fake_clock import FakeClock
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(now=1000)
+        self.limiter = RateLimiter(MemoryStore(), {('test', 'ip'): Limit(2, 10), ('test', 'account'): Limit(3, 10)},
+                                   enabled=True, clock=self.clock)
+
+    def test_burst_is_allowed_then_limited(self):
+        # When
+        waits = [self.limiter.check('test', ip='10.0.0.1') for _ in range(3)]
+
+        # Then
+        assert [0, 0, 5] == waits
+        assert '5' == retry_after(waits[-1])
+
+    def test_bucket_refills_over_time(self):
+        # Given
+        self.limiter.check('test', ip='10.0.0.1')
+        self.limiter.check('test', ip='10.0.0.1')
+
+        # When
+        self.clock.now += 5
+        wait = self.limiter.check('test', ip='10.0.0.1')
+
+        # Then
+        assert 0 == wait
+
+    def test_cost_takes_several_tokens(self):
+        # When
+        waits = [self.limiter.check('test', ip='10.0.0.1', cost=5), self.limiter.check('test', ip='10.0.0.1')]
+
+        # Then
+        assert [0, 5] == waits
+
+    def test_account_is_limited_across_ips(self):
+        # Given
+        for i in range(3):
+            self.limiter.check('test', ip=f'10.0.0.{i}', account='account')
+
+        # When
+        wait = self.limiter.check('test', ip='10.0.0.9', account='account')
+
+        # Then
+        assert 0 < wait
+        assert 0 == self.limiter.check('test', ip='10.0.0.9', account='other')
+
+    def test_failing_store_allows_request(self):
+        # Given
+        class FailingStore:
+            def take(self, key, limit, now, cost=1):
+                raise OSError('store unavailable')
+        self.limiter.store = FailingStore()
+
+        # When
+        wait = self.limiter.check('test', ip='10.0.0.1')
+
+        # Then
+        assert 0 == wait
+
+    def test_sqlite_store_is_shared_between_stores(self):
+        # Given
+        path = os.path.join(tempfile.mkdtemp(), 'ratelimit.db')
+        first = RateLimiter(SQLiteStore(path), {('test', 'ip'): Limit(2, 10)}, enabled=True, clock=self.clock)
+        second = RateLimiter(SQLiteStore(path), {('test', 'ip'): Limit(2, 10)}, enabled=True, clock=self.clock)
+
+        # When
+        waits = [first.check('test', ip='10.0.0.1'), second.check('test', ip='10.0.0.1'),
+                 first.check('test', ip='10.0.0.1')]
+
+        # Then
+        assert [0, 0, 5] == waits
+
+    def test_client_ip_from_trusted_proxy(self):
+        # Then
+        assert '127.0.0.1' == client_ip('127.0.0.1', '10.0.0.1', trusted_proxies=0)
+        assert '10.0.0.1' == client_ip('127.0.0.1', '1.2.3.4, 10.0.0.1', trusted_proxies=1)
@@ -1,13 +1,23 @@
+import gzip
 import json
+import re
 import unittest
+from unittest import mock
 
 import requests_mock
 from requests import ConnectTimeout
 
 from app.database import init_db, db_session
-from app.models import Subscription
+from app.history import history_cache
+from app.ratelimit import limiter, Limit
+from app.node import reset_client
+from app.subscribers import subscribers_cache
+from app.users import user_cache
+from app.models import AccountHistory, Subscription, Transaction, User
+from app.passwords import hasher, PasswordHasher
 from run import app
 
+HASH = '89F14F380D84746B014323E78985FC1750D64C1345A9870AC4F749250AA6C82D'
 
 class TestRoutes(unittest.TestCase):
 
@@ -16,6 +26,14 @@ class TestRoutes(unittest.TestCase):
         self.app = app.test_client()
         with app.app_context():
             init_db()
+        for model in (Transaction, AccountHistory):
+            db_session.query(model).delete()
+        db_session.commit()
+        history_cache.clear()
+        reset_client()
+        subscribers_cache.clear()
+        user_cache.clear()
+        limiter.store.clear()
 
     def test_get_home(self):
         # When
@@ -25,6 +43,30 @@ class TestRoutes(unittest.TestCase):
         assert b'Sign Up' in resp.data
         assert b'Login' in resp.data
 
+    def test_static_assets_have_immutable_fingerprinted_urls(self):
+        # Given
+        page = self.app.get('/').data.decode()
+        url = re.search(r'href="(/static/css/main.css\?v=[0-9a-f]+)"', page).group(1)
+
+        # When
+        fingerprinted = self.app.get(url)
+        stale = self.app.get('/static/css/main.css?v=0')
+
+        # Then
+        assert 'immutable' in fingerprinted.headers['Cache-Control']
+        assert 'immutable' not in stale.headers.get('Cache-Control', '')
+        fingerprinted.close()
+        stale.close()
+
+    def test_robots_txt_is_cacheable(self):
+        # When
+        resp = self.app.get('/robots.txt')
+
+        # Then
+        assert 200 == resp.status_code
+        assert 'max-age=86400' in resp.headers['Cache-Control']
+        resp.close()
+
     def test_get_register(self):
         # When
         resp = self.app.get('/register')
@@ -86,6 +128,39 @@ class TestRoutes(unittest.TestCase):
         # Then
         assert b'Password must be more than 8 characters' in resp.data
 
+    @mock.patch('app.routes.RECAPTCHA_SECRET', 'secret')
+    def test_register_with_failed_recaptcha_verified_by_async_server(self):
+        # Given
+        data = {
+            'email': 'test@example.com',
+            'password': 'password'
+        }
+
+        # When
+        resp = self.app.post('/register', data=data, environ_overrides={'nanotify.recaptcha_verified': False})
+
+        # Then
+        assert b'Invalid reCAPTCHA' in resp.data
+
+    def test_register_is_rate_limited_per_ip(self):
+        # Given
+        limits = dict(limiter.limits)
+        limiter.limits[('register', 'ip')] = Limit(1, 3600)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        self.app.post('/register', data={'email': 'test_register_rate_limit@example.com', 'password': 'password'},
+                      environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+        # When
+        limited = self.app.post('/register', data={'email': 'other_rate_limit@example.com', 'password': 'password'},
+                                environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        other_ip = self.app.post('/register', data={'email': 'other_rate_limit@example.com', 'password': 'password'},
+                                 environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+        # Then
+        assert 429 == limited.status_code
+        assert '3600' == limited.headers['Retry-After']
+        assert 302 == other_ip.status_code
+
     def test_login(self):
         # Given
         data = {
@@ -114,6 +189,39 @@ class TestRoutes(unittest.TestCase):
         # Then
         assert 'http://localhost/subscribe' == resp.location
 
+    def test_login_rehashes_password_when_rounds_change(self):
+        # Given
+        data = {
+            'email': 'test_login_rehashes_password@example.com',
+            'password': 'password'
+        }
+        self.app.post('/register', data=data)
+
+        # When
+        with mock.patch.object(hasher, 'rounds', 5):
+            resp = self.app.post('/', data=data)
+
+        # Then
+        assert 'http://localhost/subscribe' == resp.location
+        user = db_session.query(User).filter(User.email == data['email']).first()
+        assert b'$2b$05$' == user.password[:7]
+
+    def test_login_sheds_load_when_hashing_is_overloaded(self):
+        # Given
+        data = {
+            'email': 'test@example.com',
+            'password': 'password'
+        }
+        self.app.post('/register', data=data)
+
+        # When
+        with mock.patch('app.routes.hasher', PasswordHasher(rounds=hasher.rounds, max_queue=0)):
+            resp = self.app.post('/', data=data)
+
+        # Then
+        assert 429 == resp.status_code
+        assert '1' == resp.headers['Retry-After']
+
     def test_login_wrong_password(self):
         # Given
         data = {
@@ -226,6 +334,99 @@ class TestRoutes(unittest.TestCase):
         # Then
         assert b'Add an account in the correct format' in resp.data
 
+    def test_subscriptions_are_paginated_by_account(self):
+        # Given
+        data = {'email': 'test_subscriptions_are_paginated@example.com', 'password': 'password'}
+        self.app.post('/register', data=data)
+        self.app.post('/', data=data)
+        accounts = [f'xrb_{i}niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh' for i in range(1, 4)]
+        for account in accounts:
+            db_session.add(Subscription(account=account, email=data['email']))
+        db_session.commit()
+
+        # When
+        first = json.loads(self.app.get('/subscriptions?limit=2').data)
+        second = json.loads(self.app.get(f'/subscriptions?limit=2&after={first["next"]}').data)
+
+        # Then
+        assert {'subscriptions': accounts[:2], 'next': accounts[1]} == first
+        assert {'subscriptions': accounts[2:], 'next': None} == second
+
+    def test_subscriptions_page_links_to_next_page(self):
+        # Given
+        data = {'email': 'test_subscriptions_page_links@example.com', 'password': 'password'}
+        self.app.post('/register', data=data)
+        self.app.post('/', data=data)
+        accounts = [f'xrb_{i}niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh' for i in range(1, 4)]
+        for account in accounts:
+            db_session.add(Subscription(account=account, email=data['email']))
+        db_session.commit()
+
+        # When
+        with mock.patch('app.routes.SUBSCRIPTIONS_PAGE_SIZE', 2):
+            first = self.app.get('/subscribe').data
+            second = self.app.get(f'/subscribe?after={accounts[1]}').data
+
+        # Then
+        assert accounts[1].encode() in first and accounts[2].encode() not in first
+        assert f'after={accounts[1]}'.encode() in first
+        assert accounts[2].encode() in second and accounts[1].encode() not in second
+        assert b'Welcome to Nanotify!' not in second
+
+    def test_search_subscriptions_by_prefix(self):
+        # Given
+        data = {'email': 'test_search_subscriptions@example.com', 'password': 'password'}
+        self.app.post('/register', data=data)
+        self.app.post('/', data=data)
+        for account in ('xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh',
+                        'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a',
+                        'xrbx1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'):
+            db_session.add(Subscription(account=account, email=data['email']))
+        db_session.commit()
+
+        # When
+        resp = self.app.get('/subscriptions?q=NANO_1')
+
+        # Then
+        assert ['xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'] == \
+            json.loads(resp.data)['subscriptions']
+
+    def test_delete_subscription(self):
+        # Given
+        data = {'email': 'test_delete_subscription@example.com', 'password': 'password'}
+        self.app.post('/register', data=data)
+        self.app.post('/', data=data)
+        account = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+        self.app.post('/subscribe', data={'account': account, 'action': 'subscribe'})
+        db_session.add(Subscription(account=account, email='other_delete_subscription@example.com'))
+        db_session.commit()
+
+        # When
+        resp = self.app.post('/subscribe', data={'account': account, 'action': 'delete'})
+
+        # Then
+        assert account.encode() not in resp.data
+        assert ['other_delete_subscription@example.com'] == \
+            [email for email, in db_session.query(Subscription.email).filter(Subscription.account == account)
+             .filter(Subscription.email.like('%delete_subscription%'))]
+
+    def test_mobile_subscribe_is_rate_limited_per_account(self):
+        # Given
+        limits = dict(limiter.limits)
+        limiter.limits[('subscribe', 'account')] = Limit(1, 60)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        account = {'account': 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq4rat'}
+        self.app.post('/mobile/subscribe', content_type='application/json', data=json.dumps(account),
+                      environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+        # When
+        resp = self.app.post('/mobile/subscribe', content_type='application/json', data=json.dumps(account),
+                             environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+        # Then
+        assert 429 == resp.status_code
+        assert '60' == resp.headers['Retry-After']
+
     def test_mobile_subscribe_to_invalid_format_account(self):
         # Given
         account = {'account': 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6z_my_account'}
@@ -246,6 +447,18 @@ class TestRoutes(unittest.TestCase):
         # Then
         assert 201 == resp.status_code
 
+    def test_mobile_subscribe_normalizes_nano_prefix(self):
+        # Given
+        account = {'account': 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqnano'}
+        self.app.post('/mobile/subscribe', content_type='application/json', data=json.dumps(account))
+
+        # When
+        resp = self.app.post('/mobile/subscribe', content_type='application/json',
+                             data=json.dumps({'account': account['account'].replace('xrb_', 'NANO_').upper()}))
+
+        # Then
+        assert 409 == resp.status_code
+
     def test_mobile_double_subscribe_to_account(self):
         # Given
         account = {'account': 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'}
@@ -257,6 +470,105 @@ class TestRoutes(unittest.TestCase):
         # Then
         assert 409 == resp.status_code
 
+    def test_import_and_export_subscriptions(self):
+        # Given
+        data = {
+            'email': 'test_import_subscriptions@example.com',
+            'password': 'password'
+        }
+        self.app.post('/register', data=data)
+        self.app.post('/', data=data)
+        accounts = ['xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqimpa',
+                    'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqimpb']
+        csv = 'account\n' + '\n'.join(accounts + accounts[:1] + ['xrb_invalid']) + '\n'
+
+        # When
+        resp = self.app.post('/subscribe/import', content_type='text/csv', data=csv)
+
+        # Then
+        assert {'imported': 2, 'duplicates': 1, 'invalid': 1} == json.loads(resp.data)
+        export = self.app.get('/subscribe/export?format=csv')
+        assert 'text/csv' in export.content_type
+        assert 'account\r\n' + '\r\n'.join(accounts) + '\r\n' == export.data.decode()
+
+    def test_mobile_import_subscriptions(self):
+        # Given
+        account = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqimpm'
+        lines = json.dumps({'account': account}) + '\n' + json.dumps({'account': account}) + '\n'
+
+        # When
+        resp = self.app.post('/mobile/subscribe/import', content_type='application/x-ndjson', data=lines)
+
+        # Then
+        assert 200 == resp.status_code
+        assert {'imported': 1, 'duplicates': 1, 'invalid': 0} == json.loads(resp.data)
+        resp = self.app.post('/mobile/subscribe', content_type='application/json', data=json.dumps({'account': account}))
+        assert 409 == resp.status_code
+
+    def test_mobile_import_subscriptions_is_rate_limited_per_ip(self):
+        # Given
+        limits = dict(limiter.limits)
+        limiter.limits[('import', 'ip')] = Limit(1, 3600)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        self.app.post('/mobile/subscribe/import', content_type='application/x-ndjson', data='')
+
+        # When
+        resp = self.app.post('/mobile/subscribe/import', content_type='application/x-ndjson', data='')
+
+        # Then
+        assert 429 == resp.status_code
+        assert '3600' == resp.headers['Retry-After']
+
+    def test_get_subscribers_for_accounts(self):
+        # Given
+        account = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq5sub'
+        self.app.post('/mobile/subscribe', content_type='application/json', data=json.dumps({'account': account}))
+
+        # When
+        resp = self.app.post('/internal/subscribers', content_type='application/json',
+                             data=json.dumps({'accounts': [account]}))
+
+        # Then
+        assert 200 == resp.status_code
+        assert {account: [{'email': None, 'webhook': None}]} == json.loads(resp.data)
+
+    @mock.patch('app.routes.INTERNAL_TOKEN', 'token')
+    def test_get_subscribers_requires_internal_token(self):
+        # When
+        resp = self.app.post('/internal/subscribers', content_type='application/json',
+                             data=json.dumps({'accounts': ['xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh']}))
+
+        # Then
+        assert 403 == resp.status_code
+
+    @mock.patch('app.routes.INTERNAL_TOKEN', 'token')
+    def test_get_subscribers_accepts_only_a_bearer_token(self):
+        # Given
+        body = json.dumps({'accounts': ['xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh']})
+
+        # When
+        bearer = self.app.post('/internal/subscribers', content_type='application/json', data=body,
+                               headers={'Authorization': 'Bearer token'})
+        other = self.app.post('/internal/subscribers', content_type='application/json', data=body,
+                              headers={'Authorization': 'Basic: token'})
+
+        # Then
+        assert 200 == bearer.status_code
+        assert 403 == other.status_code
+
+    @mock.patch('app.routes.INTERNAL_TOKEN', None)
+    def test_get_subscribers_without_internal_token_is_refused_outside_testing(self):
+        # Given
+        app.testing = False
+        account = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+
+        # When
+        resp = self.app.post('/internal/subscribers', content_type='application/json',
+                             data=json.dumps({'accounts': [account]}))
+
+        # Then
+        assert 403 == resp.status_code
+
     def test_get_settings_page(self):
         # Given
         data = {
@@ -304,6 +616,42 @@ class TestRoutes(unittest.TestCase):
         # Then
         assert b'http://mywebhook.com' in resp.data
 
+    def test_page_loads_use_cached_user_and_keep_session_cookie(self):
+        # Given
+        data = {
+            'email': 'test_page_loads_use_cached_user@example.com',
+            'password': 'password'
+        }
+        self.app.post('/register', data=data)
+        self.app.post('/', data=data)
+        self.app.get('/settings')
+
+        # When
+        resp = self.app.get('/settings')
+
+        # Then
+        assert 200 == resp.status_code
+        assert 'Set-Cookie' not in resp.headers
+        assert 1 == user_cache.misses
+        assert 1 == user_cache.hits
+
+    def test_save_webhook_invalidates_cached_user(self):
+        # Given
+        data = {
+            'email': 'test_save_webhook_invalidates_cached_user@example.com',
+            'password': 'password'
+        }
+        self.app.post('/register', data=data)
+        self.app.post('/', data=data)
+        self.app.get('/settings')
+
+        # When
+        self.app.post('/settings', data={'webhook': 'http://mywebhook.com'})
+
+        # Then
+        assert user_cache.get(data['email']) is None
+        assert b'http://mywebhook.com' in self.app.get('/settings').data
+
     def test_save_invalid_webhook_on_settings_page(self):
         # Given
         data = {
@@ -345,6 +693,97 @@ class TestRoutes(unittest.TestCase):
         assert history[0]['amount'] == "120568492000000000000000000000"
         assert history[0]['hash'] == "89F14F380D84746B014323E78985FC1750D64C1345A9870AC4F749250AA6C82D"
 
+    @requests_mock.mock()
+    def test_get_transaction_history_is_cached(self, mock_request):
+        # Given
+        data = {"history": [{"type": "send", "hash": "89F14F380D84746B014323E78985FC1750D64C1345A9870AC4F749250AA6C82D"}]}
+        mock_request.post('http://[::1]:7076', text=json.dumps(data))
+        self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a')
+
+        # When
+        resp = self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a')
+
+        # Then
+        assert 200 == resp.status_code
+        assert json.loads(resp.data)[0]['type'] == "send"
+        assert 1 == mock_request.call_count
+        stats = json.loads(self.app.get('/internal/stats/history').data)
+        assert 1 == stats['hits']
+        assert 1 == stats['misses']
+
+    @requests_mock.mock()
+    def test_metrics_include_request_db_and_node_timings(self, mock_request):
+        # Given
+        mock_request.post('http://[::1]:7076', text=json.dumps({'history': []}))
+        self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a')
+        self.app.post('/mobile/subscribe', content_type='application/json',
+                      data=json.dumps({'account': 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqmtrc'}))
+
+        # When
+        resp = self.app.get('/metrics')
+
+        # Then
+        assert 200 == resp.status_code
+        text = resp.data.decode()
+        assert 'nanotify_request_duration_seconds_count{endpoint="profile.get_transactions",method="GET",status="200"}' \
+            in text
+        assert 'nanotify_db_query_duration_seconds_count{endpoint="profile.mobile_subscribe"}' in text
+        assert 'nanotify_node_rpc_duration_seconds_count{action="account_history"}' in text
+        assert 'nanotify_history_cache_total{result="misses"}' in text
+
+    @requests_mock.mock()
+    def test_get_transaction_history_pages(self, mock_request):
+        # Given
+        chain = [{'type': 'receive', 'hash': f'{height:064X}'} for height in range(5, 0, -1)]
+
+        def history(request, context):
+            body = request.json()
+            start = [block['hash'] for block in chain].index(body['head']) if body.get('head') else 0
+            return json.dumps({'history': chain[start:start + body['count']]})
+        mock_request.post('http://[::1]:7076', text=history)
+        first = json.loads(self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+                                        '?count=2').data)
+
+        # When
+        resp = self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+                            f'?count=2&before={first[-1]["hash"]}')
+
+        # Then
+        assert 200 == resp.status_code
+        assert chain[:2] == first
+        assert chain[2:4] == json.loads(resp.data)
+
+    @requests_mock.mock()
+    def test_get_unchanged_transaction_history_is_not_modified(self, mock_request):
+        # Given
+        data = {"history": [{"type": "send", "hash": '89F14F380D84746B014323E78985FC1750D64C1345A9870AC4F749250AA6C82D'}]}
+        mock_request.post('http://[::1]:7076', text=json.dumps(data))
+        first = self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a')
+
+        # When
+        resp = self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a',
+                            headers={'If-None-Match': first.headers['ETag']})
+
+        # Then
+        assert 'W/"89F14F380D84746B014323E78985FC1750D64C1345A9870AC4F749250AA6C82D-10"' == first.headers['ETag']
+        assert 304 == resp.status_code
+        assert b'' == resp.data
+
+    @requests_mock.mock()
+    def test_get_transaction_history_is_compressed(self, mock_request):
+        # Given
+        data = {"history": [{"type": "send", "hash": f'{height:064X}'} for height in range(10)]}
+        mock_request.post('http://[::1]:7076', text=json.dumps(data))
+
+        # When
+        resp = self.app.get('/transactions/xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a',
+                            headers={'Accept-Encoding': 'gzip, deflate'})
+
+        # Then
+        assert 'gzip' == resp.headers['Content-Encoding']
+        assert 'Accept-Encoding' in resp.headers['Vary']
+        assert data['history'] == json.loads(gzip.decompress(resp.data))
+
     @requests_mock.mock()
     def test_get_transaction_history_raises_exception(self, mock_request):
         # Given
@@ -356,6 +795,90 @@ class TestRoutes(unittest.TestCase):
         # Then
         assert 500 == resp.status_code
 
+    def test_transaction_feed_is_not_served_by_wsgi_workers(self):
+        # Given
+        account = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+
+        # When
+        events = self.app.get(f'/transactions/{account}/events')
+        poll = self.app.get(f'/transactions/{account}/poll?head=0000')
+
+        # Then
+        assert 501 == events.status_code
+        assert 501 == poll.status_code
+
+    @requests_mock.mock()
+    def test_get_transaction_history_batch(self, mock_request):
+        # Given
+        accounts = ['xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a',
+                    'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh']
+
+        def history(request, context):
+            body = request.json()
+            return json.dumps({'history': [{'account': body['account'], 'count': body['count'],
+                                            'head': body.get('head')}]})
+        mock_request.post('http://[::1]:7076', text=history)
+
+        # When
+        resp = self.app.post('/transactions', content_type='application/json',
+                             data=json.dumps({'accounts': accounts + accounts[:1], 'count': 5,
+                                              'head': {accounts[1]: HASH}}))
+
+        # Then
+        assert 200 == resp.status_code
+        history = json.loads(resp.data)
+        assert set(accounts) == set(history)
+        assert [{'account': accounts[0], 'count': 5, 'head': None}] == history[accounts[0]]
+        assert [{'account': accounts[1], 'count': 5, 'head': HASH}] == history[accounts[1]]
+        assert 2 == mock_request.call_count
+
+    def test_get_transaction_history_batch_invalid_account(self):
+        # Given
+        accounts = ['xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a', 'nano_account']
+
+        # When
+        resp = self.app.post('/transactions', content_type='application/json', data=json.dumps({'accounts': accounts}))
+
+        # Then
+        assert 400 == resp.status_code
+        assert {'invalid': ['nano_account']} == json.loads(resp.data)
+
+    def test_transaction_history_batch_takes_a_token_per_account(self):
+        # Given
+        limits = dict(limiter.limits)
+        limiter.limits[('transactions', 'ip')] = Limit(3, 60)
+        self.addCleanup(lambda: setattr(limiter, 'limits', limits))
+        body = json.dumps({'accounts': ['nano_account', 'other_account']})
+        self.app.post('/transactions', content_type='application/json', data=body)
+
+        # When
+        resp = self.app.post('/transactions', content_type='application/json', data=body)
+
+        # Then
+        assert 429 == resp.status_code
+        assert '20' == resp.headers['Retry-After']
+
+    def test_get_transaction_history_batch_rejects_invalid_heads_and_counts(self):
+        # Given
+        account = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+        bodies = [{'accounts': [account], 'head': {account: ['x']}},
+                  {'accounts': [account], 'head': {account: HASH[:16]}},
+                  {'accounts': [account], 'count': True}]
+
+        # When
+        statuses = [self.app.post('/transactions', content_type='application/json', data=json.dumps(body)).status_code
+                    for body in bodies]
+
+        # Then
+        assert [400, 400, 400] == statuses
+
+    def test_get_transaction_history_batch_without_accounts(self):
+        # When
+        resp = self.app.post('/transactions', content_type='application/json', data=json.dumps({'count': 10}))
+
+        # Then
+        assert 400 == resp.status_code
+
     @requests_mock.mock()
     def test_get_transaction_history_invalid_account(self, mock_request):
         # Given
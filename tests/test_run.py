@@ -0,0 +1,26 @@
+import unittest
+
+from app import node
+from run import after_fork, create_app
+
+
+class TestRun(unittest.TestCase):
+
+    def test_create_app_overrides_config(self):
+        # When
+        app = create_app({'TESTING': True, 'TEMPLATES_AUTO_RELOAD': True})
+
+        # Then
+        assert app.testing
+        assert app.jinja_env.auto_reload
+        assert 200 == app.test_client().get('/robots.txt').status_code
+
+    def test_after_fork_opens_a_new_node_session(self):
+        # Given
+        client = node.get_client()
+
+        # When
+        after_fork()
+
+        # Then
+        assert client is not node.get_client()
@@ -0,0 +1,139 @@
+import unittest
+
+from app.database import init_db, db_session
+from app.models import Subscription, User
+from app.subscribers import subscribers_for, subscribers_cache, Subscriber, SubscribedAccounts, subscribed_accounts
+from app.users import webhook_cache
+
+ACCOUNT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqsubs'
+UNWATCHED_ACCOUNT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwqnone'
+
+
+class TestSubscribers(unittest.TestCase):
+
+    def setUp(self):
+        init_db()
+        subscribers_cache.clear()
+        subscribed_accounts.clear()
+        webhook_cache.clear()
+        db_session.query(Subscription).filter(Subscription.account.in_([ACCOUNT, UNWATCHED_ACCOUNT])).delete(
+            synchronize_session=False)
+        db_session.merge(User('subscriber@example.com', 'password', 'http://mywebhook.com'))
+        db_session.commit()
+
+    def tearDown(self):
+        db_session.remove()
+
+    def subscribe(self, email):
+        subscription = Subscription(account=ACCOUNT, email=email)
+        db_session.add(subscription)
+        db_session.commit()
+        return subscription
+
+    def test_subscribers_for_accounts(self):
+        # Given
+        self.subscribe('subscriber@example.com')
+
+        # When
+        subscribers = subscribers_for([ACCOUNT, UNWATCHED_ACCOUNT])
+
+        # Then
+        assert (Subscriber('subscriber@example.com', 'http://mywebhook.com'),) == subscribers[ACCOUNT]
+        assert () == subscribers[UNWATCHED_ACCOUNT]
+
+    def test_subscribers_are_cached(self):
+        # Given
+        subscribers_for([ACCOUNT, UNWATCHED_ACCOUNT])
+
+        # When
+        subscribers_for([ACCOUNT, UNWATCHED_ACCOUNT])
+
+        # Then
+        assert 2 == len(subscribers_cache)
+
+    def test_subscribe_invalidates_cache(self):
+        # Given
+        subscribers_for([ACCOUNT])
+
+        # When
+        self.subscribe('subscriber@example.com')
+
+        # Then
+        assert 1 == len(subscribers_for([ACCOUNT])[ACCOUNT])
+
+    def test_delete_invalidates_cache(self):
+        # Given
+        subscription = self.subscribe('subscriber@example.com')
+        subscribers_for([ACCOUNT])
+
+        # When
+        db_session.delete(subscription)
+        db_session.commit()
+
+        # Then
+        assert () == subscribers_for([ACCOUNT])[ACCOUNT]
+
+    def test_rollback_keeps_cache(self):
+        # Given
+        subscribers_for([ACCOUNT])
+
+        # When
+        db_session.add(Subscription(account=ACCOUNT, email='subscriber@example.com'))
+        db_session.flush()
+        db_session.rollback()
+
+        # Then
+        assert () == subscribers_cache.get(ACCOUNT)
+
+    def test_subscribed_accounts_include_new_subscriptions(self):
+        # Given
+        assert [] == subscribed_accounts.matching([ACCOUNT])
+
+        # When
+        self.subscribe('subscriber@example.com')
+
+        # Then
+        assert [ACCOUNT] == subscribed_accounts.matching([ACCOUNT, UNWATCHED_ACCOUNT])
+
+    def test_subscribed_accounts_reload_after_ttl(self):
+        # Given
+        now = [0]
+        accounts = SubscribedAccounts(ttl=60, clock=lambda: now[0])
+        subscription = self.subscribe('subscriber@example.com')
+        assert [ACCOUNT] == accounts.matching([ACCOUNT])
+        db_session.delete(subscription)
+        db_session.commit()
+
+        # When
+        before = accounts.matching([ACCOUNT])
+        now[0] = 60
+        after = accounts.matching([ACCOUNT])
+
+        # Then
+        assert [ACCOUNT] == before
+        assert [] == after
+
+    def test_changing_webhook_updates_every_subscription(self):
+        # Given
+        self.subscribe('subscriber@example.com')
+        subscribers_for([ACCOUNT])
+
+        # When
+        user = db_session.query(User).get('subscriber@example.com')
+        user.webhook = 'http://rotated.com'
+        db_session.commit()
+
+        # Then
+        assert (Subscriber('subscriber@example.com', 'http://rotated.com'),) == subscribers_for([ACCOUNT])[ACCOUNT]
+
+    def test_webhooks_are_cached(self):
+        # Given
+        self.subscribe('subscriber@example.com')
+        subscribers_for([ACCOUNT])
+
+        # When
+        db_session.query(User).filter(User.email == 'subscriber@example.com').update({'webhook': 'http://core.com'})
+        db_session.commit()
+
+        # Then
+        assert 'http://mywebhook.com' == subscribers_for([ACCOUNT])[ACCOUNT][0].webhook
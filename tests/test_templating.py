@@ -0,0 +1,64 @@
+import unittest
+
+from flask import render_template
+from jinja2 import DictLoader, Environment
+
+from app.templating import FragmentCacheExtension, compile_templates
+from run import app
+
+
+class TestTemplating(unittest.TestCase):
+
+    def setUp(self):
+        self.renders = 0
+        templates = {'page.html': "{% cache 'fragment' %}{{ count() }}{% endcache %}"}
+        self.environment = Environment(loader=DictLoader(templates), extensions=[FragmentCacheExtension],
+                                       auto_reload=False)
+        self.environment.globals['count'] = self.count
+
+    def count(self):
+        self.renders += 1
+        return self.renders
+
+    def test_fragment_is_rendered_once(self):
+        # Given
+        template = self.environment.get_template('page.html')
+
+        # When
+        pages = [template.render(), template.render()]
+
+        # Then
+        assert ['1', '1'] == pages
+        assert 1 == self.renders
+
+    def test_fragment_is_not_cached_when_templates_auto_reload(self):
+        # Given
+        self.environment.auto_reload = True
+        template = self.environment.get_template('page.html')
+
+        # When
+        pages = [template.render(), template.render()]
+
+        # Then
+        assert ['1', '2'] == pages
+
+    def test_static_urls_in_the_layout_follow_the_request(self):
+        # Given
+        def render(script_root):
+            with app.test_request_context(base_url=f'http://localhost{script_root}/'):
+                return render_template('layouts/base.html')
+
+        # When
+        pages = [render(''), render('/nanotify')]
+
+        # Then
+        assert 'href="/static/favicon.ico"' in pages[0]
+        assert 'href="/nanotify/static/favicon.ico"' in pages[1]
+        assert 'href="/nanotify/static/css/main.css' in pages[1]
+
+    def test_compile_templates(self):
+        # When
+        names = compile_templates(app)
+
+        # Then
+        assert {'layouts/base.html', 'subscribe.html', 'settings.html', 'email/digest.txt'} <= set(names)
@@ -0,0 +1,178 @@
+import datetime
+import unittest
+
+from app import transactions
+from app.database import init_db, db_session
+from app.models import AccountHistory, Subscription, Transaction
+
+ACCOUNT = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+
+
+class FakeNode:
+    """An account chain served the way the node's account_history is, newest first from ``head`` inclusive."""
+
+    def __init__(self, length):
+        self.chain = [self.block(i) for i in range(length)]
+        self.requests = []
+
+    @staticmethod
+    def block(height):
+        return {'type': 'receive', 'account': ACCOUNT, 'amount': '1', 'hash': f'{height:064X}'}
+
+    def extend(self, count):
+        self.chain += [self.block(len(self.chain) + i) for i in range(count)]
+
+    def account_history(self, account, count=10, head=None):
+        self.requests.append((count, head))
+        newest_first = list(reversed(self.chain))
+        start = [block['hash'] for block in newest_first].index(head) if head else 0
+        return newest_first[start:start + count]
+
+
+class TestTransactions(unittest.TestCase):
+
+    def setUp(self):
+        init_db()
+        for model in (Transaction, AccountHistory, Subscription):
+            db_session.query(model).delete()
+        db_session.commit()
+        db_session.remove()
+        self.node = FakeNode(25)
+
+    def history(self, count=10, head=None):
+        return transactions.history(ACCOUNT, count, head, fetch=self.node.account_history)
+
+    def hashes(self, *heights):
+        return [FakeNode.block(height)['hash'] for height in heights]
+
+    def test_first_view_fetches_the_requested_blocks(self):
+        # When
+        history = self.history()
+
+        # Then
+        assert self.hashes(*range(24, 14, -1)) == [block['hash'] for block in history]
+        assert [(10, None)] == self.node.requests
+
+    def test_unchanged_account_only_checks_its_newest_block(self):
+        # Given
+        self.history()
+
+        # When
+        history = self.history()
+
+        # Then
+        assert self.hashes(*range(24, 14, -1)) == [block['hash'] for block in history]
+        assert [(10, None), (1, None)] == self.node.requests
+
+    def test_recently_synced_account_is_served_without_asking_the_node(self):
+        # Given
+        self.history()
+        self.node.extend(1)
+
+        # When
+        history = transactions.history(ACCOUNT, fetch=self.node.account_history, max_age=60)
+
+        # Then
+        assert self.hashes(*range(24, 14, -1)) == [block['hash'] for block in history]
+        assert [(10, None)] == self.node.requests
+
+    def test_view_is_recorded_once(self):
+        # Given
+        transactions._recent_views.clear()
+        self.history()
+
+        # When
+        transactions.mark_viewed(ACCOUNT)
+        viewed_at = db_session.query(AccountHistory.viewed_at).scalar()
+        transactions.mark_viewed(ACCOUNT)
+
+        # Then
+        assert viewed_at is not None
+        assert viewed_at == db_session.query(AccountHistory.viewed_at).scalar()
+
+    def test_only_new_blocks_are_fetched(self):
+        # Given
+        self.history()
+        self.node.extend(3)
+        self.node.requests.clear()
+
+        # When
+        history = self.history()
+
+        # Then
+        assert self.hashes(*range(27, 17, -1)) == [block['hash'] for block in history]
+        assert [(1, None), (101, self.hashes(27)[0])] == self.node.requests
+
+    def test_older_pages_are_fetched_once_then_served_locally(self):
+        # Given
+        self.history()
+        self.history(10, self.hashes(15)[0])
+        self.node.requests.clear()
+
+        # When
+        history = self.history(10, self.hashes(10)[0])
+
+        # Then
+        assert self.hashes(*range(10, 0, -1)) == [block['hash'] for block in history]
+        assert [] == self.node.requests
+
+    def test_history_is_complete_at_the_open_block(self):
+        # Given
+        self.history()
+        self.history(20, self.hashes(15)[0])
+        self.node.requests.clear()
+
+        # When
+        history = self.history(10, self.hashes(3)[0])
+
+        # Then
+        assert self.hashes(3, 2, 1, 0) == [block['hash'] for block in history]
+        assert [] == self.node.requests
+
+    def test_store_is_reset_when_the_stored_head_leaves_the_chain(self):
+        # Given
+        self.history()
+        self.node.chain = [dict(block, hash=f'F{block["hash"][1:]}') for block in self.node.chain[:5]]
+
+        # When
+        history = self.history()
+
+        # Then
+        assert [block['hash'] for block in reversed(self.node.chain)] == [block['hash'] for block in history]
+        assert 5 == db_session.query(Transaction).filter(Transaction.account == ACCOUNT).count()
+
+    def test_blocks_fetched_by_two_syncs_at_once_are_stored_once(self):
+        # Given
+        self.history()
+        self.node.extend(1)
+        fetch = self.node.account_history
+
+        def racing_fetch(account, count=10, head=None):
+            # Another worker syncs the same account while this one is asking the node for the new block
+            self.node.account_history = fetch
+            transactions.history(ACCOUNT, fetch=fetch)
+            return fetch(account, count, head)
+        self.node.account_history = racing_fetch
+
+        # When
+        history = self.history()
+
+        # Then
+        assert self.hashes(*range(25, 15, -1)) == [block['hash'] for block in history]
+        assert 11 == db_session.query(Transaction).count()
+
+    def test_evict_drops_idle_unsubscribed_accounts(self):
+        # Given
+        subscribed = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+        self.history()
+        transactions.history(subscribed, fetch=self.node.account_history)
+        db_session.add(Subscription(subscribed))
+        db_session.commit()
+
+        # When
+        evicted = transactions.evict(idle=60, now=datetime.datetime.utcnow() + datetime.timedelta(seconds=61))
+
+        # Then
+        assert 1 == evicted
+        assert [(subscribed,)] == db_session.query(AccountHistory.account).all()
+        assert {subscribed} == {account for account, in db_session.query(Transaction.account)}
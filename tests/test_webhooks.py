@@ -0,0 +1,247 @@
+import datetime
+import json
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from unittest import mock
+from urllib.parse import urlsplit
+
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from app.database import init_db, db_session
+from app.models import Notification, NotificationClaim, NotificationCursor, Subscription, User, WebhookDelivery
+from app.subscribers import subscribers_cache
+from app.users import webhook_cache
+from app.webhooks import RefusedDestination, WebhookDeliverer, backoff, check_destination
+
+ACCOUNT = 'xrb_3txm99yb6yq1t56iznzthbmjy9wntg61itxusqkhiixh4fz38i7rhsmyjt7a'
+OTHER_ACCOUNT = 'xrb_1niabkx3gbxit5j5yyqcpas71dkffggbr6zpd3heui8rpoocm5xqbdwq44oh'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubWebhook:
+    """Customer webhook endpoint answering every POST with ``status``, once ``gate`` is set if it is given."""
+
+    def __init__(self, status=200, gate=None):
+        self.status = status
+        self.gate = gate
+        self.received = []
+        self.requests = []
+        self.connections = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                stub.connections.add(self.client_address)
+                stub.received.append(body)
+                if stub.gate:
+                    stub.gate.wait()
+                stub.requests.append(body)
+                self.send_response(stub.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/hook'
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TestWebhooks(unittest.TestCase):
+
+    def setUp(self):
+        init_db()
+        for model in (WebhookDelivery, NotificationClaim, NotificationCursor, Notification):
+            db_session.query(model).delete()
+        db_session.query(Subscription).filter(Subscription.account.in_([ACCOUNT, OTHER_ACCOUNT])).delete(
+            synchronize_session=False)
+        db_session.commit()
+        subscribers_cache.clear()
+        webhook_cache.clear()
+        self.webhooks = []
+        self.deliverer = WebhookDeliverer(backoff=lambda attempts: 60, allow_private=True)
+
+    def tearDown(self):
+        self.deliverer.close()
+        for webhook in self.webhooks:
+            webhook.stop()
+        db_session.remove()
+
+    def webhook(self, **kwargs):
+        webhook = StubWebhook(**kwargs)
+        self.webhooks.append(webhook)
+        return webhook
+
+    def notify(self, account, webhooks, count=1):
+        for webhook in set(webhooks):
+            url = getattr(webhook, 'url', webhook)
+            email = f'{urlsplit(url).port}{urlsplit(url).path.replace("/", ".")}@example.com'
+            db_session.merge(User(email, 'password', url))
+            db_session.add(Subscription(account=account, email=email))
+        for i in range(count):
+            db_session.add(Notification(account=account, hash=f'{account[-4:]}{i:060X}', amount='1', block='{}'))
+        db_session.commit()
+
+    def deliveries(self):
+        db_session.remove()
+        return db_session.query(WebhookDelivery.url, WebhookDelivery.status, WebhookDelivery.attempts).all()
+
+    def test_delivers_notification_to_each_webhook(self):
+        # Given
+        first, second = self.webhook(), self.webhook()
+        self.notify(ACCOUNT, [first, second, first])
+
+        # When
+        wait(self.deliverer.run_once())
+
+        # Then
+        assert sorted([(first.url, 'delivered', 1), (second.url, 'delivered', 1)]) == sorted(self.deliveries())
+        assert [{'account': ACCOUNT, 'hash': f'{ACCOUNT[-4:]}{0:060X}', 'amount': '1', 'block': '{}'}] == \
+            first.requests
+
+    def test_notifications_are_only_expanded_once(self):
+        # Given
+        webhook = self.webhook()
+        self.notify(ACCOUNT, [webhook])
+
+        # When
+        wait(self.deliverer.run_once())
+        wait(self.deliverer.run_once())
+
+        # Then
+        assert 1 == len(webhook.requests)
+        assert 1 == len(self.deliveries())
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        # Given
+        webhook = self.webhook(status=500)
+        self.notify(ACCOUNT, [webhook])
+
+        # When
+        wait(self.deliverer.run_once())
+        retried = self.deliverer.run_once()
+
+        # Then
+        assert [] == retried
+        assert [(webhook.url, 'pending', 1)] == self.deliveries()
+        next_attempt_at = db_session.query(WebhookDelivery.next_attempt_at).scalar()
+        assert next_attempt_at > datetime.datetime.utcnow() + datetime.timedelta(seconds=50)
+
+    def test_delivery_fails_after_max_attempts(self):
+        # Given
+        webhook = self.webhook(status=500)
+        self.notify(ACCOUNT, [webhook])
+        deliverer = WebhookDeliverer(max_attempts=2, backoff=lambda attempts: 0, allow_private=True)
+
+        # When
+        wait(deliverer.run_once())
+        wait(deliverer.run_once())
+        deliverer.close()
+
+        # Then
+        assert [(webhook.url, 'failed', 2)] == self.deliveries()
+
+    def test_private_destination_is_refused(self):
+        # Given
+        webhook = self.webhook()
+        self.notify(ACCOUNT, [webhook])
+        deliverer = WebhookDeliverer()
+
+        # When
+        wait(deliverer.run_once())
+        deliverer.close()
+
+        # Then
+        assert [] == webhook.requests
+        assert [(webhook.url, 'failed', 1)] == self.deliveries()
+
+    def test_private_address_connected_to_after_a_public_lookup_is_refused(self):
+        # Given
+        webhook = self.webhook()
+        self.notify(ACCOUNT, [webhook])
+        deliverer = WebhookDeliverer()
+
+        # When
+        # The lookup made by the check passes but the connection reaches a loopback address, as after DNS rebinding
+        with mock.patch('app.webhooks.check_destination'):
+            wait(deliverer.run_once())
+        deliverer.close()
+
+        # Then
+        assert [] == webhook.received
+        assert [(webhook.url, 'failed', 1)] == self.deliveries()
+
+    def test_destination_must_resolve_to_public_addresses(self):
+        # Given
+        def resolver(*addresses):
+            return lambda host, port, **kwargs: [(None, None, None, '', (address, port)) for address in addresses]
+
+        # Then
+        check_destination('https://example.com/hook', resolve=resolver('93.184.216.34'))
+        for url, addresses in [('http://example.com/hook', ['93.184.216.34', '10.0.0.1']),
+                               ('http://example.com/hook', ['169.254.169.254']),
+                               ('http://example.com/hook', ['::1']),
+                               ('http://example.com/hook', ['fe80::1%eth0']),
+                               ('ftp://example.com/hook', ['93.184.216.34'])]:
+            with self.assertRaises(RefusedDestination):
+                check_destination(url, resolve=resolver(*addresses))
+
+    def test_slow_host_does_not_stall_other_hosts(self):
+        # Given
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        slow, fast = self.webhook(gate=gate), self.webhook()
+        # One customer's host with a webhook per path, all of which are slow
+        self.notify(ACCOUNT, [f'{slow.url}/{i}' for i in range(20)])
+        self.notify(OTHER_ACCOUNT, [fast], count=10)
+        deliverer = WebhookDeliverer(host_concurrency=2, batch_size=10, timeout=(2, 30), allow_private=True)
+        queries = []
+        due = deliverer._due
+        deliverer._due = lambda busy: queries.append(busy) or due(busy)
+        # The in-memory database is one connection, so deliveries mustn't record their results mid dispatch
+        database = threading.Lock()
+        record = deliverer._record
+
+        def _record(row, error):
+            with database:
+                record(row, error)
+        deliverer._record = _record
+
+        def run_once():
+            with database:
+                return deliverer.run_once()
+
+        # When
+        futures = run_once()
+        dispatches = 1
+        while len(fast.requests) < 10 and dispatches < 50:
+            wait([future for future in futures if not future.done()], timeout=1, return_when=FIRST_COMPLETED)
+            futures += run_once()
+            dispatches += 1
+        gate.set()
+        wait(futures)
+        deliverer.close()
+
+        # Then
+        assert 10 == len(fast.requests)
+        assert 2 == len(slow.received)
+        assert len(queries) <= 3 * dispatches
+        assert len(fast.connections) <= 2
+
+    def test_backoff_is_jittered_and_capped(self):
+        assert 0 == backoff(3, base=1, cap=10, rand=lambda: 0)
+        assert 8 == backoff(3, base=1, cap=10, rand=lambda: 1)
+        assert 10 == backoff(10, base=1, cap=10, rand=lambda: 1)